@@ -8,7 +8,10 @@ from django.db.models import QuerySet, Sum
 from django.db import transaction
 from django import forms
 
+from django.contrib import messages
+from django.http import HttpResponse
 from django.urls import reverse, path
+from django.utils import timezone
 from django.utils.html import format_html
 from django.template.response import TemplateResponse
 
@@ -20,6 +23,10 @@ from djangopwa.forms.ticket_forms import TicketAssignmentForm
 from djangopwa.forms.lottery_forms import LotteryCreateForm
 from djangopwa.forms.user import PaymentContactForm
 from djangopwa.utils.complex_filter import build_complex_filter
+from djangopwa.ticket_assignment import build_intervals_filter, get_seller_intervals
+from djangopwa.lottery_counters import add_lottery_tickets
+from djangopwa.seller_settlement import settle_sellers, write_settlement_summary
+from djangopwa.purchase_verification import decline_clients, verify_clients
 
 from datetime import datetime, timedelta
 
@@ -48,7 +55,12 @@ class LotteryAdminModel(admin.ModelAdmin):
         "lottery_date_3",
         "lottery_date_4",
         "price_per_ticket",
+        "available_tickets",
+        "reserved_tickets",
+        "purchased_tickets",
+        "money_raised",
     )
+    list_select_related = ("counters",)
     search_fields = ("name",)
     list_filter = (
         "lottery_date_1",
@@ -75,6 +87,34 @@ class LotteryAdminModel(admin.ModelAdmin):
         ),
     )
 
+    def get_counter(self, obj: models.Lottery, field_name):
+        """
+        Reads a counter of the lottery from its counters row, joined in the
+        changelist query, so no ticket is counted.
+        """
+        counters = getattr(obj, "counters", None)
+        return getattr(counters, field_name, 0)
+
+    def available_tickets(self, obj: models.Lottery):
+        return self.get_counter(obj, "available_tickets")
+
+    available_tickets.short_description = "Disponibles"
+
+    def reserved_tickets(self, obj: models.Lottery):
+        return self.get_counter(obj, "reserved_tickets")
+
+    reserved_tickets.short_description = "Reservadas"
+
+    def purchased_tickets(self, obj: models.Lottery):
+        return self.get_counter(obj, "purchased_tickets")
+
+    purchased_tickets.short_description = "Compradas"
+
+    def money_raised(self, obj: models.Lottery):
+        return "{:,.0f}".format(self.get_counter(obj, "money_raised")).replace(",", ".")
+
+    money_raised.short_description = "Dinero recaudado"
+
     def create_tickets_in_range(self, lottery, start_number, end_number):
         """
         Create tickets in the specified range for the given lottery.
@@ -88,7 +128,9 @@ class LotteryAdminModel(admin.ModelAdmin):
             models.Ticket(lottery=lottery, number=number)
             for number in range(start_number, end_number + 1)
         ]
-        models.Ticket.objects.bulk_create(tickets)
+        with transaction.atomic():
+            models.Ticket.objects.bulk_create(tickets)
+            add_lottery_tickets(tickets)
 
     def save_model(self, request: Any, obj: Any, form: Any, change: Any) -> None:
         """
@@ -439,31 +481,6 @@ class ClientAdmin(admin.ModelAdmin):
 
         return form
 
-    def get_seller_ticket_assignments(self, current_user, initial_lottery_to_buy):
-        return models.TicketAssignment.objects.filter(
-            assigned_to=current_user, lottery=initial_lottery_to_buy
-        )
-
-    def get_ticket_number_ranges(self, seller_ticket_assignments):
-        ticket_number_ranges = []
-        for assignment in seller_ticket_assignments:
-            if assignment.start_number is not None and assignment.end_number is not None:
-                ticket_number_ranges.extend(range(
-                    assignment.start_number,
-                    assignment.end_number + 1,
-                ))
-        return ticket_number_ranges
-
-    def get_individual_ticket_numbers(self, seller_ticket_assignments):
-        individual_ticket_numbers = []
-        for assignment in seller_ticket_assignments:
-            individual_ticket_numbers.extend(
-                list(assignment.individual_tickets.values_list('number', flat=True)))
-        return individual_ticket_numbers
-
-    def combine_ticket_numbers(self, ticket_number_ranges, individual_ticket_numbers):
-        return set(ticket_number_ranges) | set(individual_ticket_numbers)
-
     def filter_ticket_numbers_by_assignment(
         self,
         form,
@@ -486,14 +503,13 @@ class ClientAdmin(admin.ModelAdmin):
         ticket_numbers = models.Ticket.objects.none()
 
         if lottery_to_buy and current_user:
-            seller_ticket_assignments = self.get_seller_ticket_assignments(
-                current_user=current_user, initial_lottery_to_buy=lottery_to_buy
+            seller_intervals = (
+                []
+                if current_user.is_superuser
+                else get_seller_intervals(current_user.id, lottery_to_buy)
             )
 
-            if not current_user.is_superuser and (
-                not seller_ticket_assignments or len(
-                    seller_ticket_assignments) <= 0
-            ):
+            if not current_user.is_superuser and not seller_intervals:
                 form.base_fields["ticket"].queryset = ticket_numbers
                 return
 
@@ -520,19 +536,15 @@ class ClientAdmin(admin.ModelAdmin):
                 extra_ticket_conditions_info_purchased,
             ]
 
+            available_filter = build_complex_filter(
+                ticket_numbers_conditions[:1])
+
             # add filter by ticket ranges if user is a seller
             if not current_user.is_superuser:
-                ticket_number_ranges = self.get_ticket_number_ranges(
-                    seller_ticket_assignments)
-                individual_ticket_numbers = self.get_individual_ticket_numbers(
-                    seller_ticket_assignments)
-                all_ticket_numbers = self.combine_ticket_numbers(
-                    ticket_number_ranges, individual_ticket_numbers)
+                available_filter &= build_intervals_filter(seller_intervals)
 
-                ticket_numbers_conditions[0]["number__in"] = all_ticket_numbers
-
-            ticket_numbers_complex_filter = build_complex_filter(
-                ticket_numbers_conditions
+            ticket_numbers_complex_filter = available_filter | build_complex_filter(
+                ticket_numbers_conditions[1:]
             )
 
             ticket_numbers = models.Ticket.objects.filter(
@@ -843,6 +855,8 @@ class CustomUserAdmin(UserAdmin):
 
     inlines = [ClientInfoInline]
 
+    actions = ["settle_outstanding_payments"]
+
     def get_urls(self):
         """
         Returns additional URL patterns for the admin interface.
@@ -955,6 +969,39 @@ class CustomUserAdmin(UserAdmin):
     delete_button.short_description = ""
     delete_button.allow_tags = True
 
+    @admin.action(description="Cobrar abonos pendientes")
+    def settle_outstanding_payments(self, request, queryset):
+        """
+        Bills the outstanding payments of the selected sellers in one run
+        and downloads the summary of the bills.
+
+        Args:
+            request (HttpRequest): The request object.
+            queryset (QuerySet): The selected sellers.
+
+        Returns:
+            HttpResponse: The CSV summary, None when nothing was billed.
+        """
+        generation_date = timezone.now()
+        settlements = settle_sellers(
+            list(queryset.values_list("id", flat=True)), generation_date
+        )
+        if not settlements:
+            self.message_user(
+                request,
+                "Los vendedores seleccionados no tienen abonos pendientes.",
+                messages.WARNING,
+            )
+            return None
+
+        file_name = (
+            f"seller_settlement_{timezone.localtime(generation_date):%Y%m%d_%H%M%S}.csv"
+        )
+        response = HttpResponse(content_type="text/csv")
+        response["Content-Disposition"] = f'attachment; filename="{file_name}"'
+        write_settlement_summary(settlements, response)
+        return response
+
     def get_inline_instances(self, request, obj=None):
         """
         Returns inline instances based on the request and object.
@@ -1140,6 +1187,10 @@ class BaseAdminTable(admin.ModelAdmin):
     list_display = ("ticket_number", "client_name_lastname", "client_document_number",
                     "client_telephone", "client_city", "client_seller", "client_payments", "payment_balance", "amount_to_pay", "bills_button", "verify_purchase", "client_whatsapp", "ticket_png", "edit_button")
 
+    # Every column reads these relations and the client stored payment
+    # totals, so a page costs the same queries whatever its size
+    list_select_related = ("client__ticket_number", "ticket__lottery")
+
     def ticket_number(self, obj):
         return f"{obj.client.ticket_number.number:04}" if obj.client.ticket_number else ""
 
@@ -1171,7 +1222,7 @@ class BaseAdminTable(admin.ModelAdmin):
     client_city.allow_tags = True
 
     def client_seller(self, obj):
-        return obj.client.seller.id
+        return obj.client.seller_id
 
     client_seller.short_description = "Vendedor"
     client_seller.allow_tags = True
@@ -1184,24 +1235,15 @@ class BaseAdminTable(admin.ModelAdmin):
     client_payments.short_description = "Abonos"
     client_payments.allow_tags = True
 
-    def calculate_client_balance(self, obj):
-        payments = models.Payment.objects.filter(client=obj.client)
-
-        payment_balance = 0
-
-        for payment in payments:
-            payment_balance += payment.amount
-        return payment_balance
-
     def payment_balance(self, obj):
-        payment_balance = self.calculate_client_balance(obj)
+        payment_balance = obj.client.paid_total
         return f"${payment_balance:,.0f}".replace(",", ".")
 
     payment_balance.short_description = "Abonado"
     payment_balance.allow_tags = True
 
     def amount_to_pay(self, obj: models.TicketPendingPurchase):
-        payment_balance = self.calculate_client_balance(obj)
+        payment_balance = obj.client.paid_total
         price_ticket = obj.ticket.lottery.price_per_ticket
         total_to_pay = price_ticket - payment_balance
         return f"${total_to_pay:,.0f}".replace(",", ".")
@@ -1330,12 +1372,47 @@ class BaseAdminTable(admin.ModelAdmin):
     def has_add_permission(self, request):
         return False
 
+    actions = ["verify_selected_purchases", "decline_selected_tickets"]
+
     def get_actions(self, request):
         actions = super().get_actions(request)
         if 'delete_selected' in actions:
             del actions['delete_selected']
         return actions
 
+    def report_purchase_result(self, request, result, verb):
+        if result.processed:
+            self.message_user(
+                request, f"{len(result.processed)} boletas {verb}.", messages.SUCCESS
+            )
+        if result.not_found:
+            self.message_user(
+                request,
+                f"{len(result.not_found)} clientes no encontrados.",
+                messages.WARNING,
+            )
+
+    def filter_own_rows(self, request, queryset):
+        """
+        Keep the rows a user may act on: all of them for a superuser, only
+        the ones of its own clients for a seller.
+        """
+        if request.user.is_superuser:
+            return queryset
+        return queryset.filter(client__seller=request.user)
+
+    @admin.action(description="Aprobar las boletas seleccionadas")
+    def verify_selected_purchases(self, request, queryset):
+        queryset = self.filter_own_rows(request, queryset)
+        result = verify_clients(queryset.values_list("client_id", flat=True))
+        self.report_purchase_result(request, result, "aprobadas")
+
+    @admin.action(description="Declinar las boletas seleccionadas")
+    def decline_selected_tickets(self, request, queryset):
+        queryset = self.filter_own_rows(request, queryset)
+        result = decline_clients(queryset.values_list("client_id", flat=True))
+        self.report_purchase_result(request, result, "declinadas")
+
     def get_queryset(self, request):
         """
         Method to filter the queryset based on the authenticated user.
@@ -1410,31 +1487,6 @@ class TicketReservedAdmin(BaseAdminTable):
 
         return form
 
-    def get_seller_ticket_assignments(self, current_user, initial_lottery_to_buy):
-        return models.TicketAssignment.objects.filter(
-            assigned_to=current_user, lottery=initial_lottery_to_buy
-        )
-
-    def get_ticket_number_ranges(self, seller_ticket_assignments):
-        ticket_number_ranges = []
-        for assignment in seller_ticket_assignments:
-            if assignment.start_number is not None and assignment.end_number is not None:
-                ticket_number_ranges.extend(range(
-                    assignment.start_number,
-                    assignment.end_number + 1,
-                ))
-        return ticket_number_ranges
-
-    def get_individual_ticket_numbers(self, seller_ticket_assignments):
-        individual_ticket_numbers = []
-        for assignment in seller_ticket_assignments:
-            individual_ticket_numbers.extend(
-                list(assignment.individual_tickets.values_list('number', flat=True)))
-        return individual_ticket_numbers
-
-    def combine_ticket_numbers(self, ticket_number_ranges, individual_ticket_numbers):
-        return set(ticket_number_ranges) | set(individual_ticket_numbers)
-
     def filter_ticket_numbers_by_assignment(
         self,
         form,
@@ -1457,14 +1509,13 @@ class TicketReservedAdmin(BaseAdminTable):
         ticket_numbers = models.Ticket.objects.none()
 
         if lottery_to_buy and current_user:
-            seller_ticket_assignments = self.get_seller_ticket_assignments(
-                current_user=current_user, initial_lottery_to_buy=lottery_to_buy
+            seller_intervals = (
+                []
+                if current_user.is_superuser
+                else get_seller_intervals(current_user.id, lottery_to_buy)
             )
 
-            if not current_user.is_superuser and (
-                not seller_ticket_assignments or len(
-                    seller_ticket_assignments) <= 0
-            ):
+            if not current_user.is_superuser and not seller_intervals:
                 form.base_fields["ticket"].queryset = ticket_numbers
                 return
 
@@ -1491,19 +1542,15 @@ class TicketReservedAdmin(BaseAdminTable):
                 extra_ticket_conditions_info_purchased,
             ]
 
+            available_filter = build_complex_filter(
+                ticket_numbers_conditions[:1])
+
             # add filter by ticket ranges if user is a seller
             if not current_user.is_superuser:
-                ticket_number_ranges = self.get_ticket_number_ranges(
-                    seller_ticket_assignments)
-                individual_ticket_numbers = self.get_individual_ticket_numbers(
-                    seller_ticket_assignments)
-                all_ticket_numbers = self.combine_ticket_numbers(
-                    ticket_number_ranges, individual_ticket_numbers)
-
-                ticket_numbers_conditions[0]["number__in"] = all_ticket_numbers
+                available_filter &= build_intervals_filter(seller_intervals)
 
-            ticket_numbers_complex_filter = build_complex_filter(
-                ticket_numbers_conditions
+            ticket_numbers_complex_filter = available_filter | build_complex_filter(
+                ticket_numbers_conditions[1:]
             )
 
             ticket_numbers = models.Ticket.objects.filter(
@@ -1516,6 +1563,8 @@ class TicketReservedAdmin(BaseAdminTable):
 
 @admin.register(models.TicketPurchased)
 class TicketPurchasedAdmin(BaseAdminTable):
+    actions = []
+
     def get_list_display(self, request):
         # Get the default list display from the base class
         list_display = super().get_list_display(request)
@@ -1526,7 +1575,9 @@ class TicketPurchasedAdmin(BaseAdminTable):
 @admin.register(models.TicketWithPayment)
 class TicketWithPaymentAdmin(BaseAdminTable):
     """Admin view filtered by clients with existing payments."""
-    
+
+    actions = ["decline_selected_tickets"]
+
     def verify_purchase(self, obj):
         return format_html(
             f"""
@@ -1543,11 +1594,8 @@ class TicketWithPaymentAdmin(BaseAdminTable):
         """Override to filter TicketReserved by clients who have existing payments."""
         # Fetch the TicketReserved model queryset
         queryset = models.TicketReserved.objects.all()
-        # Get client IDs with existing payments
-        client_ids_with_payments = models.Payment.objects.values_list(
-            'client_id', flat=True).distinct()
-        # Filter TicketReserved where the client is in the list of client IDs with payments
-        return queryset.filter(client_id__in=client_ids_with_payments)
+        # Filter TicketReserved where the client has at least one payment
+        return queryset.filter(client__payment_count__gt=0)
 
 
 @admin.register(models.Whatsapp)
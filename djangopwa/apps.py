@@ -1,5 +1,10 @@
 from django.apps import AppConfig
-from django.db.models.signals import post_migrate
+from django.db.models.signals import (
+    m2m_changed,
+    post_delete,
+    post_migrate,
+    post_save,
+)
 
 
 class DjangopwaConfig(AppConfig):
@@ -9,4 +14,32 @@ class DjangopwaConfig(AppConfig):
 
     def ready(self):
         from .groups import create_seller_group_with_permissions
+        from .ticket_availability import on_ticket_saved, on_ticket_deleted
+        from .ticket_assignment import on_assignment_changed
+        from . import client_balance, lottery_counters, lottery_statistics, payment_rollup
+        from .models import TicketAssignment
         post_migrate.connect(create_seller_group_with_permissions, sender=self)
+        post_save.connect(on_ticket_saved, sender="djangopwa.Ticket")
+        post_delete.connect(on_ticket_deleted, sender="djangopwa.Ticket")
+        post_save.connect(
+            lottery_counters.on_lottery_saved, sender="djangopwa.Lottery")
+        post_delete.connect(
+            lottery_counters.on_client_deleted, sender="djangopwa.ClientInfo")
+        # The client totals lock the client row before the rollup is moved
+        post_save.connect(
+            client_balance.on_payment_saved, sender="djangopwa.Payment")
+        post_delete.connect(
+            client_balance.on_payment_deleted, sender="djangopwa.Payment")
+        post_save.connect(
+            payment_rollup.on_payment_saved, sender="djangopwa.Payment")
+        post_delete.connect(
+            payment_rollup.on_payment_deleted, sender="djangopwa.Payment")
+        post_save.connect(
+            lottery_statistics.on_payment_changed, sender="djangopwa.Payment")
+        post_delete.connect(
+            lottery_statistics.on_payment_changed, sender="djangopwa.Payment")
+        post_save.connect(on_assignment_changed, sender=TicketAssignment)
+        post_delete.connect(on_assignment_changed, sender=TicketAssignment)
+        m2m_changed.connect(
+            on_assignment_changed, sender=TicketAssignment.individual_tickets.through
+        )
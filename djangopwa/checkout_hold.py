@@ -0,0 +1,229 @@
+import uuid
+
+from django.core.cache import cache
+
+from djangopwa import constants
+
+
+SESSION_HOLD_OWNER_KEY = "checkout_hold_owner"
+
+HOLD_PURPOSE_CHECKOUT = "checkout"
+HOLD_PURPOSE_ROULETTE = "roulette"
+
+# The numbers held by an owner are recorded at least as long as its holds last
+OWNER_HOLDS_TIMEOUT = max(
+    constants.CHECKOUT_HOLD_SECONDS, constants.LUCKY_ROULETTE_HOLD_SECONDS
+)
+
+
+def get_hold_cache_key(lottery_id, ticket_number):
+    return f"ticket_checkout_hold:{lottery_id}:{ticket_number}"
+
+
+def get_owner_holds_cache_key(lottery_id, owner):
+    return f"ticket_checkout_hold_owner:{lottery_id}:{owner}"
+
+
+def get_hold_owner(request):
+    """
+    Get the token identifying the holds of the visitor, stored in the session.
+
+    Args:
+        request (HttpRequest): The HTTP request.
+
+    Returns:
+        str: The hold owner token of the session.
+    """
+    owner = request.session.get(SESSION_HOLD_OWNER_KEY)
+    if owner is None:
+        owner = uuid.uuid4().hex
+        request.session[SESSION_HOLD_OWNER_KEY] = owner
+    return owner
+
+
+def get_foreign_holds(lottery_id, ticket_numbers, owner):
+    """
+    Get the ticket numbers held by someone else, with one cache round trip.
+
+    Args:
+        lottery_id (int): The ID of the lottery.
+        ticket_numbers (list): The ticket numbers to check.
+        owner (str): The hold owner token of the visitor.
+
+    Returns:
+        list: The ticket numbers held by another owner.
+    """
+    keys = {
+        get_hold_cache_key(lottery_id, ticket_number): ticket_number
+        for ticket_number in ticket_numbers
+    }
+    holds = cache.get_many(keys.keys())
+    return sorted(
+        keys[key] for key, hold_owner in holds.items() if hold_owner != owner
+    )
+
+
+def get_owner_holds(lottery_id, owner):
+    """
+    Get the ticket numbers an owner still holds in a lottery.
+
+    The numbers are recorded per owner when held, the ones whose hold
+    expired or went to someone else are dropped.
+
+    Returns:
+        dict: The purpose of each held number, keyed by ticket number.
+    """
+    holds = cache.get(get_owner_holds_cache_key(lottery_id, owner)) or {}
+    if not holds:
+        return {}
+
+    keys = {
+        get_hold_cache_key(lottery_id, ticket_number): ticket_number
+        for ticket_number in holds
+    }
+    hold_owners = cache.get_many(keys.keys())
+    return {
+        keys[key]: holds[keys[key]]
+        for key, hold_owner in hold_owners.items()
+        if hold_owner == owner
+    }
+
+
+def set_owner_holds(lottery_id, owner, holds, timeout=OWNER_HOLDS_TIMEOUT):
+    key = get_owner_holds_cache_key(lottery_id, owner)
+    if holds:
+        cache.set(key, holds, max(timeout, OWNER_HOLDS_TIMEOUT))
+    else:
+        cache.delete(key)
+
+
+def acquire_hold(
+    lottery_id,
+    ticket_number,
+    owner,
+    timeout=constants.CHECKOUT_HOLD_SECONDS,
+    purpose=HOLD_PURPOSE_CHECKOUT,
+):
+    """
+    Hold a ticket number for an owner.
+
+    cache.add is atomic, so only one owner wins a free number. Holding a
+    number the owner already holds refreshes its timeout.
+
+    Returns:
+        bool: True when the owner holds the number, False when someone else
+        does or the owner reached MAX_HOLDS_PER_OWNER roulette numbers.
+    """
+    return acquire_holds(lottery_id, [ticket_number], owner, timeout, purpose)
+
+
+def acquire_holds(
+    lottery_id,
+    ticket_numbers,
+    owner,
+    timeout=constants.CHECKOUT_HOLD_SECONDS,
+    purpose=HOLD_PURPOSE_CHECKOUT,
+):
+    """
+    Hold several ticket numbers for an owner, all of them or none.
+
+    An owner holds at most MAX_HOLDS_PER_OWNER roulette numbers of a lottery
+    at once, counting the ones it already holds. Checkout holds are not
+    capped, a purchase holds every number it buys.
+
+    Args:
+        lottery_id (int): The ID of the lottery.
+        ticket_numbers (list): The ticket numbers to hold.
+        owner (str): The hold owner token of the visitor.
+        timeout (int): Seconds the holds last.
+        purpose (str): What the numbers are held for, HOLD_PURPOSE_CHECKOUT
+            or HOLD_PURPOSE_ROULETTE.
+
+    Returns:
+        bool: True when the owner holds every number.
+    """
+    ticket_numbers = set(ticket_numbers)
+    owner_holds = get_owner_holds(lottery_id, owner)
+    if purpose == HOLD_PURPOSE_ROULETTE:
+        roulette_holds = {
+            ticket_number
+            for ticket_number, hold_purpose in owner_holds.items()
+            if hold_purpose == HOLD_PURPOSE_ROULETTE
+        }
+        if len(roulette_holds | ticket_numbers) > constants.MAX_HOLDS_PER_OWNER:
+            return False
+
+    if get_foreign_holds(lottery_id, ticket_numbers, owner):
+        return False
+
+    added_keys = []
+    for ticket_number in ticket_numbers:
+        key = get_hold_cache_key(lottery_id, ticket_number)
+        if cache.add(key, owner, timeout):
+            added_keys.append(key)
+        elif cache.get(key) == owner:
+            cache.touch(key, timeout)
+        else:
+            # Lost a race for this number, give back the ones just taken
+            cache.delete_many(added_keys)
+            return False
+
+    owner_holds.update(dict.fromkeys(ticket_numbers, purpose))
+    set_owner_holds(lottery_id, owner, owner_holds, timeout)
+    return True
+
+
+def release_holds(lottery_id, ticket_numbers, owner):
+    """
+    Release the given ticket numbers held by an owner.
+    """
+    keys = [
+        get_hold_cache_key(lottery_id, ticket_number)
+        for ticket_number in ticket_numbers
+    ]
+    holds = cache.get_many(keys)
+    cache.delete_many(
+        [key for key, hold_owner in holds.items() if hold_owner == owner]
+    )
+    set_owner_holds(lottery_id, owner, get_owner_holds(lottery_id, owner))
+
+
+def release_owner_holds(lottery_id, owner, purpose):
+    """
+    Release every ticket number an owner holds for a purpose, like the
+    number of its previous roulette spin.
+
+    Returns:
+        list: The released ticket numbers.
+    """
+    ticket_numbers = sorted(
+        ticket_number
+        for ticket_number, hold_purpose in get_owner_holds(lottery_id, owner).items()
+        if hold_purpose == purpose
+    )
+    if ticket_numbers:
+        release_holds(lottery_id, ticket_numbers, owner)
+    return ticket_numbers
+
+
+def hold_checkout(lottery_id, ticket_numbers, owner):
+    """
+    Hold the numbers selected in a checkout for CHECKOUT_HOLD_SECONDS.
+
+    The numbers the owner held for an earlier checkout and no longer
+    selects are released first, so changing the selection does not keep
+    the old numbers away from other visitors.
+
+    Returns:
+        bool: True when the owner holds every selected number.
+    """
+    ticket_numbers = set(ticket_numbers)
+    deselected = [
+        ticket_number
+        for ticket_number, purpose in get_owner_holds(lottery_id, owner).items()
+        if purpose == HOLD_PURPOSE_CHECKOUT and ticket_number not in ticket_numbers
+    ]
+    if deselected:
+        release_holds(lottery_id, deselected, owner)
+
+    return acquire_holds(lottery_id, ticket_numbers, owner)
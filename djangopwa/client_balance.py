@@ -0,0 +1,184 @@
+from django.db import transaction
+from django.db.models import Case, Count, F, FloatField, QuerySet, Sum, Value, When
+
+from djangopwa import models
+from djangopwa.lottery_counters import add_clients_money, move_client_money
+
+
+def move_client_payment_totals(client_id, amount, count):
+    """
+    Move the stored payment totals of a client, and the money raised by its
+    lottery, by a difference.
+
+    The relative UPDATE locks the client row, so concurrent payments of the
+    same client are applied one after the other without losing any.
+    """
+    if client_id is None or (not amount and not count):
+        return
+    models.ClientInfo.objects.filter(id=client_id).update(
+        paid_total=F("paid_total") + float(amount),
+        payment_count=F("payment_count") + count,
+    )
+    move_client_money(client_id, amount)
+
+
+def add_client_payments(payments):
+    """
+    Add new payments to the stored totals of their clients.
+
+    Used after a bulk insert, which sends no signals. Every client is moved
+    by the sum of its payments with a single relative UPDATE, and so is the
+    money raised by their lotteries.
+    """
+    totals = {}
+    for payment in payments:
+        paid_total, payment_count = totals.get(payment.client_id, (0, 0))
+        totals[payment.client_id] = (
+            paid_total + float(payment.amount), payment_count + 1)
+    if not totals:
+        return
+
+    models.ClientInfo.objects.filter(id__in=totals).update(
+        paid_total=F("paid_total") + Case(
+            *[
+                When(id=client_id, then=Value(paid_total))
+                for client_id, (paid_total, _) in totals.items()
+            ],
+            output_field=FloatField(),
+        ),
+        payment_count=F("payment_count") + Case(
+            *[
+                When(id=client_id, then=Value(payment_count))
+                for client_id, (_, payment_count) in totals.items()
+            ],
+        ),
+    )
+    add_clients_money(
+        {client_id: paid_total for client_id, (paid_total, _) in totals.items()})
+
+
+def on_payment_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+
+    loaded_values = instance.get_loaded_values()
+
+    with transaction.atomic():
+        if created:
+            move_client_payment_totals(instance.client_id, instance.amount, 1)
+            return
+
+        if loaded_values is None:
+            # Saved over an existing row without loading it first, the
+            # repaired difference is what the save moved
+            for row in refresh_client_payment_totals([instance.client_id]):
+                move_client_money(
+                    row["client_id"], row["computed"][0] - row["stored"][0])
+        elif loaded_values["client_id"] != instance.client_id:
+            move_client_payment_totals(
+                loaded_values["client_id"], -loaded_values["amount"], -1)
+            move_client_payment_totals(instance.client_id, instance.amount, 1)
+        else:
+            move_client_payment_totals(
+                instance.client_id,
+                float(instance.amount) - float(loaded_values["amount"]),
+                0,
+            )
+
+
+def is_client_deletion(origin):
+    """
+    Whether a payment is deleted in cascade from its client, whose stored
+    totals and rollup rows are deleted with it.
+    """
+    if isinstance(origin, QuerySet):
+        return origin.model is models.ClientInfo
+    return isinstance(origin, models.ClientInfo)
+
+
+def on_payment_deleted(sender, instance, origin=None, **kwargs):
+    if is_client_deletion(origin):
+        return
+
+    # Sent inside the deletion transaction, also for bulk and cascade deletes
+    loaded_values = instance.get_loaded_values() or {
+        "client_id": instance.client_id,
+        "amount": instance.amount,
+    }
+    move_client_payment_totals(
+        loaded_values["client_id"], -loaded_values["amount"], -1)
+
+
+def get_client_payment_totals(client_ids=None):
+    """
+    Compute the payment totals of the clients from the payments, with one
+    grouped query.
+
+    Args:
+        client_ids (list, optional): Only compute these clients.
+
+    Returns:
+        dict: Tuples of (paid_total, payment_count) keyed by client ID, for
+        the clients with at least one payment.
+    """
+    payments = models.Payment.objects.all()
+    if client_ids is not None:
+        payments = payments.filter(client_id__in=client_ids)
+
+    totals = payments.values("client_id").annotate(
+        total=Sum("amount"), count=Count("id")
+    ).order_by()
+
+    return {
+        row["client_id"]: (row["total"] or 0, row["count"]) for row in totals
+    }
+
+
+def refresh_client_payment_totals(client_ids=None, batch_size=1000):
+    """
+    Recompute the stored payment totals and fix the clients that drifted.
+
+    The clients are locked before the payments are summed, a payment written
+    meanwhile waits and then moves the repaired totals as usual.
+
+    Args:
+        client_ids (list, optional): Only repair these clients.
+        batch_size (int): Clients written per UPDATE batch.
+
+    Returns:
+        list: The repaired clients, with the stored and computed totals.
+    """
+    clients = models.ClientInfo.objects.only("id", "paid_total", "payment_count")
+    if client_ids is not None:
+        clients = clients.filter(id__in=client_ids)
+
+    repaired = []
+    drifted_clients = []
+    with transaction.atomic():
+        clients = list(clients.select_for_update())
+        totals = get_client_payment_totals(client_ids)
+
+        for client in clients:
+            paid_total, payment_count = totals.get(client.id, (0, 0))
+            if (
+                abs(client.paid_total - paid_total) < 0.005
+                and client.payment_count == payment_count
+            ):
+                continue
+
+            repaired.append(
+                {
+                    "client_id": client.id,
+                    "stored": (client.paid_total, client.payment_count),
+                    "computed": (paid_total, payment_count),
+                }
+            )
+            client.paid_total = paid_total
+            client.payment_count = payment_count
+            drifted_clients.append(client)
+
+        models.ClientInfo.objects.bulk_update(
+            drifted_clients, ["paid_total", "payment_count"], batch_size=batch_size
+        )
+
+    return repaired
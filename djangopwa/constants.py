@@ -34,3 +34,71 @@ BANK_NAMES = [
     ("BANCOLOMBIA", "Bancolombia"),
     ("DAVIPLATA", "Daviplata"),
 ]
+
+
+# Seconds a cached ticket availability index lives before it is rebuilt
+TICKET_AVAILABILITY_CACHE_SECONDS: int = 60
+
+# Beyond this many versions behind, a client gets a full availability snapshot
+# instead of the list of changed tickets
+TICKET_AVAILABILITY_MAX_DELTA_VERSIONS: int = 500
+
+# Seconds a number drawn by the lucky roulette stays held for the spinner
+LUCKY_ROULETTE_HOLD_SECONDS: int = 5 * 60
+
+# Expired reservations released by the sweeper in each transaction
+RESERVATION_SWEEP_BATCH_SIZE: int = 500
+
+# Seconds the numbers selected in a checkout stay held for the visitor
+CHECKOUT_HOLD_SECONDS: int = 10 * 60
+
+# Roulette numbers a visitor can hold at once in a lottery, checkout holds
+# are not capped
+MAX_HOLDS_PER_OWNER: int = 20
+
+# Seconds the resolved ticket intervals of a seller stay cached
+SELLER_ASSIGNMENT_CACHE_SECONDS: int = 10 * 60
+
+# Seconds the dashboard statistics of a lottery stay cached
+LOTTERY_STATISTICS_CACHE_SECONDS: int = 30
+
+
+class WebhookEventState(models.IntegerChoices):
+    """
+    Enumeration for the states of a queued webhook event.
+
+    Attributes
+    ----------
+    PENDING : int
+        Waiting for a worker, for the first time or after a failure.
+    PROCESSING : int
+        Claimed by a worker.
+    DONE : int
+        Processed.
+    DEAD : int
+        Failed every attempt, left for an admin to inspect.
+    """
+
+    PENDING = 1, "Pendiente"
+    PROCESSING = 2, "Procesando"
+    DONE = 3, "Procesado"
+    DEAD = 4, "Fallido"
+
+
+# Queued webhook events claimed by a worker at a time
+WEBHOOK_QUEUE_BATCH_SIZE: int = 50
+
+# Attempts of a webhook event before it is left in the DEAD state
+WEBHOOK_EVENT_MAX_ATTEMPTS: int = 8
+
+# Seconds before the first retry of a failed webhook event, doubled on each
+# attempt up to WEBHOOK_EVENT_MAX_BACKOFF_SECONDS
+WEBHOOK_EVENT_RETRY_SECONDS: int = 30
+WEBHOOK_EVENT_MAX_BACKOFF_SECONDS: int = 60 * 60
+
+# Seconds after which an event claimed by a worker that died is claimed again
+WEBHOOK_EVENT_PROCESSING_TIMEOUT_SECONDS: int = 10 * 60
+
+# Wompi reconciliation requests submitted per worker thread ahead of the
+# responses, so a long list of references is not queued all at once
+WOMPI_RECONCILIATION_REQUESTS_PER_WORKER: int = 4
@@ -8,6 +8,15 @@ from django.db.models import Count
 from djangopwa import models
 from djangopwa import constants
 from djangopwa.forms import lottery_forms
+from djangopwa.checkout_hold import (
+    acquire_holds,
+    get_foreign_holds,
+    get_hold_owner,
+    hold_checkout,
+    release_holds,
+)
+from djangopwa.ticket_availability import get_availability_index
+from djangopwa.ticket_reservation import ReservationResult, reserve_tickets
 from lottery.wompi import wompi
 
 
@@ -65,7 +74,8 @@ class LotteryView(generic.TemplateView):
         formatted_price = f"{lottery.price_per_ticket:,}".replace(",", ".")
         context["formatted_price"] = formatted_price
 
-        context["tickets"] = lottery.ticket_set.all()
+        context["ticket_availability"] = get_availability_index(
+            lottery).to_payload()
         context["lottery"] = lottery
         context["lottery_id"] = lottery.id
         context["lottery_media"] = lottery_media
@@ -87,21 +97,41 @@ class LotteryViewSelectTicketOptions(generic.TemplateView):
         return context
 
 
-def create_ticket_purchases(purchase_data):
-    lottery_id = purchase_data.get("lottery_id")
+def create_ticket_purchases(purchase_data, hold_owner=None):
+    """
+    Reserve the tickets of a purchase for the buyer.
 
-    ticket_numbers = purchase_data.get("ticket_numbers")
-    purchase_reference = purchase_data.get("purchase_reference")
+    The checkout holds taken when the form was shown are checked first,
+    refreshed or taken again if they expired, so numbers held by another
+    visitor are refused from the cache without touching the ticket rows.
+    They are released once the tickets are reserved, whose state guards
+    them from then on, and otherwise last until they expire.
 
-    name = purchase_data.get("name")
-    city = purchase_data.get("city")
-    document_number = purchase_data.get("document_number")
-    lastname = purchase_data.get("lastname")
-    whatsapp = purchase_data.get("whatsapp")
+    Parameters
+    ----------
+    purchase_data : dict
+        The lottery, the ticket numbers, the buyer data and the purchase reference.
+    hold_owner : str, optional
+        The checkout hold owner token of the buyer.
+
+    Returns
+    -------
+    ReservationResult
+        The reserved and the unavailable ticket numbers. Nothing is reserved
+        unless every ticket number was available.
+    """
+    lottery_id = purchase_data.get("lottery_id")
+    ticket_numbers = purchase_data.get("ticket_numbers")
     seller_id = purchase_data.get("seller_id")
-    
+
+    if hold_owner and not acquire_holds(lottery_id, ticket_numbers, hold_owner):
+        return ReservationResult(
+            unavailable=get_foreign_holds(lottery_id, set(ticket_numbers), hold_owner)
+            or sorted(set(ticket_numbers))
+        )
+
     seller = None
-    
+
     if seller_id:
         try:
             seller_id = int(seller_id)  # Convert to integer
@@ -113,61 +143,20 @@ def create_ticket_purchases(purchase_data):
             print(f"Seller with ID {seller_id} does not exist.")
     else:
         print("Seller ID is not provided.")
-        
+
     lottery = get_object_or_404(
         models.Lottery,
         id=lottery_id,
     )
 
-    # Retrieve the ticket and update its state to reserved
-    for ticket_number in ticket_numbers:
-        ticket = get_object_or_404(
-            models.Ticket,
-            number=ticket_number,
-            lottery_id=lottery_id,
-            state=constants.TicketState.AVAILABLE,
-        )
-        # Retrieve or create user
-        client = models.ClientInfo.objects.create(
-            name=name,
-            lastname=lastname,
-            whatsapp=whatsapp,
-            telephone=whatsapp,
-            document_number=document_number,
-            city=city,
-            lottery_to_buy=lottery,
-            ticket_number=ticket,
-            purchase_reference=purchase_reference,
-        )
-        
-        if seller:
-            client.seller = seller
+    reservation = reserve_tickets(
+        lottery, ticket_numbers, purchase_data, seller=seller)
 
-        ticket.state = constants.TicketState.RESERVED
+    # The reserved tickets are now guarded by their state
+    if hold_owner and reservation.reserved:
+        release_holds(lottery_id, ticket_numbers, hold_owner)
 
-        # Create a TicketReserved entry
-        expiration = timezone.now() + timezone.timedelta(
-            days=constants.MAX_TIME_DAYS_RESERVATION_TICKET
-        )
-
-        ticket_reserved = models.TicketReserved.objects.create(
-            ticket=ticket,
-            expiration=expiration,
-            client=client,
-            purchase_reference=purchase_reference,
-        )
-
-        ticket_pending_purchase = models.TicketPendingPurchase.objects.create(
-            ticket=ticket,
-            expiration=expiration,
-            client=client,
-            purchase_reference=purchase_reference,
-        )
-
-        ticket.save()
-        client.save()
-        ticket_reserved.save()
-        ticket_pending_purchase.save()
+    return reservation
 
 
 class LotteryPurchaseDataFormView(generic.edit.FormView):
@@ -178,17 +167,25 @@ class LotteryPurchaseDataFormView(generic.edit.FormView):
     form_class = lottery_forms.LotteryPurchaseDataForm
     template_name = "lottery/lottery_purchase_data_form.html"
 
-    def check_tickets_state(self, lottery_id, ticket_numbers):
-        try:
-            lottery = models.Lottery.objects.filter(id=lottery_id).first()
-
-            for ticket_number in ticket_numbers:
-                ticket = models.Ticket.objects.filter(
-                    lottery=lottery, number=ticket_number
-                ).first()
-                if ticket.state != constants.TicketState.AVAILABLE:
-                    return False
-        except Exception as e:
+    def check_tickets_state(self, lottery_id, ticket_numbers, hold_owner):
+        """
+        Hold the selected tickets for the visitor and check they are available.
+
+        The holds last CHECKOUT_HOLD_SECONDS, until the purchase is posted.
+        Numbers held by another visitor are refused from the cache, only the
+        visitor that holds every number reaches the database, with one query.
+        """
+        if not hold_checkout(lottery_id, ticket_numbers, hold_owner):
+            return False
+
+        available_count = models.Ticket.objects.filter(
+            lottery_id=lottery_id,
+            number__in=ticket_numbers,
+            state=constants.TicketState.AVAILABLE,
+        ).count()
+
+        if available_count != len(set(ticket_numbers)):
+            release_holds(lottery_id, ticket_numbers, hold_owner)
             return False
         return True
 
@@ -223,7 +220,9 @@ class LotteryPurchaseDataFormView(generic.edit.FormView):
 
         isTicketsAvailable = (
             self.check_tickets_state(
-                lottery_id=lottery_id, ticket_numbers=ticket_numbers
+                lottery_id=lottery_id,
+                ticket_numbers=ticket_numbers,
+                hold_owner=get_hold_owner(self.request),
             )
             and ticket_numbers.__len__() >= 1
         )
@@ -290,9 +289,20 @@ class LotteryPurchaseDataFormView(generic.edit.FormView):
             "seller_id": seller_id
         }
 
-        self.request.session["lottery_purchase_data"] = lottery_purchase_data
+        reservation = create_ticket_purchases(
+            lottery_purchase_data, hold_owner=get_hold_owner(self.request)
+        )
+
+        if not reservation.reserved:
+            form.add_error(
+                None,
+                "Los numeros "
+                + ", ".join(f"{number:04d}" for number in reservation.unavailable)
+                + " ya no estan disponibles.",
+            )
+            return self.form_invalid(form)
 
-        create_ticket_purchases(lottery_purchase_data)
+        self.request.session["lottery_purchase_data"] = lottery_purchase_data
 
         return redirect("lottery_payment_gateway", pk=self.kwargs["pk"])
 
@@ -378,8 +388,9 @@ class LotterySelectTicketView(generic.TemplateView):
 
         context["lottery"] = lottery
 
-        # Add tickets data related to lottery object
-        context["tickets"] = lottery.ticket_set.all()
+        # Add the compact availability index of the lottery tickets
+        context["ticket_availability"] = get_availability_index(
+            lottery).to_payload()
         return context
 
 
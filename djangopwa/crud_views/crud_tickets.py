@@ -5,11 +5,11 @@ from django.http import JsonResponse, HttpResponseRedirect
 from django.utils import timezone
 
 
-import random
-
 from djangopwa import models
 from djangopwa import constants
 from djangopwa.forms import ticket_forms
+from djangopwa.checkout_hold import get_hold_owner
+from djangopwa.ticket_sampler import get_ticket_sampler
 
 
 def mask_after_third_character(string):
@@ -55,7 +55,6 @@ class TicketView(generic.DetailView):
             client = ticket_reserved.client
 
         if client:
-            payment_count = models.Payment.objects.filter(client=client).count()
             client_context = {
                 "name_and_lastname": mask_after_third_character(client.name)
                 + " "
@@ -63,7 +62,7 @@ class TicketView(generic.DetailView):
                 "document_number": mask_except_last_three_characters(
                     str(client.document_number)
                 ),
-                "payment_count": payment_count,
+                "payment_count": client.payment_count,
             }
 
             context["client"] = client_context
@@ -84,31 +83,44 @@ class TicketLuckyRouletteView(generic.TemplateView):
 class RandomAvailableTicketAPIView(generic.View):
     def get(self, request, *args, **kwargs):
         """
-        Get a random available ticket from the database for the specified lottery.
+        Get a random available ticket for the specified lottery.
+
+        The ticket is drawn in O(1) from the in-memory sampler of the lottery.
+        With ``?hold=1`` the drawn ticket is held for the visitor for a few
+        minutes so that no concurrent spin or checkout gets the same number.
 
         Returns:
             JsonResponse: A JSON response containing the details of the selected ticket.
         """
         lottery_id = kwargs.get("lottery_id")
-        # Filter available tickets for the specified lottery
-        available_tickets = models.Ticket.objects.filter(state=1, lottery_id=lottery_id)
-        available_tickets_count = available_tickets.count()
+        hold = request.GET.get("hold") in ("1", "true")
+
+        try:
+            sampler = get_ticket_sampler(lottery_id)
+        except models.Lottery.DoesNotExist:
+            sampler = None
+
+        if sampler is None:
+            ticket_number = None
+        elif hold:
+            ticket_number = sampler.draw_and_hold(
+                get_hold_owner(request), constants.LUCKY_ROULETTE_HOLD_SECONDS
+            )
+        else:
+            ticket_number = sampler.draw()
 
-        if available_tickets_count == 0:
+        if ticket_number is None:
             # No available tickets found for the specified lottery
             return JsonResponse({"error": "No available tickets for this lottery"})
 
-        # Choose a random index within the range of available tickets
-        random_index = random.randint(0, available_tickets_count - 1)
-
-        # Retrieve the randomly chosen ticket
-        random_ticket = available_tickets[random_index]
-
         # Prepare the response data
         response_data = {
-            "ticket_number": random_ticket.number,
+            "ticket_number": ticket_number,
         }
 
+        if hold:
+            response_data["hold_seconds"] = constants.LUCKY_ROULETTE_HOLD_SECONDS
+
         return JsonResponse(response_data)
 
 
@@ -1,10 +1,15 @@
 from djangopwa.models import TicketAssignment, Ticket
 from djangopwa.models import TicketAssignment
 from django import forms
-from django.db.models import Min, Max
 
 from djangopwa import models
 from djangopwa import constants
+from djangopwa.ticket_assignment import (
+    build_intervals_filter,
+    find_assignment_conflicts,
+    get_assignment_index,
+    lock_lottery_assignments,
+)
 from types import NoneType
 
 
@@ -55,15 +60,13 @@ class TicketAssignmentForm(forms.ModelForm):
         self.fields["lottery"].initial = lottery.id
         self.fields["lottery"].disabled = True  # Disable editing
 
-        tickets = lottery.ticket_set.exclude(
-            ticketassignment__isnull=False
-        ).exclude(
-            number__range=(
-                models.TicketAssignment.objects.filter(lottery=lottery)
-                .aggregate(min_number=Min('start_number'), max_number=Max('end_number'))
-                .values()
-            )
-        )
+        tickets = lottery.ticket_set.all()
+
+        # Offer only the numbers nobody has been assigned yet
+        assigned_intervals = get_assignment_index(
+            lottery.id).get_assigned_intervals()
+        if assigned_intervals:
+            tickets = tickets.exclude(build_intervals_filter(assigned_intervals))
         
         if 'instance' in kwargs:
             instance = kwargs['instance']
@@ -78,18 +81,30 @@ class TicketAssignmentForm(forms.ModelForm):
     def clean(self):
         cleaned_data = super().clean()
         assigned_to = cleaned_data.get("assigned_to")
-        start_number = cleaned_data.get("start_number")
-        end_number = cleaned_data.get("end_number")
+        individual_tickets = cleaned_data.get("individual_tickets")
         lottery = cleaned_data.get("lottery")
 
-        if assigned_to and start_number is not None and end_number is not None and lottery:
-            if TicketAssignment.objects.filter(
-                lottery=lottery,
-                start_number__lte=end_number,
-                end_number__gte=start_number,
-            ).exclude(assigned_to=assigned_to).exists():
+        # Ranges are checked by TicketAssignment.clean. The admin saves the
+        # tickets in the transaction of the request, so the lottery stays
+        # locked until they are written.
+        if assigned_to and individual_tickets and lottery:
+            numbers = set(individual_tickets.values_list("number", flat=True))
+            lock_lottery_assignments(lottery.id)
+            conflicts = find_assignment_conflicts(
+                lottery.id,
+                [(number, number) for number in numbers],
+                assigned_to.id,
+                self.instance.pk,
+            )
+            conflicting_numbers = sorted(
+                number
+                for number in numbers
+                if any(conflict.start <= number <= conflict.end for conflict in conflicts)
+            )
+            if conflicting_numbers:
                 raise forms.ValidationError(
-                    f"Tickets in the specified range for lottery {lottery} have already been assigned to another user."
+                    f"Tickets {', '.join(f'{number:04}' for number in conflicting_numbers)} "
+                    f"for lottery {lottery} have already been assigned to another user."
                 )
 
         return cleaned_data
@@ -0,0 +1,299 @@
+from collections import Counter, defaultdict
+
+from django.db import transaction
+from django.db.models import Case, Count, F, FloatField, QuerySet, Subquery, Sum, Value, When
+
+from djangopwa import constants
+from djangopwa import models
+
+
+STATE_COUNTER_FIELDS = {
+    constants.TicketState.AVAILABLE: "available_tickets",
+    constants.TicketState.RESERVED: "reserved_tickets",
+    constants.TicketState.PURCHASED: "purchased_tickets",
+}
+
+COUNTER_FIELDS = (*STATE_COUNTER_FIELDS.values(), "money_raised")
+
+
+def move_lottery_counters(lottery_id, state_counts=None, money=0):
+    """
+    Move the counters of a lottery by a difference.
+
+    The relative UPDATE locks the counters row, so concurrent transitions of
+    the same lottery are applied one after the other without losing any.
+
+    Args:
+        lottery_id (int): The ID of the lottery.
+        state_counts (dict, optional): Tickets that entered each state,
+            negative for the tickets that left it.
+        money (float): Money raised difference.
+    """
+    updates = {
+        STATE_COUNTER_FIELDS[state]: F(STATE_COUNTER_FIELDS[state]) + count
+        for state, count in (state_counts or {}).items()
+        if count
+    }
+    if money:
+        updates["money_raised"] = F("money_raised") + float(money)
+    if lottery_id is None or not updates:
+        return
+
+    models.LotteryCounters.objects.filter(lottery_id=lottery_id).update(**updates)
+
+
+def move_ticket_counters(lottery_id, state, ticket_count, previous_states):
+    """
+    Move the counters of a lottery after some tickets changed state.
+
+    Args:
+        lottery_id (int): The ID of the lottery.
+        state (int): The new state of the tickets.
+        ticket_count (int): The number of tickets that changed.
+        previous_states (dict): The number of those tickets that were in
+            each state before, empty for new tickets.
+    """
+    state_counts = Counter({state: ticket_count})
+    state_counts.subtract(previous_states)
+    move_lottery_counters(lottery_id, state_counts)
+
+
+def add_lottery_tickets(tickets):
+    """
+    Add new tickets to the counters of their lotteries.
+
+    Used after a bulk insert, which sends no signals.
+    """
+    state_counts = defaultdict(Counter)
+    for ticket in tickets:
+        state_counts[ticket.lottery_id][ticket.state] += 1
+
+    for lottery_id, counts in state_counts.items():
+        move_lottery_counters(lottery_id, counts)
+
+
+def move_client_money(client_id, amount):
+    """
+    Move the money raised by the lottery of a client, without reading the
+    client first.
+    """
+    if client_id is None or not amount:
+        return
+    models.LotteryCounters.objects.filter(
+        lottery_id=Subquery(
+            models.ClientInfo.objects.filter(id=client_id).values("lottery_to_buy_id")
+        )
+    ).update(money_raised=F("money_raised") + float(amount))
+
+
+def add_clients_money(client_amounts):
+    """
+    Add the payments of several clients to the money raised by their
+    lotteries, with one query for the lotteries and one relative UPDATE.
+
+    Args:
+        client_amounts (dict): Amount paid keyed by client ID.
+    """
+    lottery_ids = models.ClientInfo.objects.filter(
+        id__in=client_amounts, lottery_to_buy__isnull=False
+    ).values_list("id", "lottery_to_buy_id")
+
+    lottery_amounts = defaultdict(float)
+    for client_id, lottery_id in lottery_ids:
+        lottery_amounts[lottery_id] += float(client_amounts[client_id])
+
+    move_lotteries_money(lottery_amounts)
+
+
+def remove_clients_money(client_ids):
+    """
+    Take the stored totals of several clients out of the money raised by
+    their lotteries, with one grouped query and one relative UPDATE.
+
+    Used before clients are deleted without sending signals.
+
+    Args:
+        client_ids (list): The IDs of the clients.
+    """
+    lottery_totals = (
+        models.ClientInfo.objects.filter(
+            id__in=client_ids, lottery_to_buy__isnull=False
+        )
+        .values("lottery_to_buy_id")
+        .annotate(total=Sum("paid_total"))
+        .order_by()
+        .values_list("lottery_to_buy_id", "total")
+    )
+    move_lotteries_money(
+        {lottery_id: -total for lottery_id, total in lottery_totals if total}
+    )
+
+
+def move_lotteries_money(lottery_amounts):
+    """
+    Move the money raised by several lotteries with one relative UPDATE.
+
+    Args:
+        lottery_amounts (dict): Money raised difference keyed by lottery ID.
+    """
+    if not lottery_amounts:
+        return
+
+    models.LotteryCounters.objects.filter(lottery_id__in=lottery_amounts).update(
+        money_raised=F("money_raised") + Case(
+            *[
+                When(lottery_id=lottery_id, then=Value(float(amount)))
+                for lottery_id, amount in lottery_amounts.items()
+            ],
+            output_field=FloatField(),
+        )
+    )
+
+
+def compute_lottery_counters(lottery_ids=None):
+    """
+    Compute the counters of the lotteries from the tickets and the payments,
+    with one grouped query each.
+
+    Args:
+        lottery_ids (list, optional): Only compute these lotteries.
+
+    Returns:
+        dict: The counter values keyed by lottery ID.
+    """
+    tickets = models.Ticket.objects.all()
+    payments = models.Payment.objects.filter(client__lottery_to_buy__isnull=False)
+    if lottery_ids is not None:
+        tickets = tickets.filter(lottery_id__in=lottery_ids)
+        payments = payments.filter(client__lottery_to_buy_id__in=lottery_ids)
+
+    counters = defaultdict(lambda: dict.fromkeys(COUNTER_FIELDS, 0))
+
+    ticket_counts = tickets.values("lottery_id", "state").annotate(
+        count=Count("id")).order_by()
+    for row in ticket_counts:
+        field_name = STATE_COUNTER_FIELDS.get(row["state"])
+        if field_name:
+            counters[row["lottery_id"]][field_name] = row["count"]
+
+    money_raised = payments.values("client__lottery_to_buy_id").annotate(
+        total=Sum("amount")).order_by()
+    for row in money_raised:
+        counters[row["client__lottery_to_buy_id"]]["money_raised"] = row["total"] or 0
+
+    return counters
+
+
+def is_drifted(stored, computed):
+    return any(
+        abs(stored[field_name] - computed[field_name]) >= 0.005
+        for field_name in COUNTER_FIELDS
+    )
+
+
+def refresh_lottery_counters(lottery_ids=None):
+    """
+    Rebuild the counters from the tickets and the payments and fix the
+    lotteries that drifted, creating the missing counters rows.
+
+    The counters rows are locked before the source tables are read, a
+    transition written meanwhile waits and then moves the repaired counters
+    as usual.
+
+    Args:
+        lottery_ids (list, optional): Only check these lotteries.
+
+    Returns:
+        list: The repaired lotteries, with the stored and computed counters,
+        stored is None for a missing row.
+    """
+    lotteries = models.Lottery.objects.all()
+    if lottery_ids is not None:
+        lotteries = lotteries.filter(id__in=lottery_ids)
+
+    repaired = []
+    with transaction.atomic():
+        stored_counters = {
+            counters.lottery_id: counters
+            for counters in models.LotteryCounters.objects.select_for_update().filter(
+                lottery__in=lotteries)
+        }
+        computed_counters = compute_lottery_counters(lottery_ids)
+
+        drifted_counters = []
+        missing_counters = []
+        for lottery_id in lotteries.values_list("id", flat=True):
+            computed = computed_counters[lottery_id]
+            counters = stored_counters.get(lottery_id)
+
+            if counters is None:
+                missing_counters.append(
+                    models.LotteryCounters(lottery_id=lottery_id, **computed))
+                repaired.append(
+                    {"lottery_id": lottery_id, "stored": None, "computed": computed})
+                continue
+
+            stored = {
+                field_name: getattr(counters, field_name)
+                for field_name in COUNTER_FIELDS
+            }
+            if not is_drifted(stored, computed):
+                continue
+
+            for field_name, value in computed.items():
+                setattr(counters, field_name, value)
+            drifted_counters.append(counters)
+            repaired.append(
+                {"lottery_id": lottery_id, "stored": stored, "computed": computed})
+
+        models.LotteryCounters.objects.bulk_update(drifted_counters, COUNTER_FIELDS)
+        models.LotteryCounters.objects.bulk_create(missing_counters)
+
+    return repaired
+
+
+def get_lottery_counters(lottery_id):
+    """
+    Get the counters of a lottery, building them from the source tables
+    when the row is missing.
+    """
+    counters = models.LotteryCounters.objects.filter(lottery_id=lottery_id).first()
+    if counters is None:
+        refresh_lottery_counters([lottery_id])
+        counters = models.LotteryCounters.objects.get(lottery_id=lottery_id)
+    return counters
+
+
+def is_lottery_deletion(origin):
+    """
+    Whether a row is deleted in cascade from its lottery, whose counters
+    are deleted with it.
+    """
+    if isinstance(origin, QuerySet):
+        return origin.model is models.Lottery
+    return isinstance(origin, models.Lottery)
+
+
+def on_lottery_saved(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        models.LotteryCounters.objects.get_or_create(lottery_id=instance.id)
+
+
+def is_clients_queryset_deletion(origin):
+    """
+    Whether a client is deleted by a ClientInfo queryset, which took the
+    totals of all its clients out of their lotteries beforehand.
+    """
+    return isinstance(origin, QuerySet) and origin.model is models.ClientInfo
+
+
+def on_client_deleted(sender, instance, origin=None, **kwargs):
+    # The payments of a deleted client are deleted in cascade without
+    # moving anything, its stored total leaves the lottery at once
+    if (
+        is_lottery_deletion(origin)
+        or is_clients_queryset_deletion(origin)
+        or not instance.paid_total
+    ):
+        return
+    move_lottery_counters(instance.lottery_to_buy_id, money=-instance.paid_total)
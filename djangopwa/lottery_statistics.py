@@ -0,0 +1,151 @@
+from dataclasses import dataclass, field
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Q
+
+from djangopwa import constants
+from djangopwa import models
+from djangopwa.lottery_counters import STATE_COUNTER_FIELDS, get_lottery_counters
+
+
+# Bumped after every ticket transition or payment write, it is part of the
+# statistics cache keys so a change invalidates every lottery at once.
+STATISTICS_GENERATION_CACHE_KEY = "lottery_statistics_generation"
+
+
+def get_statistics_generation():
+    return cache.get_or_set(STATISTICS_GENERATION_CACHE_KEY, 0, None)
+
+
+def get_statistics_cache_key(lottery_id):
+    generation = get_statistics_generation()
+    return f"lottery_statistics:{generation}:{lottery_id}"
+
+
+@dataclass
+class LotteryStatistics:
+    lottery_id: int
+    total_tickets: int = 0
+    ticket_counts: dict = field(default_factory=dict)
+    pending_tickets: int = 0
+    tickets_with_payments: int = 0
+    money_raised: float = 0
+
+    def count(self, state):
+        return self.ticket_counts.get(state, 0)
+
+    @property
+    def available_tickets(self):
+        return self.count(constants.TicketState.AVAILABLE)
+
+    @property
+    def reserved_tickets(self):
+        return self.count(constants.TicketState.RESERVED)
+
+    @property
+    def purchased_tickets(self):
+        return self.count(constants.TicketState.PURCHASED)
+
+    @property
+    def percentage(self):
+        """
+        Percentage of the numbers of the lottery that are no longer available.
+        """
+        if not self.total_tickets:
+            return 0
+        return (self.total_tickets - self.available_tickets) * 100 / self.total_tickets
+
+    def as_context(self):
+        """
+        Format the statistics the way the reports template shows them.
+        """
+        return {
+            "total_money_raised": "{:,.0f}".format(self.money_raised).replace(",", "."),
+            "percentage": self.percentage,
+            "pending_tickets": self.pending_tickets,
+            "complete_tickets_payment": self.purchased_tickets,
+            "tickets_with_payments": self.tickets_with_payments,
+        }
+
+
+def compute_lottery_statistics(lottery):
+    """
+    Compute the dashboard numbers of a lottery with two queries.
+
+    The ticket counts and the money raised are read from the counters row
+    of the lottery, the pending purchases and the reserved tickets with a
+    payment from one aggregate over its clients, so neither the ticket nor
+    the payment table is scanned.
+
+    Args:
+        lottery (Lottery): The lottery to summarize.
+
+    Returns:
+        LotteryStatistics: The statistics of the lottery.
+    """
+    counters = get_lottery_counters(lottery.id)
+    statistics = LotteryStatistics(
+        lottery_id=lottery.id,
+        total_tickets=lottery.upper_series_range - lottery.lower_series_range + 1,
+        ticket_counts={
+            state: getattr(counters, field_name)
+            for state, field_name in STATE_COUNTER_FIELDS.items()
+        },
+        money_raised=counters.money_raised,
+    )
+
+    client_totals = models.ClientInfo.objects.filter(
+        lottery_to_buy_id=lottery.id
+    ).aggregate(
+        pending_tickets=Count("ticketpendingpurchase"),
+        tickets_with_payments=Count(
+            "id",
+            filter=Q(
+                payment_count__gt=0,
+                ticket_number__state=constants.TicketState.RESERVED,
+            ),
+            distinct=True,
+        ),
+    )
+    statistics.pending_tickets = client_totals["pending_tickets"]
+    statistics.tickets_with_payments = client_totals["tickets_with_payments"]
+
+    return statistics
+
+
+def get_lottery_statistics(lottery):
+    """
+    Get the statistics of a lottery, computing and caching them on a miss.
+
+    Any ticket transition or payment write invalidates the cached
+    statistics once committed, the short timeout only bounds what a write
+    made outside of the ORM could leave stale.
+
+    Args:
+        lottery (Lottery): The lottery to summarize.
+
+    Returns:
+        LotteryStatistics: The statistics of the lottery.
+    """
+    cache_key = get_statistics_cache_key(lottery.id)
+    statistics = cache.get(cache_key)
+
+    if statistics is None:
+        statistics = compute_lottery_statistics(lottery)
+        cache.set(cache_key, statistics,
+                  constants.LOTTERY_STATISTICS_CACHE_SECONDS)
+
+    return statistics
+
+
+def invalidate_lottery_statistics():
+    try:
+        cache.incr(STATISTICS_GENERATION_CACHE_KEY)
+    except ValueError:
+        cache.set(STATISTICS_GENERATION_CACHE_KEY, 1, None)
+
+
+def on_payment_changed(sender, **kwargs):
+    # After the commit, a read in between would cache the old totals
+    transaction.on_commit(invalidate_lottery_statistics)
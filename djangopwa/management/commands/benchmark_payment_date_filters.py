@@ -0,0 +1,171 @@
+import random
+import time
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from djangopwa import models
+from djangopwa.payment_balance import (
+    adjust_date_range,
+    build_complex_queries_filter_by_dates,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the query plans and timings of the seller payment date "
+        "filters on synthetic payments. Everything is written inside a "
+        "transaction that is rolled back, run it against SQLite or "
+        "PostgreSQL with --database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--payments", type=int, default=1_000_000)
+        parser.add_argument("--sellers", type=int, default=20)
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=45,
+            help="Number of days selected, in runs like the calendar picks.",
+        )
+        parser.add_argument("--history-days", type=int, default=365)
+        parser.add_argument("--repeat", type=int, default=5)
+        parser.add_argument("--database", default="default")
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        random.seed(options["seed"])
+        database = options["database"]
+
+        with transaction.atomic(using=database):
+            seller_ids = self.create_payments(database, options)
+            # Fresh rows have no planner statistics yet
+            with connections[database].cursor() as cursor:
+                cursor.execute(
+                    f"ANALYZE {models.Payment._meta.db_table}")
+            dates = self.pick_days(options["days"], options["history_days"])
+            self.stdout.write(
+                f"{options['payments']} payments, {len(dates)} days selected in "
+                f"{len(adjust_date_range(dates))} runs "
+                f"({connections[database].vendor})"
+            )
+
+            payments = models.Payment.objects.using(database).filter(
+                seller_id=seller_ids[0])
+            strategies = {
+                "one range per day": payments.filter(
+                    self.build_filter_per_day(dates)),
+                "coalesced ranges": payments.filter(
+                    build_complex_queries_filter_by_dates(dates)),
+                "date__date__in": payments.filter(date__date__in=dates),
+            }
+
+            for name, queryset in strategies.items():
+                self.report(name, queryset, options["repeat"])
+
+            transaction.set_rollback(True, using=database)
+
+    def create_payments(self, database, options):
+        now = timezone.now()
+        lottery = models.Lottery.objects.using(database).create(
+            name="Benchmark",
+            description="",
+            lottery_date_1=now,
+            lottery_date_2=now,
+            lottery_date_3=now,
+            lottery_date_4=now,
+            price_per_ticket=10000,
+            lower_series_range=0,
+            upper_series_range=0,
+        )
+        ticket = models.Ticket.objects.using(database).create(
+            lottery=lottery, number=0)
+
+        sellers = [
+            models.User.objects.db_manager(database).create(
+                username=f"benchmark-seller-{index}-{now.timestamp()}")
+            for index in range(options["sellers"])
+        ]
+        clients = models.ClientInfo.objects.using(database).bulk_create(
+            [
+                models.ClientInfo(
+                    lottery_to_buy=lottery,
+                    ticket_number=ticket,
+                    name="Benchmark",
+                    lastname="",
+                    whatsapp=0,
+                    document_number=0,
+                    telephone=0,
+                    city="",
+                    seller=seller,
+                )
+                for seller in sellers
+            ]
+        )
+        if not all(client.pk for client in clients):
+            clients = list(
+                models.ClientInfo.objects.using(database).filter(
+                    seller__in=sellers)
+            )
+
+        history_seconds = options["history_days"] * 24 * 60 * 60
+        batch_size = 10_000
+        remaining = options["payments"]
+        started_at = time.monotonic()
+
+        while remaining:
+            batch = min(batch_size, remaining)
+            models.Payment.objects.using(database).bulk_create(
+                [
+                    models.Payment(
+                        seller_id=client.seller_id,
+                        client=client,
+                        amount=10000,
+                        date=now - timedelta(
+                            seconds=random.randrange(history_seconds)),
+                        payment_type="BONO1",
+                    )
+                    for client in random.choices(clients, k=batch)
+                ]
+            )
+            remaining -= batch
+
+        self.stdout.write(
+            f"Inserted the payments in {time.monotonic() - started_at:.1f}s")
+        return [seller.id for seller in sellers]
+
+    def pick_days(self, days, history_days):
+        today = timezone.localdate()
+        dates = set()
+        while len(dates) < min(days, history_days):
+            run_start = today - timedelta(days=random.randrange(history_days))
+            for offset in range(random.randint(1, 7)):
+                dates.add(run_start + timedelta(days=offset))
+        return sorted(dates)[:days]
+
+    def build_filter_per_day(self, dates):
+        queries = Q()
+        for date in dates:
+            start_date = timezone.make_aware(
+                datetime(date.year, date.month, date.day))
+            queries |= Q(date__gte=start_date,
+                         date__lt=start_date + timedelta(days=1))
+        return queries
+
+    def report(self, name, queryset, repeat):
+        timings = []
+        for _ in range(repeat):
+            started_at = time.perf_counter()
+            rows = queryset.count()
+            timings.append(time.perf_counter() - started_at)
+
+        self.stdout.write(self.style.MIGRATE_HEADING(name))
+        self.stdout.write(
+            f"  {rows} rows, best {min(timings) * 1000:.1f}ms, "
+            f"median {sorted(timings)[len(timings) // 2] * 1000:.1f}ms"
+        )
+        for line in queryset.explain().splitlines():
+            self.stdout.write(f"  {line}")
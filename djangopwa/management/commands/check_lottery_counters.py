@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+
+from djangopwa.lottery_counters import COUNTER_FIELDS, refresh_lottery_counters
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the ticket counts and money raised of every lottery from the "
+        "tickets and the payments, report the counters that drifted and fix them."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--lottery",
+            type=int,
+            action="append",
+            dest="lottery_ids",
+            help="Only check the lottery with this ID, can be repeated.",
+        )
+
+    def handle(self, *args, **options):
+        repaired = refresh_lottery_counters(options["lottery_ids"])
+
+        for row in repaired:
+            if row["stored"] is None:
+                self.stdout.write(f"Lottery {row['lottery_id']}: missing counters")
+                continue
+
+            drift = ", ".join(
+                f"{field_name} {row['stored'][field_name]:,.0f} -> "
+                f"{row['computed'][field_name]:,.0f}"
+                for field_name in COUNTER_FIELDS
+                if row["stored"][field_name] != row["computed"][field_name]
+            )
+            self.stdout.write(f"Lottery {row['lottery_id']}: {drift}")
+
+        self.stdout.write(
+            self.style.SUCCESS(f"Repaired the counters of {len(repaired)} lotteries")
+        )
@@ -0,0 +1,298 @@
+import json
+import random
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Q
+from django.test import RequestFactory
+from django.utils import timezone
+
+from djangopwa import constants
+from djangopwa import models
+from djangopwa.lottery_counters import add_lottery_tickets
+from djangopwa.ticket_reservation import reserve_tickets
+from djangopwa.webhook_queue import process_events
+from djangopwa.wompi_events import generate_reference_events
+from djangopwa.wompi_webhook import process_queued_event, wompi_webhook
+
+
+class QueryCounter:
+    def __init__(self):
+        self.queries = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries += 1
+        return execute(sql, params, many, context)
+
+
+def measure(function, *args):
+    """
+    Run a function on the calling thread and measure it.
+
+    Returns:
+        tuple: The result, the seconds it took and the queries it ran.
+    """
+    counter = QueryCounter()
+    started_at = time.perf_counter()
+    with connection.execute_wrapper(counter):
+        result = function(*args)
+    return result, time.perf_counter() - started_at, counter.queries
+
+
+class ClosingThreadPoolExecutor(ThreadPoolExecutor):
+    """
+    Close the database connection of the worker thread after every task,
+    the connections opened by the threads are not closed by Django.
+    """
+
+    def submit(self, function, /, *args, **kwargs):
+        def run():
+            try:
+                return function(*args, **kwargs)
+            finally:
+                connection.close()
+
+        return super().submit(run)
+
+
+class Command(BaseCommand):
+    help = (
+        "Load test the Wompi webhook with signed transaction.updated events, "
+        "retried and out of order deliveries and multi ticket references, "
+        "then drain the queue. Reports the latency percentiles, throughput "
+        "and queries per event of both phases. The deliveries call the view "
+        "through RequestFactory, so they measure the view and not the HTTP "
+        "path: no server, network or middleware. Seeds its own lottery and "
+        "deletes it afterwards, only available with DEBUG."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--references", type=int, default=200)
+        parser.add_argument(
+            "--max-tickets",
+            type=int,
+            default=5,
+            help="Tickets of a reference are drawn between 1 and this.",
+        )
+        parser.add_argument("--retry-ratio", type=float, default=0.2)
+        parser.add_argument("--out-of-order-ratio", type=float, default=0.1)
+        parser.add_argument("--declined-ratio", type=float, default=0.1)
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=8,
+            help="Deliveries in flight, use 1 on SQLite.",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=1,
+            help="Queue worker threads, use 1 on SQLite.",
+        )
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument(
+            "--keep",
+            action="store_true",
+            help="Keep the seeded lottery, payments and events.",
+        )
+
+    def handle(self, *args, **options):
+        if not settings.DEBUG:
+            raise CommandError("The load test writes to the database, it needs DEBUG.")
+
+        rng = random.Random(options["seed"])
+        run_id = f"loadtest-{timezone.now():%Y%m%d%H%M%S}"
+
+        lottery, seller, references = self.seed(run_id, rng, options)
+        try:
+            deliveries = self.generate_deliveries(lottery, references, rng, options)
+            self.stdout.write(
+                f"{len(references)} references, "
+                f"{sum(len(tickets) for tickets in references.values())} tickets, "
+                f"{len(deliveries)} deliveries"
+            )
+
+            self.deliver(deliveries, options["concurrency"])
+            self.process(run_id, options["workers"])
+            self.check_outcome(lottery, references)
+        finally:
+            if not options["keep"]:
+                self.clean(run_id, lottery, seller)
+
+    def seed(self, run_id, rng, options):
+        now = timezone.now()
+        seller = models.User.objects.create(username=run_id)
+        ticket_counts = [
+            rng.randint(1, options["max_tickets"]) for _ in range(options["references"])
+        ]
+        lottery = models.Lottery.objects.create(
+            name=run_id,
+            description="Load test",
+            lottery_date_1=now,
+            lottery_date_2=now,
+            lottery_date_3=now,
+            lottery_date_4=now,
+            price_per_ticket=10000,
+            lower_series_range=0,
+            upper_series_range=sum(ticket_counts) - 1,
+        )
+        tickets = models.Ticket.objects.bulk_create(
+            [
+                models.Ticket(lottery=lottery, number=number)
+                for number in range(sum(ticket_counts))
+            ]
+        )
+        add_lottery_tickets(tickets)
+
+        references = {}
+        next_number = 0
+        for index, ticket_count in enumerate(ticket_counts):
+            reference = f"{run_id}-{index}"
+            ticket_numbers = list(range(next_number, next_number + ticket_count))
+            next_number += ticket_count
+            reserve_tickets(
+                lottery,
+                ticket_numbers,
+                {
+                    "name": "Load",
+                    "lastname": "Test",
+                    "whatsapp": 3000000000,
+                    "document_number": 0,
+                    "city": "",
+                    "purchase_reference": reference,
+                },
+                seller=seller,
+            )
+            references[reference] = ticket_numbers
+
+        return lottery, seller, references
+
+    def generate_deliveries(self, lottery, references, rng, options):
+        deliveries_by_reference = [
+            generate_reference_events(
+                reference,
+                len(ticket_numbers) * lottery.price_per_ticket * 100,
+                rng,
+                retry_ratio=options["retry_ratio"],
+                out_of_order_ratio=options["out_of_order_ratio"],
+                declined_ratio=options["declined_ratio"],
+            )
+            for reference, ticket_numbers in references.items()
+        ]
+
+        # The references are interleaved, each one keeps its delivery order
+        deliveries = []
+        while deliveries_by_reference:
+            index = rng.randrange(len(deliveries_by_reference))
+            deliveries.append(deliveries_by_reference[index].pop(0))
+            if not deliveries_by_reference[index]:
+                deliveries_by_reference.pop(index)
+        return deliveries
+
+    def deliver(self, deliveries, concurrency):
+        factory = RequestFactory()
+
+        def post(event):
+            request = factory.post(
+                "/api/wompi_webhook",
+                data=json.dumps(event),
+                content_type="application/json",
+            )
+            response, seconds, queries = measure(wompi_webhook, request)
+            return response.status_code, seconds, queries
+
+        started_at = time.perf_counter()
+        with ClosingThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = list(executor.map(post, deliveries))
+        elapsed = time.perf_counter() - started_at
+
+        errors = sum(1 for status_code, _, _ in results if status_code != 200)
+        self.report(
+            "Webhook deliveries",
+            [seconds for _, seconds, _ in results],
+            [queries for _, _, queries in results],
+            elapsed,
+        )
+        if errors:
+            self.stderr.write(f"  {errors} deliveries answered with an error")
+
+    def process(self, run_id, workers):
+        timings = []
+        queries = []
+
+        def handler(data):
+            response, seconds, query_count = measure(process_queued_event, data)
+            timings.append(seconds)
+            queries.append(query_count)
+            return response
+
+        # Only the events of this run, the queue may hold real ones
+        event_filter = Q(payload__data__transaction__reference__startswith=run_id)
+
+        started_at = time.perf_counter()
+        for _ in process_events(
+            handler,
+            workers=workers,
+            event_filter=event_filter,
+            executor_class=ClosingThreadPoolExecutor,
+        ):
+            pass
+        elapsed = time.perf_counter() - started_at
+
+        self.report("Queued event processing", timings, queries, elapsed)
+
+    def report(self, title, timings, queries, elapsed):
+        self.stdout.write(self.style.MIGRATE_HEADING(title))
+        if not timings:
+            self.stdout.write("  no events")
+            return
+
+        if len(timings) > 1:
+            percentiles = statistics.quantiles(timings, n=100, method="inclusive")
+            p50, p99 = percentiles[49], percentiles[98]
+        else:
+            p50 = p99 = timings[0]
+
+        self.stdout.write(
+            f"  {len(timings)} events in {elapsed:.2f}s, "
+            f"{len(timings) / elapsed:.1f} events/s"
+        )
+        self.stdout.write(
+            f"  latency p50 {p50 * 1000:.1f}ms, p99 {p99 * 1000:.1f}ms, "
+            f"max {max(timings) * 1000:.1f}ms"
+        )
+        self.stdout.write(
+            f"  queries per event: mean {statistics.mean(queries):.1f}, "
+            f"max {max(queries)}"
+        )
+
+    def check_outcome(self, lottery, references):
+        expected_payments = sum(len(tickets) for tickets in references.values())
+        payments = models.Payment.objects.filter(
+            purchase_reference__in=references).count()
+        purchased = models.Ticket.objects.filter(
+            lottery=lottery, state=constants.TicketState.PURCHASED
+        ).count()
+
+        message = (
+            f"{payments} payments for {expected_payments} tickets, "
+            f"{purchased} tickets purchased"
+        )
+        if payments == expected_payments == purchased:
+            self.stdout.write(self.style.SUCCESS(message))
+        else:
+            self.stderr.write(message)
+
+    def clean(self, run_id, lottery, seller):
+        models.WompiWebhookEvent.objects.filter(
+            payload__data__transaction__reference__startswith=run_id
+        ).delete()
+        models.WompiTransactionEvent.objects.filter(
+            purchase_reference__startswith=run_id
+        ).delete()
+        lottery.delete()
+        seller.delete()
@@ -0,0 +1,71 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from djangopwa import constants
+from djangopwa.webhook_queue import process_events, requeue_dead_events
+from djangopwa.wompi_webhook import process_queued_event
+
+
+class Command(BaseCommand):
+    help = (
+        "Process the queued Wompi webhook events in batches on a thread pool, "
+        "retrying the failed ones with backoff. Safe to run from several "
+        "nodes at the same time."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=constants.WEBHOOK_QUEUE_BATCH_SIZE,
+            help="Maximum number of events claimed at a time.",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=4,
+            help="Threads processing the events of a batch, use 1 on SQLite.",
+        )
+        parser.add_argument(
+            "--interval",
+            type=int,
+            default=0,
+            help="Keep polling the queue every INTERVAL seconds instead of exiting.",
+        )
+        parser.add_argument(
+            "--requeue-dead",
+            action="store_true",
+            help="Give the dead events a new round of attempts first.",
+        )
+
+    def handle(self, *args, **options):
+        if options["requeue_dead"]:
+            requeued = requeue_dead_events()
+            self.stdout.write(f"Requeued {requeued} dead events")
+
+        while True:
+            self.process(options["batch_size"], options["workers"])
+            if not options["interval"]:
+                return
+            time.sleep(options["interval"])
+
+    def process(self, batch_size, workers):
+        totals = {"events": 0, "done": 0, "retried": 0, "dead": 0}
+        started_at = time.monotonic()
+
+        for batch in process_events(process_queued_event, batch_size, workers):
+            for key in totals:
+                totals[key] += getattr(batch, key)
+            self.stdout.write(
+                f"{batch.events} events: {batch.done} done, {batch.retried} "
+                f"retried, {batch.dead} dead in {batch.seconds:.3f}s"
+            )
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Processed {totals['events']} events ({totals['done']} done, "
+                f"{totals['retried']} retried, {totals['dead']} dead) in "
+                f"{time.monotonic() - started_at:.3f}s"
+            )
+        )
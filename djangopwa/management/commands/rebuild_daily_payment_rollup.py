@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from djangopwa.payment_rollup import rebuild_daily_payments
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the daily payment rollup of the sellers from the payment "
+        "history, with one grouped query."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--seller",
+            type=int,
+            dest="seller_id",
+            help="Only rebuild the rows of the seller with this ID.",
+        )
+
+    def handle(self, *args, **options):
+        rows = rebuild_daily_payments(options["seller_id"])
+
+        self.stdout.write(
+            self.style.SUCCESS(f"Wrote {rows} daily payment rows")
+        )
@@ -0,0 +1,128 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Sum
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from djangopwa import models
+from djangopwa.wompi_fake_server import FakeWompiServer
+from djangopwa.wompi_reconciliation import (
+    WompiTransactionsClient,
+    get_pending_references,
+    reconcile_references,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Ask Wompi for the transactions of every purchase reference still "
+        "pending and ingest the approved ones the webhook never delivered."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--reference",
+            action="append",
+            dest="references",
+            help="Only reconcile this purchase reference, can be repeated.",
+        )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=10,
+            help="Maximum number of requests to Wompi in flight.",
+        )
+        parser.add_argument(
+            "--base-url",
+            help="URL of the transactions API, defaults to WOMPI_BASE_API_URL.",
+        )
+        parser.add_argument(
+            "--client",
+            default="djangopwa.wompi_reconciliation.WompiTransactionsClient",
+            help="Dotted path of the transactions client class.",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only report the transactions found.",
+        )
+        parser.add_argument(
+            "--fake",
+            action="store_true",
+            help="Run against a local fake API that approves every pending "
+            "reference. Only available with DEBUG.",
+        )
+        parser.add_argument(
+            "--fake-latency",
+            type=float,
+            default=0.05,
+            help="Seconds the fake API takes to answer each request.",
+        )
+
+    def handle(self, *args, **options):
+        references = options["references"] or get_pending_references()
+        self.stdout.write(f"{len(references)} pending references")
+
+        if options["fake"]:
+            if not settings.DEBUG:
+                raise CommandError("--fake writes payments, it needs DEBUG.")
+            with FakeWompiServer(latency=options["fake_latency"]) as server:
+                for transaction_data in self.build_fake_transactions(references):
+                    server.add_transaction(transaction_data)
+                self.reconcile(references, options, base_url=server.url)
+            return
+
+        self.reconcile(references, options, base_url=options["base_url"])
+
+    def reconcile(self, references, options, base_url):
+        client_class = import_string(options["client"])
+        if client_class is WompiTransactionsClient:
+            client = client_class(
+                base_url=base_url, max_connections=options["concurrency"])
+        else:
+            client = client_class()
+
+        try:
+            report = reconcile_references(
+                client,
+                references,
+                concurrency=options["concurrency"],
+                dry_run=options["dry_run"],
+            )
+        finally:
+            client.close()
+
+        for reference in report.failed_references:
+            self.stderr.write(f"Could not read the transactions of {reference}")
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Read {report.transactions} transactions of {report.references} "
+                f"references and ingested {report.ingested} in "
+                f"{report.seconds:.2f}s ({report.references_per_second:.1f} "
+                "references/s)"
+            )
+        )
+
+    def build_fake_transactions(self, references):
+        due_by_reference = (
+            models.ClientInfo.objects.filter(purchase_reference__in=references)
+            .values("purchase_reference")
+            .annotate(
+                due=Sum("ticket_number__lottery__price_per_ticket"),
+                paid=Sum("paid_total"),
+            )
+            .order_by()
+        )
+        finalized_at = timezone.now().isoformat()
+
+        for row in due_by_reference:
+            amount = max((row["due"] or 0) - (row["paid"] or 0), 0)
+            yield {
+                "id": f"fake-{row['purchase_reference']}",
+                "status": "APPROVED",
+                "reference": row["purchase_reference"],
+                "finalized_at": finalized_at,
+                "payment_method": {"type": "FAKE"},
+                "amount_in_cents": int(round(amount * 100)),
+            }
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+
+from djangopwa.client_balance import refresh_client_payment_totals
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the stored paid total and payment count of every client "
+        "from its payments, with one grouped query, and fix the drifted ones."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--client",
+            type=int,
+            action="append",
+            dest="client_ids",
+            help="Only repair the client with this ID, can be repeated.",
+        )
+
+    def handle(self, *args, **options):
+        repaired = refresh_client_payment_totals(options["client_ids"])
+
+        for row in repaired:
+            stored_total, stored_count = row["stored"]
+            paid_total, payment_count = row["computed"]
+            self.stdout.write(
+                f"Client {row['client_id']}: {stored_total:,.0f} in {stored_count} "
+                f"payments -> {paid_total:,.0f} in {payment_count} payments"
+            )
+
+        self.stdout.write(
+            self.style.SUCCESS(f"Repaired {len(repaired)} clients")
+        )
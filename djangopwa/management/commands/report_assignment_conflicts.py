@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+
+from djangopwa import models
+from djangopwa.ticket_assignment import AssignmentIndex
+
+
+class Command(BaseCommand):
+    help = (
+        "Report the ticket numbers assigned to more than one seller, e.g. "
+        "assignments saved before overlaps were rejected."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--lottery",
+            type=int,
+            help="Only check the lottery with this ID.",
+        )
+
+    def handle(self, *args, **options):
+        lotteries = models.Lottery.objects.order_by("id")
+        if options["lottery"]:
+            lotteries = lotteries.filter(id=options["lottery"])
+
+        usernames = dict(models.User.objects.values_list("id", "username"))
+        total_conflicts = 0
+
+        for lottery_id, lottery_name in lotteries.values_list("id", "name"):
+            conflicts = AssignmentIndex.build(lottery_id).get_all_conflicts()
+            total_conflicts += len(conflicts)
+
+            for first, second in conflicts:
+                start = max(first.start, second.start)
+                end = min(first.end, second.end)
+                self.stdout.write(
+                    f"{lottery_name}: {start}-{end} assigned to "
+                    f"{usernames.get(first.seller_id)} (assignment {first.assignment_id}) "
+                    f"and {usernames.get(second.seller_id)} (assignment {second.assignment_id})"
+                )
+
+        style = self.style.WARNING if total_conflicts else self.style.SUCCESS
+        self.stdout.write(style(f"Found {total_conflicts} conflicting assignments"))
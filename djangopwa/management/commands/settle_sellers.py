@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from djangopwa.seller_settlement import settle_sellers, write_settlement_summary
+
+
+class Command(BaseCommand):
+    help = (
+        "Bill the outstanding payments of every seller in one transaction "
+        "and write a CSV summary with one line per billed seller."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--seller",
+            type=int,
+            action="append",
+            dest="seller_ids",
+            help="Only settle the seller with this ID, can be repeated.",
+        )
+        parser.add_argument(
+            "--output",
+            help="Path of the summary file, "
+            "defaults to seller_settlement_<date>.csv.",
+        )
+
+    def handle(self, *args, **options):
+        generation_date = timezone.now()
+        settlements = settle_sellers(options["seller_ids"], generation_date)
+
+        output = options["output"] or (
+            f"seller_settlement_{timezone.localtime(generation_date):%Y%m%d_%H%M%S}.csv"
+        )
+        with open(output, "w", newline="") as file:
+            write_settlement_summary(settlements, file)
+
+        total_amount = sum(settlement.bill.total_amount for settlement in settlements)
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Billed {len(settlements)} sellers for {total_amount:,} "
+                f"in total, summary written to {output}"
+            )
+        )
@@ -0,0 +1,70 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from djangopwa import constants
+from djangopwa.reservation_sweeper import (
+    count_paid_expired_holdings,
+    sweep_expired_reservations,
+)
+from djangopwa.ticket_availability import prune_ticket_state_changes
+
+
+class Command(BaseCommand):
+    help = (
+        "Release the tickets of expired reservations and delete their holding "
+        "rows in batches, then prune the ticket state changes too old to be "
+        "sent as a delta. A reserved ticket whose client paid anything is kept "
+        "after its expiration until it is verified or declined, the unpaid "
+        "tickets of the same purchase are released. Safe to run from several "
+        "nodes at the same time."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=constants.RESERVATION_SWEEP_BATCH_SIZE,
+            help="Maximum number of reservations released per transaction.",
+        )
+        parser.add_argument(
+            "--interval",
+            type=int,
+            default=0,
+            help="Keep sweeping every INTERVAL seconds instead of exiting.",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        interval = options["interval"]
+
+        while True:
+            self.sweep(batch_size)
+            if not interval:
+                return
+            time.sleep(interval)
+
+    def sweep(self, batch_size):
+        total_rows = 0
+        total_tickets = 0
+        started_at = time.monotonic()
+
+        for batch in sweep_expired_reservations(batch_size=batch_size):
+            total_rows += batch.rows
+            total_tickets += batch.released_tickets
+            self.stdout.write(
+                f"{batch.model_name}: {batch.rows} rows, "
+                f"{batch.released_tickets} tickets released in {batch.seconds:.3f}s"
+            )
+
+        pruned_changes = prune_ticket_state_changes()
+        paid_reservations = count_paid_expired_holdings()
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Processed {total_rows} expired reservations, released "
+                f"{total_tickets} tickets, kept {paid_reservations} expired "
+                f"reservations with payments and pruned {pruned_changes} ticket "
+                f"state changes in {time.monotonic() - started_at:.3f}s"
+            )
+        )
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from djangopwa.purchase_verification import verify_paid_purchases
+
+
+class Command(BaseCommand):
+    help = (
+        "Move to PURCHASED the reserved tickets of every purchase reference "
+        "paid in full, for payments recorded outside the Wompi webhook."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--reference",
+            action="append",
+            dest="purchase_references",
+            help="Only verify this purchase reference, can be repeated.",
+        )
+
+    def handle(self, *args, **options):
+        result = verify_paid_purchases(options["purchase_references"])
+
+        self.stdout.write(
+            self.style.SUCCESS(f"Verified {len(result.processed)} tickets")
+        )
@@ -0,0 +1,34 @@
+# Generated by Django 5.0.6 on 2026-10-18 20:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djangopwa', '0016_alter_ticketassignment_options_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='lottery',
+            name='availability_version',
+            field=models.BigIntegerField(default=0, editable=False, verbose_name='version de disponibilidad'),
+        ),
+        migrations.CreateModel(
+            name='TicketStateChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('number', models.IntegerField(verbose_name='numero')),
+                ('state', models.IntegerField(choices=[(1, 'Disponible'), (2, 'Reservada'), (3, 'Comprada')], verbose_name='estado')),
+                ('version', models.BigIntegerField(verbose_name='version')),
+                ('lottery', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='djangopwa.lottery', verbose_name='rifa')),
+            ],
+            options={
+                'verbose_name': 'Cambio de estado de boleta',
+                'verbose_name_plural': 'Cambios de estado de boletas',
+                'indexes': [models.Index(fields=['lottery', 'version'], name='djangopwa_t_lottery_7b3d74_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.0.6 on 2026-10-18 20:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djangopwa', '0017_ticketstatechange_lottery_availability_version'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='ticketpendingpurchase',
+            name='expiration',
+            field=models.DateTimeField(db_index=True, verbose_name='Fecha de expiracion'),
+        ),
+        migrations.AlterField(
+            model_name='ticketreserved',
+            name='expiration',
+            field=models.DateTimeField(db_index=True, verbose_name='Fecha de expiracion'),
+        ),
+    ]
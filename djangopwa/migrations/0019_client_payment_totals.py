@@ -0,0 +1,42 @@
+# Generated by Django 5.0.6 on 2026-10-18 20:22
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def fill_client_payment_totals(apps, schema_editor):
+    ClientInfo = apps.get_model("djangopwa", "ClientInfo")
+    Payment = apps.get_model("djangopwa", "Payment")
+
+    totals = (
+        Payment.objects.values("client_id")
+        .annotate(total=Sum("amount"), count=Count("id"))
+        .order_by()
+    )
+    for row in totals:
+        ClientInfo.objects.filter(id=row["client_id"]).update(
+            paid_total=row["total"] or 0, payment_count=row["count"]
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djangopwa', '0018_index_reservation_expiration'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='clientinfo',
+            name='paid_total',
+            field=models.FloatField(default=0, editable=False, verbose_name='Total abonado'),
+        ),
+        migrations.AddField(
+            model_name='clientinfo',
+            name='payment_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Cantidad de abonos'),
+        ),
+        migrations.RunPython(
+            fill_client_payment_totals, migrations.RunPython.noop
+        ),
+    ]
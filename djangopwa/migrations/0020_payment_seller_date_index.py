@@ -0,0 +1,17 @@
+# Generated by Django 5.0.6 on 2026-10-18 20:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djangopwa', '0019_client_payment_totals'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['seller', 'date'], name='payment_seller_date_idx'),
+        ),
+    ]
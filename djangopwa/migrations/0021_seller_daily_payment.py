@@ -0,0 +1,70 @@
+# Generated by Django 5.0.6 on 2026-10-18 20:26
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Max, Sum
+from django.db.models.functions import TruncDate
+
+
+def fill_seller_daily_payments(apps, schema_editor):
+    Payment = apps.get_model("djangopwa", "Payment")
+    SellerDailyPayment = apps.get_model("djangopwa", "SellerDailyPayment")
+
+    daily_payments = (
+        Payment.objects.annotate(day=TruncDate("date"))
+        .values("seller_id", "client_id", "day")
+        .annotate(
+            total_amount=Sum("amount"),
+            payment_count=Count("id"),
+            last_payment_date=Max("date"),
+        )
+        .order_by()
+    )
+    SellerDailyPayment.objects.bulk_create(
+        [
+            SellerDailyPayment(
+                seller_id=row["seller_id"],
+                client_id=row["client_id"],
+                day=row["day"],
+                total_amount=row["total_amount"] or 0,
+                payment_count=row["payment_count"],
+                last_payment_date=row["last_payment_date"],
+            )
+            for row in daily_payments.iterator()
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djangopwa', '0020_payment_seller_date_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SellerDailyPayment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(verbose_name='dia')),
+                ('total_amount', models.FloatField(verbose_name='total abonado')),
+                ('payment_count', models.PositiveIntegerField(verbose_name='cantidad de abonos')),
+                ('last_payment_date', models.DateTimeField(verbose_name='fecha ultimo pago')),
+                ('client', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='djangopwa.clientinfo', verbose_name='cliente')),
+                ('seller', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, verbose_name='vendedor')),
+            ],
+            options={
+                'verbose_name': 'Abonos diarios de vendedor',
+                'verbose_name_plural': 'Abonos diarios de vendedores',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='sellerdailypayment',
+            constraint=models.UniqueConstraint(fields=('seller', 'day', 'client'), name='seller_daily_payment_unique'),
+        ),
+        migrations.RunPython(
+            fill_seller_daily_payments, migrations.RunPython.noop
+        ),
+    ]
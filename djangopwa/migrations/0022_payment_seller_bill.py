@@ -0,0 +1,23 @@
+# Generated by Django 5.0.6 on 2026-10-18 20:29
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djangopwa', '0021_seller_daily_payment'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='payment',
+            name='seller_bill',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, to='djangopwa.sellerbill', verbose_name='factura vendedor'),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(condition=models.Q(('seller_bill__isnull', True)), fields=['seller'], name='payment_unbilled_idx'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.0.6 on 2026-10-18 20:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djangopwa', '0022_payment_seller_bill'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WompiTransactionEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('transaction_id', models.CharField(max_length=200, verbose_name='ID de transacción')),
+                ('status', models.CharField(max_length=32, verbose_name='Estado')),
+                ('purchase_reference', models.CharField(blank=True, default='', max_length=200, verbose_name='Referencia de compra')),
+                ('received_at', models.DateTimeField(auto_now_add=True, verbose_name='Fecha de recepción')),
+            ],
+            options={
+                'verbose_name': 'Evento de transacción Wompi',
+                'verbose_name_plural': 'Eventos de transacciones Wompi',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='wompitransactionevent',
+            constraint=models.UniqueConstraint(fields=('transaction_id', 'status'), name='wompi_transaction_event_unique'),
+        ),
+    ]
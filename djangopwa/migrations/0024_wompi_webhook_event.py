@@ -0,0 +1,35 @@
+# Generated by Django 5.0.6 on 2026-10-18 20:32
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djangopwa', '0023_wompi_transaction_event'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WompiWebhookEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event', models.CharField(max_length=64, verbose_name='Evento')),
+                ('payload', models.JSONField(verbose_name='Contenido')),
+                ('state', models.IntegerField(choices=[(1, 'Pendiente'), (2, 'Procesando'), (3, 'Procesado'), (4, 'Fallido')], default=1, verbose_name='Estado')),
+                ('attempts', models.PositiveSmallIntegerField(default=0, verbose_name='Intentos')),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Próximo intento')),
+                ('locked_at', models.DateTimeField(blank=True, null=True, verbose_name='Reclamado en')),
+                ('last_error', models.TextField(blank=True, default='', verbose_name='Último error')),
+                ('result', models.CharField(blank=True, default='', max_length=200, verbose_name='Resultado')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Fecha de recepción')),
+                ('processed_at', models.DateTimeField(blank=True, null=True, verbose_name='Fecha de procesamiento')),
+            ],
+            options={
+                'verbose_name': 'Evento de webhook Wompi',
+                'verbose_name_plural': 'Eventos de webhook Wompi',
+                'indexes': [models.Index(fields=['state', 'next_attempt_at'], name='wompi_webhook_event_due_idx')],
+            },
+        ),
+    ]
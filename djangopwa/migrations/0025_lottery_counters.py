@@ -0,0 +1,70 @@
+# Generated by Django 5.0.6 on 2026-10-18 20:53
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+STATE_COUNTER_FIELDS = {
+    1: "available_tickets",
+    2: "reserved_tickets",
+    3: "purchased_tickets",
+}
+
+
+def fill_lottery_counters(apps, schema_editor):
+    Lottery = apps.get_model("djangopwa", "Lottery")
+    LotteryCounters = apps.get_model("djangopwa", "LotteryCounters")
+    Payment = apps.get_model("djangopwa", "Payment")
+    Ticket = apps.get_model("djangopwa", "Ticket")
+
+    counters = {
+        lottery_id: LotteryCounters(lottery_id=lottery_id)
+        for lottery_id in Lottery.objects.values_list("id", flat=True)
+    }
+
+    ticket_counts = (
+        Ticket.objects.values("lottery_id", "state")
+        .annotate(count=Count("id"))
+        .order_by()
+    )
+    for row in ticket_counts:
+        field_name = STATE_COUNTER_FIELDS.get(row["state"])
+        if field_name:
+            setattr(counters[row["lottery_id"]], field_name, row["count"])
+
+    money_raised = (
+        Payment.objects.filter(client__lottery_to_buy__isnull=False)
+        .values("client__lottery_to_buy_id")
+        .annotate(total=Sum("amount"))
+        .order_by()
+    )
+    for row in money_raised:
+        counters[row["client__lottery_to_buy_id"]].money_raised = row["total"] or 0
+
+    LotteryCounters.objects.bulk_create(counters.values(), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djangopwa', '0024_wompi_webhook_event'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LotteryCounters',
+            fields=[
+                ('lottery', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='counters', serialize=False, to='djangopwa.lottery', verbose_name='rifa')),
+                ('available_tickets', models.IntegerField(default=0, verbose_name='boletas disponibles')),
+                ('reserved_tickets', models.IntegerField(default=0, verbose_name='boletas reservadas')),
+                ('purchased_tickets', models.IntegerField(default=0, verbose_name='boletas compradas')),
+                ('money_raised', models.FloatField(default=0, verbose_name='dinero recaudado')),
+            ],
+            options={
+                'verbose_name': 'Contadores de rifa',
+                'verbose_name_plural': 'Contadores de rifas',
+            },
+        ),
+        migrations.RunPython(fill_lottery_counters, migrations.RunPython.noop),
+    ]
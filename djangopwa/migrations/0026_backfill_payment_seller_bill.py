@@ -0,0 +1,56 @@
+from django.db import migrations
+
+
+def backfill_payment_seller_bill(apps, schema_editor):
+    """
+    Link the payments billed before Payment.seller_bill existed to their
+    bills, so an outstanding bill does not bill them again.
+
+    Those bills only kept the total and the last payment date of each
+    client, the latest unbilled payments of the client up to that date are
+    claimed until they add up to the billed total. Bills are replayed in
+    the order they were generated.
+    """
+    SellerBill = apps.get_model("djangopwa", "SellerBill")
+    Payment = apps.get_model("djangopwa", "Payment")
+    ClientTicketPaymentBalance = apps.get_model(
+        "djangopwa", "ClientTicketPaymentBalance")
+
+    bills = SellerBill.objects.exclude(
+        id__in=Payment.objects.filter(seller_bill__isnull=False).values(
+            "seller_bill_id")
+    ).order_by("generation_date", "id")
+
+    for bill in bills.iterator():
+        claimed_ids = []
+        balances = ClientTicketPaymentBalance.objects.filter(seller_bill=bill)
+        for balance in balances:
+            payments = Payment.objects.filter(
+                seller_id=bill.seller_id,
+                client_id=balance.client_id,
+                date__lte=balance.last_payment_date,
+                seller_bill__isnull=True,
+            ).order_by("-date", "-id").values_list("id", "amount")
+
+            billed_amount = 0
+            for payment_id, amount in payments:
+                if billed_amount >= balance.total_amount:
+                    break
+                claimed_ids.append(payment_id)
+                billed_amount += amount
+
+        if claimed_ids:
+            Payment.objects.filter(id__in=claimed_ids).update(seller_bill=bill)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djangopwa', '0025_lottery_counters'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            backfill_payment_seller_bill, migrations.RunPython.noop
+        ),
+    ]
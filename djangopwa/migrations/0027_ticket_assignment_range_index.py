@@ -0,0 +1,17 @@
+# Generated by Django 5.0.6 on 2026-10-18 21:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djangopwa', '0026_backfill_payment_seller_bill'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='ticketassignment',
+            index=models.Index(fields=['lottery', 'start_number', 'end_number'], name='assignment_range_idx'),
+        ),
+    ]
@@ -1,5 +1,5 @@
 from django.core.exceptions import ValidationError
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import AbstractUser
 from django.utils import timezone
 
@@ -47,6 +47,23 @@ def get_default_seller():
     return User.objects.get(id=1)
 
 
+class ClientInfoQuerySet(models.QuerySet):
+    def delete(self):
+        """
+        Delete the clients, taking their stored totals out of the money
+        raised by their lotteries with one aggregate instead of one UPDATE
+        per client from the post_delete signal.
+        """
+        from djangopwa.lottery_counters import remove_clients_money
+
+        with transaction.atomic():
+            remove_clients_money(self.values("id"))
+            return super().delete()
+
+    delete.alters_data = True
+    delete.queryset_only = True
+
+
 class ClientInfo(models.Model):
     lottery_to_buy = models.ForeignKey(
         "Lottery",
@@ -81,10 +98,32 @@ class ClientInfo(models.Model):
         verbose_name="Referencia de compra", max_length=200, default="", blank=True, null=True
     )
 
+    # Maintained by the Payment writes, see djangopwa.client_balance
+    paid_total = models.FloatField(
+        verbose_name="Total abonado", default=0, editable=False)
+    payment_count = models.PositiveIntegerField(
+        verbose_name="Cantidad de abonos", default=0, editable=False)
+
+    objects = ClientInfoQuerySet.as_manager()
+
     class Meta:
         verbose_name = "Cliente"
         verbose_name_plural = "Clientes"
 
+    def save(self, *args, **kwargs):
+        """
+        Saves the client without overwriting its payment totals, which are
+        only moved by the payments written meanwhile.
+        """
+        if not self._state.adding and "update_fields" not in kwargs:
+            kwargs["update_fields"] = [
+                field.name
+                for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in ("paid_total", "payment_count")
+            ]
+        super().save(*args, **kwargs)
+
     def __str__(self):
         """
         Returns the string representation of the customer info.
@@ -124,14 +163,168 @@ class Payment(models.Model):
         verbose_name="Referencia de compra", max_length=200, blank=True, null=True
     )
 
+    # The bill that settled the payment, empty while it is outstanding
+    seller_bill = models.ForeignKey(
+        "SellerBill",
+        verbose_name="factura vendedor",
+        on_delete=models.SET_NULL,
+        blank=True,
+        null=True,
+        editable=False,
+    )
+
     class Meta:
         verbose_name = "Pago"
         verbose_name_plural = "Pagos"
+        indexes = [
+            # Seller settlements filter the payments of a seller by date
+            models.Index(fields=["seller", "date"], name="payment_seller_date_idx"),
+            # Only the outstanding payments are indexed, settling a seller
+            # reads the payments since its last bill
+            models.Index(
+                fields=["seller"],
+                condition=models.Q(seller_bill__isnull=True),
+                name="payment_unbilled_idx",
+            ),
+        ]
+
+    # Fields whose stored values the client totals and the daily rollup
+    # are moved from on the next save
+    TRACKED_FIELDS = ("client_id", "seller_id", "amount", "date")
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        loaded_values = dict(zip(field_names, values))
+        instance._loaded_values = {
+            field_name: loaded_values.get(field_name)
+            for field_name in cls.TRACKED_FIELDS
+        }
+        return instance
+
+    def get_loaded_values(self):
+        """
+        Get the tracked values as stored in the database, None when the
+        payment was not loaded from it.
+        """
+        return getattr(self, "_loaded_values", None)
+
+    def save(self, *args, **kwargs):
+        # The payment, the client totals and the rollup are written together
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+        self._loaded_values = {
+            field_name: getattr(self, field_name)
+            for field_name in self.TRACKED_FIELDS
+        }
 
     def __str__(self):
         return f"{self.payment_method if self.payment_method else ''} - {self.transaction_id} ({self.get_payment_type_display()})"
 
 
+class SellerDailyPayment(models.Model):
+    """
+    Daily rollup of the payments a seller collected from each client.
+
+    Maintained on every Payment write, see djangopwa.payment_rollup, and
+    rebuilt by the rebuild_daily_payment_rollup command.
+    """
+
+    seller = models.ForeignKey(
+        User, verbose_name="vendedor", on_delete=models.CASCADE)
+    client = models.ForeignKey(
+        ClientInfo, verbose_name="cliente", on_delete=models.CASCADE)
+    day = models.DateField(verbose_name="dia")
+    total_amount = models.FloatField(verbose_name="total abonado")
+    payment_count = models.PositiveIntegerField(verbose_name="cantidad de abonos")
+    last_payment_date = models.DateTimeField(verbose_name="fecha ultimo pago")
+
+    class Meta:
+        verbose_name = "Abonos diarios de vendedor"
+        verbose_name_plural = "Abonos diarios de vendedores"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["seller", "day", "client"],
+                name="seller_daily_payment_unique",
+            ),
+        ]
+
+
+class WompiTransactionEvent(models.Model):
+    """
+    A Wompi transaction status already applied by the webhook.
+
+    Wompi retries its deliveries and may send the same transaction.updated
+    event several times, the unique transaction and status pair makes every
+    status of a transaction apply once.
+    """
+
+    transaction_id = models.CharField(
+        verbose_name="ID de transacción", max_length=200)
+    status = models.CharField(verbose_name="Estado", max_length=32)
+    purchase_reference = models.CharField(
+        verbose_name="Referencia de compra", max_length=200, blank=True, default=""
+    )
+    received_at = models.DateTimeField(
+        verbose_name="Fecha de recepción", auto_now_add=True)
+
+    class Meta:
+        verbose_name = "Evento de transacción Wompi"
+        verbose_name_plural = "Eventos de transacciones Wompi"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["transaction_id", "status"],
+                name="wompi_transaction_event_unique",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.transaction_id} ({self.status})"
+
+
+class WompiWebhookEvent(models.Model):
+    """
+    A Wompi webhook delivery queued for the process_webhook_events worker.
+
+    The webhook only validates the signature and stores the raw event, see
+    djangopwa.webhook_queue for the processing, retries and dead letters.
+    """
+
+    event = models.CharField(verbose_name="Evento", max_length=64)
+    payload = models.JSONField(verbose_name="Contenido")
+    state = models.IntegerField(
+        verbose_name="Estado",
+        choices=constants.WebhookEventState.choices,
+        default=constants.WebhookEventState.PENDING,
+    )
+    attempts = models.PositiveSmallIntegerField(verbose_name="Intentos", default=0)
+    next_attempt_at = models.DateTimeField(
+        verbose_name="Próximo intento", default=timezone.now)
+    locked_at = models.DateTimeField(
+        verbose_name="Reclamado en", blank=True, null=True)
+    last_error = models.TextField(verbose_name="Último error", blank=True, default="")
+    result = models.CharField(
+        verbose_name="Resultado", max_length=200, blank=True, default="")
+    created_at = models.DateTimeField(
+        verbose_name="Fecha de recepción", auto_now_add=True)
+    processed_at = models.DateTimeField(
+        verbose_name="Fecha de procesamiento", blank=True, null=True)
+
+    class Meta:
+        verbose_name = "Evento de webhook Wompi"
+        verbose_name_plural = "Eventos de webhook Wompi"
+        indexes = [
+            # Workers claim the due events of a state in order
+            models.Index(
+                fields=["state", "next_attempt_at"],
+                name="wompi_webhook_event_due_idx",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.event} #{self.pk} ({self.get_state_display()})"
+
+
 class BankAccount(models.Model):
     """
     Model representing a bank account.
@@ -242,6 +435,22 @@ class Lottery(models.Model):
     price_per_ticket = models.IntegerField("precio por boleta")
     lower_series_range = models.IntegerField("Numero inicial")
     upper_series_range = models.IntegerField("Ultimo numero")
+    availability_version = models.BigIntegerField(
+        verbose_name="version de disponibilidad", default=0, editable=False
+    )
+
+    def save(self, *args, **kwargs):
+        """
+        Saves the lottery without overwriting its availability version, which
+        is only moved by ticket state transitions.
+        """
+        if not self._state.adding and "update_fields" not in kwargs:
+            kwargs["update_fields"] = [
+                field.name
+                for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != "availability_version"
+            ]
+        super().save(*args, **kwargs)
 
     def get_future_dates(self):
         """
@@ -338,10 +547,105 @@ class Ticket(models.Model):
     lottery = models.ForeignKey(
         Lottery, verbose_name="rifa", on_delete=models.CASCADE)
 
+    def get_previous_state(self):
+        """
+        Get the state the last save replaced, None for a new ticket or one
+        saved over a missing row. The lottery counters are moved from it.
+        """
+        return getattr(self, "_previous_state", None)
+
+    def save(self, *args, **kwargs):
+        """
+        Saves the ticket, reading the state it replaces with the row locked.
+
+        A concurrent save of the same ticket waits for the lock and then
+        reads the state written here, so a transition is never counted
+        twice from two copies loaded with the same state.
+        """
+        update_fields = kwargs.get("update_fields")
+        with transaction.atomic():
+            self._previous_state = None
+            if self.pk is not None and (
+                update_fields is None or "state" in update_fields
+            ):
+                self._previous_state = (
+                    Ticket.objects.select_for_update()
+                    .filter(pk=self.pk)
+                    .values_list("state", flat=True)
+                    .first()
+                )
+            super().save(*args, **kwargs)
+
     def __str__(self):
         return f"Boleta {str(self.number).zfill(4)}"
 
 
+class TicketStateChange(models.Model):
+    """
+    Model representing a state transition of a ticket.
+
+    Attributes
+    ----------
+    lottery : ForeignKey
+        Reference to the related lottery.
+    number : int
+        Number of the ticket that changed.
+    state : int
+        State of the ticket after the transition.
+    version : int
+        Availability version of the lottery that recorded the transition.
+    """
+
+    class Meta:
+        verbose_name = "Cambio de estado de boleta"
+        verbose_name_plural = "Cambios de estado de boletas"
+        indexes = [models.Index(fields=["lottery", "version"])]
+
+    lottery = models.ForeignKey(
+        Lottery, verbose_name="rifa", on_delete=models.CASCADE)
+    number = models.IntegerField(verbose_name="numero")
+    state = models.IntegerField(
+        verbose_name="estado", choices=constants.TicketState.choices)
+    version = models.BigIntegerField(verbose_name="version")
+
+
+class LotteryCounters(models.Model):
+    """
+    Number of tickets of a lottery in each state and money raised from its
+    clients.
+
+    Moved in the same transaction as every ticket transition and payment
+    write, see djangopwa.lottery_counters, and rebuilt by the
+    check_lottery_counters command.
+    """
+
+    class Meta:
+        verbose_name = "Contadores de rifa"
+        verbose_name_plural = "Contadores de rifas"
+
+    lottery = models.OneToOneField(
+        Lottery,
+        verbose_name="rifa",
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="counters",
+    )
+    available_tickets = models.IntegerField(
+        verbose_name="boletas disponibles", default=0)
+    reserved_tickets = models.IntegerField(
+        verbose_name="boletas reservadas", default=0)
+    purchased_tickets = models.IntegerField(
+        verbose_name="boletas compradas", default=0)
+    money_raised = models.FloatField(verbose_name="dinero recaudado", default=0)
+
+    @property
+    def total_tickets(self):
+        return self.available_tickets + self.reserved_tickets + self.purchased_tickets
+
+    def __str__(self):
+        return f"Contadores de {self.lottery_id}"
+
+
 class TicketReserved(models.Model):
     """
     Model representing a reserved ticket.
@@ -362,7 +666,8 @@ class TicketReserved(models.Model):
 
     ticket = models.ForeignKey(
         Ticket, verbose_name="Boleta", on_delete=models.CASCADE)
-    expiration = models.DateTimeField(verbose_name="Fecha de expiracion")
+    expiration = models.DateTimeField(
+        verbose_name="Fecha de expiracion", db_index=True)
     client = models.ForeignKey(
         ClientInfo, verbose_name="Cliente", on_delete=models.CASCADE
     )
@@ -400,7 +705,8 @@ class TicketWithPayment(models.Model):
 class TicketPendingPurchase(models.Model):
     ticket = models.ForeignKey(
         Ticket, verbose_name="Boleta", on_delete=models.CASCADE)
-    expiration = models.DateTimeField(verbose_name="Fecha de expiracion")
+    expiration = models.DateTimeField(
+        verbose_name="Fecha de expiracion", db_index=True)
     client = models.ForeignKey(
         ClientInfo, verbose_name="Cliente", on_delete=models.CASCADE
     )
@@ -481,6 +787,13 @@ class TicketAssignment(models.Model):
     class Meta:
         verbose_name = "Asignar boleta"
         verbose_name_plural = "Asignación boletas"
+        indexes = [
+            # Assignments are validated with start <= new end AND end >= new start
+            models.Index(
+                fields=["lottery", "start_number", "end_number"],
+                name="assignment_range_idx",
+            ),
+        ]
 
     @classmethod
     def get_assignments_for_user(cls, user):
@@ -503,9 +816,48 @@ class TicketAssignment(models.Model):
                 raise ValidationError(
                     "El valor de 'Desde' debe ser inferior al de 'Hasta'")
 
+        if (
+            self.start_number is not None
+            and self.end_number is not None
+            and self.lottery_id
+            and self.assigned_to_id
+        ):
+            self.check_range_conflicts()
+
+    def check_range_conflicts(self):
+        """
+        Reject a range overlapping the numbers assigned to another seller.
+
+        The overlaps are read from the database with the lottery row locked,
+        not from the cached assignment index, which may lag behind a
+        concurrent assignment.
+        """
+        from djangopwa.ticket_assignment import (
+            find_assignment_conflicts,
+            lock_lottery_assignments,
+        )
+
+        lock_lottery_assignments(self.lottery_id)
+        conflicts = find_assignment_conflicts(
+            self.lottery_id,
+            [(self.start_number, self.end_number)],
+            self.assigned_to_id,
+            self.pk,
+        )
+        if conflicts:
+            conflicting_numbers = ", ".join(
+                f"{conflict.start}-{conflict.end}" if conflict.start != conflict.end
+                else f"{conflict.start}"
+                for conflict in conflicts
+            )
+            raise ValidationError(
+                f"Las boletas {conflicting_numbers} ya están asignadas a otro vendedor")
+
     def save(self, *args, **kwargs):
-        self.clean()  # Call validation before saving
-        super().save(*args, **kwargs)
+        # The lottery stays locked from the validation to the write
+        with transaction.atomic():
+            self.clean()  # Call validation before saving
+            super().save(*args, **kwargs)
 
 
 class SellerBill(models.Model):
@@ -1,8 +1,10 @@
 from django.utils.dateparse import parse_date
 
-from django.utils.dateparse import parse_date
+from django.utils.dateparse import parse_date, parse_datetime
 from datetime import datetime, timedelta
+from django.db import transaction
 from django.utils import timezone
+from django.db.models import Max, Sum
 from django.db.models import Q as ComplexQueryFilter
 
 
@@ -22,20 +24,46 @@ def parse_dates(dates):
     return [parse_date(date_str) for date_str in dates if parse_date(date_str)]
 
 
+def coalesce_days(dates):
+    """
+    Sort the selected days and merge the consecutive ones.
+
+    Args:
+        dates (list): A list of date objects, in any order and with repeats.
+
+    Returns:
+        list: Tuples of the first and last day of every run of consecutive days.
+    """
+    day_runs = []
+    for date in sorted(set(dates)):
+        if day_runs and date - day_runs[-1][1] == timedelta(days=1):
+            day_runs[-1] = (day_runs[-1][0], date)
+        else:
+            day_runs.append((date, date))
+    return day_runs
+
+
 def adjust_date_range(dates):
     """
-    Adjust a list of dates to include the full day range with timezone awareness.
+    Adjust a list of dates to the fewest full-day ranges with timezone awareness.
+
+    Consecutive days are merged, so a month picked day by day in the
+    calendar becomes a single range.
 
     Args:
         dates (list): A list of datetime objects.
 
     Returns:
-        list: A list of tuples containing start and end datetime objects for each day.
+        list: A list of tuples containing the start and the exclusive end
+        datetime of every range of consecutive days.
     """
     adjusted_dates = []
-    for date in dates:
-        start_date = timezone.make_aware(datetime(date.year, date.month, date.day))
-        end_date = start_date + timedelta(days=1)
+    for first_day, last_day in coalesce_days(dates):
+        start_date = timezone.make_aware(
+            datetime(first_day.year, first_day.month, first_day.day))
+        end_day = last_day + timedelta(days=1)
+        end_date = timezone.make_aware(
+            datetime(end_day.year, end_day.month, end_day.day))
         adjusted_dates.append((start_date, end_date))
     return adjusted_dates
 
@@ -44,6 +72,9 @@ def build_complex_queries_filter_by_dates(dates) -> ComplexQueryFilter:
     """
     Build a complex query filter for filtering by date range.
 
+    It ORs one half-open range per run of consecutive days, which the
+    (seller, date) index of Payment answers with a range scan each.
+
     Args:
         dates (list): A list of datetime objects.
 
@@ -75,16 +106,110 @@ def filter_model_by_dates(seller_id, dates):
     return models.Payment.objects.filter(seller_id=seller_id).filter(queries)
 
 
-def generate_balance(payments):
+def group_client_balances(payments):
+    """
+    Group payments by client with their ticket number, total amount and
+    last payment date, in a single query.
     """
-    Generate a balance summary from a list of payments.
+    return (
+        payments.values("client_id", "client__ticket_number__number")
+        .annotate(total_amount=Sum("amount"), last_payment_date=Max("date"))
+        .order_by("client_id")
+    )
+
+
+def get_client_balances_by_dates(seller_id, dates):
+    """
+    Get the payment totals of every client of a seller in the selected dates
+    that no bill has settled yet, grouped by the database in a single query.
+
+    The payments are filtered the way a bill of those dates claims them, so
+    the balance the seller confirms is the bill that is generated. The daily
+    rollup is not read here, it also counts the payments already billed.
 
     Args:
-        payments (list): A list of dictionaries, where each dictionary represents a payment.
-            Each payment dictionary should contain:
-                - client_id (int): The ID of the client.
-                - amount (float): The amount of the payment.
-                - date (datetime.date): The date of the payment.
+        seller_id (int): The ID of the seller.
+        dates (list): A list of datetime objects.
+
+    Returns:
+        QuerySet: One row per client with its ticket number, total amount
+        and last payment date.
+    """
+    return group_client_balances(
+        filter_model_by_dates(seller_id, dates).filter(seller_bill__isnull=True)
+    )
+
+
+def get_outstanding_client_balances(seller_id, seller_bill=None):
+    """
+    Get the payment totals of every client of a seller over the payments
+    no bill has settled yet, grouped by the database in a single query.
+
+    The partial index on the unbilled payments keeps the cost proportional
+    to the payments since the last bill.
+
+    Args:
+        seller_id (int): The ID of the seller.
+        seller_bill (models.SellerBill, optional): Group the payments of
+            this bill instead of the outstanding ones.
+
+    Returns:
+        QuerySet: One row per client with its ticket number, total amount
+        and last payment date.
+    """
+    if seller_bill is None:
+        payments = models.Payment.objects.filter(
+            seller_id=seller_id, seller_bill__isnull=True)
+    else:
+        payments = models.Payment.objects.filter(seller_bill=seller_bill)
+
+    return group_client_balances(payments)
+
+
+def build_balance(client_balances):
+    """
+    Build the balance summary from the grouped rows of the clients.
+
+    Args:
+        client_balances (iterable): One dict per client with the client_id,
+            client__ticket_number__number, total_amount and
+            last_payment_date keys.
+
+    Returns:
+        dict: The balance summary, see generate_balance.
+    """
+    balance = {"total": {"amount": 0}}
+
+    for client_balance in client_balances:
+        client_id = client_balance["client_id"]
+        ticket_number = client_balance["client__ticket_number__number"]
+
+        balance["total"]["amount"] += client_balance["total_amount"]
+
+        balance[client_id] = {
+            "client_id": client_id,
+            "ticket_number": (
+                f"{str(ticket_number).zfill(4)}" if ticket_number is not None else ""
+            ),
+            "total_amount": client_balance["total_amount"],
+            "last_payment_date": client_balance["last_payment_date"],
+        }
+
+    return balance
+
+
+def generate_balance(seller_id, dates):
+    """
+    Generate the balance summary of the payments of a seller in the selected
+    dates that no bill has settled yet, the ones generate_seller_bill bills.
+
+    The per-client totals come from one grouped query and the grand total
+    is added up while reading its rows, so the balance costs one round trip
+    whatever the number of payments and clients.
+
+    Args:
+        seller_id (int): The ID of the seller.
+        dates (list): A list of datetime objects.
 
     Returns:
         dict: A dictionary representing the balance summary. The dictionary contains:
@@ -95,45 +220,39 @@ def generate_balance(payments):
                 - total_amount (float): The total amount of payments for the client.
                 - last_payment_date (datetime.date): The date of the last payment for the client.
     """
-    balance = {"total": {"amount": 0}}
-
-    for payment in payments:
-        client_id = payment.get("client_id")
-        amount = payment.get("amount")
-        date = payment.get("date")
+    return build_balance(get_client_balances_by_dates(seller_id, dates))
 
-        balance["total"]["amount"] += amount
 
-        if client_id in balance:
-            balance[client_id]["total_amount"] += amount
-            last_payment_date = balance.get(client_id).get("last_payment_date")
-            if date > last_payment_date:
-                balance[client_id]["last_payment_date"] = date
-        else:
-            ticket_number = models.ClientInfo.objects.get(
-                id=client_id
-            ).ticket_number.number
-
-            balance[client_id] = {
-                "client_id": client_id,
-                "ticket_number": f"{str(ticket_number).zfill(4)}",
-                "total_amount": amount,
-                "last_payment_date": date,
-            }
-
-    return balance
+def generate_outstanding_balance(seller_id):
+    """
+    Generate the balance summary of the payments of a seller that no bill
+    has settled yet, see generate_balance.
+    """
+    return build_balance(get_outstanding_client_balances(seller_id))
 
 
 from django.core.serializers.json import DjangoJSONEncoder
 import json
 
 
-def serialize_seller_bill_json(bill):
+SELLER_BILL_FIELDS = (
+    "id",
+    "first_name",
+    "last_name",
+    "document_number",
+    "city_residence",
+    "whatsapp",
+)
+
+
+def serialize_seller_bill_json(bill, payment_balances=None):
     """
     Serialize a SellerBill instance into JSON format, including all seller data and payment balances.
 
     Args:
         bill (models.SellerBill): The SellerBill instance to serialize.
+        payment_balances (list, optional): The ClientTicketPaymentBalance
+            instances of the bill, read from the database when not given.
 
     Returns:
         str: JSON representation of the SellerBill instance with all seller data and payment balances.
@@ -149,11 +268,22 @@ def serialize_seller_bill_json(bill):
     }
 
     # Fetch related payment balances
-    payment_balances = list(
-        bill.clientticketpaymentbalance_set.all().values(
-            "client_id", "ticket_number", "total_amount", "last_payment_date"
+    if payment_balances is None:
+        payment_balances = list(
+            bill.clientticketpaymentbalance_set.all().values(
+                "client_id", "ticket_number", "total_amount", "last_payment_date"
+            )
         )
-    )
+    else:
+        payment_balances = [
+            {
+                "client_id": payment_balance.client_id,
+                "ticket_number": payment_balance.ticket_number,
+                "total_amount": payment_balance.total_amount,
+                "last_payment_date": payment_balance.last_payment_date,
+            }
+            for payment_balance in payment_balances
+        ]
 
     # Serialize SellerBill instance
     data = {
@@ -167,50 +297,127 @@ def serialize_seller_bill_json(bill):
     return data
 
 
-def generate_seller_bill(seller_id, payments):
+def parse_payment_date(value):
+    if isinstance(value, str):
+        return parse_datetime(value)
+    return value
+
+
+def build_client_payment_balances(bill, balance):
     """
-    Generate a seller's bill and print the payment balances.
+    Build the unsaved payment balance rows of a bill.
+
+    The values are converted to the column types here, so the rows can be
+    serialized as they will be read back from the database.
 
     Args:
-        seller_id (int): The ID of the seller.
-        payments (list): A list of dictionaries, where each dictionary represents a payment.
-            Each payment dictionary should contain:
-                - client_id (int): The ID of the client.
-                - amount (float): The amount of the payment.
-                - date (datetime.date): The date of the payment.
+        bill (models.SellerBill): The bill the rows belong to.
+        balance (dict): The balance summary, as returned by generate_balance.
+
+    Returns:
+        list: A list of models.ClientTicketPaymentBalance instances.
     """
-    balance = payments
+    return [
+        models.ClientTicketPaymentBalance(
+            seller_bill=bill,
+            client_id=int(client_id),
+            # Clients without a ticket are billed under the number 0
+            ticket_number=int(details["ticket_number"] or 0),
+            total_amount=int(details["total_amount"]),
+            last_payment_date=parse_payment_date(details["last_payment_date"]),
+        )
+        for client_id, details in balance.items()
+        if client_id != "total"
+    ]
+
+
+def settle_payments(seller, payments, generation_date=None):
+    """
+    Bill the payments of a seller that no bill has settled yet.
+
+    The payments are claimed for the bill with a single UPDATE before they
+    are summed, so a payment is never billed twice and one written
+    meanwhile is left for the next bill.
+
+    Args:
+        seller (models.User): The seller to settle.
+        payments (QuerySet): The payments of the seller to bill, the ones
+            already billed are skipped.
+        generation_date (datetime, optional): Defaults to now.
+
+    Returns:
+        tuple: The saved bill and the list of its payment balances, None
+        when none of the payments is outstanding.
+    """
+    with transaction.atomic():
+        bill = models.SellerBill.objects.create(
+            generation_date=generation_date or timezone.now(),
+            seller=seller,
+            total_amount=0,
+        )
+        claimed = payments.filter(
+            seller=seller, seller_bill__isnull=True
+        ).update(seller_bill=bill)
+        if not claimed:
+            transaction.set_rollback(True)
+            return None
+
+        balance = build_balance(
+            get_outstanding_client_balances(seller.id, seller_bill=bill))
+        bill.total_amount = int(balance["total"]["amount"])
+        bill.save(update_fields=["total_amount"])
+        payment_balances = models.ClientTicketPaymentBalance.objects.bulk_create(
+            build_client_payment_balances(bill, balance)
+        )
+
+    return bill, payment_balances
 
-    bill = models.SellerBill(
-        generation_date=timezone.now(),
-        seller_id=seller_id,
-        total_amount=balance["total"]["amount"],
-    )
-    bill.save()
-    # Save client ticket payment balances
-    for client_id, details in balance.items():
-        if client_id != "total":
-            models.ClientTicketPaymentBalance.objects.create(
-                seller_bill=bill,
-                client_id=client_id,
-                ticket_number=details["ticket_number"],
-                total_amount=details["total_amount"],
-                last_payment_date=details["last_payment_date"],
-            )
 
-    return bill
+def settle_outstanding_payments(seller, generation_date=None):
+    """
+    Bill every payment of a seller that no bill has settled yet, see
+    settle_payments.
+    """
+    return settle_payments(seller, models.Payment.objects.all(), generation_date)
 
 
-def get_payments_by_dates(seller_id, dates):
+def generate_outstanding_seller_bill(seller_id):
     """
-    Get payments by seller ID and date range.
+    Settle the outstanding payments of a seller and serialize the bill.
 
     Args:
         seller_id (int): The ID of the seller.
-        dates (list): A list of datetime objects.
 
     Returns:
-        list: A list of payments filtered by the specified dates.
+        dict: The serialized bill, see serialize_seller_bill_json, None when
+        the seller has no outstanding payments.
+    """
+    seller = models.User.objects.only(*SELLER_BILL_FIELDS).get(id=seller_id)
+    settlement = settle_outstanding_payments(seller)
+    if settlement is None:
+        return None
+    return serialize_seller_bill_json(*settlement)
+
+
+def generate_seller_bill(seller_id, dates):
+    """
+    Bill the payments of a seller in the selected dates and serialize the
+    bill with its payment balances.
+
+    The payments are claimed for the bill like the outstanding ones, so the
+    ones a previous bill settled are skipped and an outstanding bill made
+    afterwards does not bill them again.
+
+    Args:
+        seller_id (int): The ID of the seller.
+        dates (list): A list of date objects.
+
+    Returns:
+        dict: The serialized bill, see serialize_seller_bill_json, None when
+        no payment of the dates is outstanding.
     """
-    payments = filter_model_by_dates(seller_id=seller_id, dates=dates).values()
-    return list(payments)
+    seller = models.User.objects.only(*SELLER_BILL_FIELDS).get(id=seller_id)
+    settlement = settle_payments(seller, filter_model_by_dates(seller_id, dates))
+    if settlement is None:
+        return None
+    return serialize_seller_bill_json(*settlement)
@@ -0,0 +1,32 @@
+from django.db import transaction
+
+from djangopwa import models
+from djangopwa.client_balance import add_client_payments
+from djangopwa.lottery_statistics import invalidate_lottery_statistics
+from djangopwa.payment_rollup import add_daily_payments
+
+
+def bulk_create_payments(payments):
+    """
+    Insert several payments with one statement.
+
+    bulk_create sends no post_save signals, so the stored client totals and
+    the daily rollup are moved here in the same transaction, with a fixed
+    number of queries whatever the number of payments.
+
+    Args:
+        payments (list): Unsaved models.Payment instances.
+
+    Returns:
+        list: The inserted payments.
+    """
+    if not payments:
+        return []
+
+    with transaction.atomic():
+        payments = models.Payment.objects.bulk_create(payments)
+        add_client_payments(payments)
+        add_daily_payments(payments)
+        transaction.on_commit(invalidate_lottery_statistics)
+
+    return payments
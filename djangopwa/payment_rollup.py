@@ -0,0 +1,167 @@
+from django.db import transaction
+from django.db.models import Count, Max, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from djangopwa import models
+from djangopwa.client_balance import is_client_deletion
+from djangopwa.payment_balance import adjust_date_range
+
+
+def get_rollup_key(seller_id, client_id, date):
+    if date is None:
+        return seller_id, client_id, None
+    if timezone.is_naive(date):
+        date = timezone.make_aware(date)
+    return seller_id, client_id, timezone.localdate(date)
+
+
+def compute_daily_payments(payments):
+    """
+    Group payments by seller, client and local day with one query.
+
+    Args:
+        payments (QuerySet): The Payment rows to roll up.
+
+    Returns:
+        QuerySet: One dict per (seller, client, day) with its total amount,
+        payment count and last payment date.
+    """
+    return (
+        payments.annotate(day=TruncDate("date"))
+        .values("seller_id", "client_id", "day")
+        .annotate(
+            total_amount=Sum("amount"),
+            payment_count=Count("id"),
+            last_payment_date=Max("date"),
+        )
+        .order_by()
+    )
+
+
+def build_rollup_rows(daily_payments):
+    return [
+        models.SellerDailyPayment(
+            seller_id=row["seller_id"],
+            client_id=row["client_id"],
+            day=row["day"],
+            total_amount=row["total_amount"] or 0,
+            payment_count=row["payment_count"],
+            last_payment_date=row["last_payment_date"],
+        )
+        for row in daily_payments
+    ]
+
+
+def refresh_daily_payments(rollup_keys):
+    """
+    Recompute the rollup rows of the given (seller, client, day) keys from
+    their payments.
+
+    A key only covers the payments of one client in one day, so the rows
+    are rebuilt from a handful of payments with three queries whatever the
+    size of the payment history.
+    """
+    rollup_keys = {key for key in rollup_keys if None not in key}
+    if not rollup_keys:
+        return
+
+    payments_filter = Q()
+    rollup_filter = Q()
+    for seller_id, client_id, day in rollup_keys:
+        [(start_date, end_date)] = adjust_date_range([day])
+        payments_filter |= Q(
+            seller_id=seller_id,
+            client_id=client_id,
+            date__gte=start_date,
+            date__lt=end_date,
+        )
+        rollup_filter |= Q(seller_id=seller_id, client_id=client_id, day=day)
+
+    with transaction.atomic():
+        daily_payments = compute_daily_payments(
+            models.Payment.objects.filter(payments_filter)
+        )
+        models.SellerDailyPayment.objects.filter(rollup_filter).delete()
+        models.SellerDailyPayment.objects.bulk_create(
+            build_rollup_rows(daily_payments))
+
+
+def rebuild_daily_payments(seller_id=None, batch_size=1000):
+    """
+    Rebuild the rollup from the whole payment history.
+
+    Args:
+        seller_id (int, optional): Only rebuild the rows of this seller.
+        batch_size (int): Rollup rows inserted per query.
+
+    Returns:
+        int: The number of rollup rows written.
+    """
+    payments = models.Payment.objects.all()
+    rollup = models.SellerDailyPayment.objects.all()
+    if seller_id is not None:
+        payments = payments.filter(seller_id=seller_id)
+        rollup = rollup.filter(seller_id=seller_id)
+
+    with transaction.atomic():
+        rollup.delete()
+        rows = build_rollup_rows(compute_daily_payments(payments).iterator())
+        models.SellerDailyPayment.objects.bulk_create(rows, batch_size=batch_size)
+
+    return len(rows)
+
+
+def add_daily_payments(payments):
+    """
+    Refresh the rollup rows of new payments, used after a bulk insert.
+    """
+    refresh_daily_payments(
+        {
+            get_rollup_key(payment.seller_id, payment.client_id, payment.date)
+            for payment in payments
+        }
+    )
+
+
+def on_payment_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+
+    rollup_keys = {
+        get_rollup_key(instance.seller_id, instance.client_id, instance.date)
+    }
+
+    loaded_values = instance.get_loaded_values()
+    if not created and loaded_values is not None:
+        # The payment may have moved to another seller, client or day
+        rollup_keys.add(
+            get_rollup_key(
+                loaded_values["seller_id"],
+                loaded_values["client_id"],
+                loaded_values["date"],
+            )
+        )
+
+    refresh_daily_payments(rollup_keys)
+
+
+def on_payment_deleted(sender, instance, origin=None, **kwargs):
+    # The rollup rows of the client are deleted in the same cascade
+    if is_client_deletion(origin):
+        return
+
+    loaded_values = instance.get_loaded_values() or {
+        "seller_id": instance.seller_id,
+        "client_id": instance.client_id,
+        "date": instance.date,
+    }
+    refresh_daily_payments(
+        [
+            get_rollup_key(
+                loaded_values["seller_id"],
+                loaded_values["client_id"],
+                loaded_values["date"],
+            )
+        ]
+    )
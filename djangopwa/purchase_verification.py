@@ -0,0 +1,270 @@
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+
+from django.db import transaction
+from django.db.models import Count, F, Q, Sum
+
+from djangopwa import constants
+from djangopwa import models
+from djangopwa.lottery_statistics import invalidate_lottery_statistics
+from djangopwa.ticket_availability import ticket_state_changed
+
+
+@dataclass
+class PurchaseResult:
+    processed: list = field(default_factory=list)
+    not_found: list = field(default_factory=list)
+
+    def as_results(self):
+        """
+        One result per requested client ID, for the JSON responses.
+        """
+        results = [
+            {"client_id": client_id, "success": True}
+            for client_id in self.processed
+        ]
+        results.extend(
+            {"client_id": client_id, "success": False, "error": "Client not found"}
+            for client_id in self.not_found
+        )
+        return sorted(results, key=lambda result: result["client_id"])
+
+
+def lock_clients(client_ids):
+    """
+    Lock the clients and read their tickets.
+
+    Returns:
+        list: Tuples of (client_id, ticket_id, lottery_id, ticket_number,
+        purchase_reference) of the clients that have a ticket.
+    """
+    return list(
+        models.ClientInfo.objects.select_for_update(of=("self",))
+        .filter(id__in=client_ids, ticket_number__isnull=False)
+        .values_list(
+            "id",
+            "ticket_number_id",
+            "ticket_number__lottery_id",
+            "ticket_number__number",
+            "purchase_reference",
+        )
+    )
+
+
+def build_result(client_ids, clients):
+    processed = {client_id for client_id, _, _, _, _ in clients}
+    return PurchaseResult(
+        processed=sorted(processed),
+        not_found=[
+            client_id for client_id in client_ids if client_id not in processed],
+    )
+
+
+def record_ticket_states(clients, previous_states, state):
+    """
+    Record the transition of the tickets of the clients that changed.
+
+    Args:
+        clients (list): The rows returned by lock_clients.
+        previous_states (dict): The state before the transition keyed by
+            the ID of each changed ticket.
+        state (int): The new state of the tickets.
+    """
+    changed_numbers = defaultdict(list)
+    changed_states = defaultdict(Counter)
+    for _, ticket_id, lottery_id, ticket_number, _ in clients:
+        if ticket_id in previous_states:
+            changed_numbers[lottery_id].append(ticket_number)
+            changed_states[lottery_id][previous_states[ticket_id]] += 1
+
+    for lottery_id, ticket_numbers in changed_numbers.items():
+        ticket_state_changed(
+            lottery_id, ticket_numbers, state, changed_states[lottery_id])
+
+
+def verify_clients(client_ids, transaction_id=""):
+    """
+    Move the tickets of several clients to PURCHASED in one transaction.
+
+    The same steps as verifying one ticket by hand, with set based
+    statements: one UPDATE of the tickets, one bulk insert of the missing
+    TicketPurchased rows and one DELETE per holding table, so the number of
+    queries does not depend on the number of clients.
+
+    Args:
+        client_ids (list): The IDs of the clients to verify.
+        transaction_id (str): Stored on the new TicketPurchased rows.
+
+    Returns:
+        PurchaseResult: The verified and the unknown client IDs.
+    """
+    client_ids = sorted(set(client_ids))
+    if not client_ids:
+        return PurchaseResult()
+
+    with transaction.atomic():
+        clients = lock_clients(client_ids)
+        ticket_ids = [ticket_id for _, ticket_id, _, _, _ in clients]
+
+        purchased_tickets = dict(
+            models.Ticket.objects.filter(id__in=ticket_ids)
+            .exclude(state=constants.TicketState.PURCHASED)
+            .values_list("id", "state")
+        )
+        models.Ticket.objects.filter(id__in=purchased_tickets).update(
+            state=constants.TicketState.PURCHASED
+        )
+
+        already_purchased = set(
+            models.TicketPurchased.objects.filter(
+                client_id__in=[client_id for client_id, _, _, _, _ in clients]
+            ).values_list("client_id", "ticket_id")
+        )
+        models.TicketPurchased.objects.bulk_create(
+            [
+                models.TicketPurchased(
+                    ticket_id=ticket_id,
+                    client_id=client_id,
+                    transaction_id=transaction_id,
+                    purchase_reference=purchase_reference,
+                )
+                for client_id, ticket_id, _, _, purchase_reference in clients
+                if (client_id, ticket_id) not in already_purchased
+            ]
+        )
+
+        models.TicketReserved.objects.filter(ticket_id__in=ticket_ids).delete()
+        models.TicketPendingPurchase.objects.filter(ticket_id__in=ticket_ids).delete()
+
+        record_ticket_states(
+            clients, purchased_tickets, constants.TicketState.PURCHASED)
+
+    return build_result(client_ids, clients)
+
+
+def decline_clients(client_ids):
+    """
+    Release the tickets of several clients and delete the clients in one
+    transaction, the same as declining one ticket by hand.
+
+    The tickets go back to AVAILABLE with one UPDATE and the clients are
+    deleted by a ClientInfo queryset, which takes the money they paid out
+    of their lotteries with one aggregate. The payments deleted in cascade
+    skip the totals and the rollup of their client, deleted with it, so the
+    number of queries does not depend on the number of clients.
+
+    Args:
+        client_ids (list): The IDs of the clients to decline.
+
+    Returns:
+        PurchaseResult: The declined and the unknown client IDs.
+    """
+    client_ids = sorted(set(client_ids))
+    if not client_ids:
+        return PurchaseResult()
+
+    with transaction.atomic():
+        clients = lock_clients(client_ids)
+        ticket_ids = [ticket_id for _, ticket_id, _, _, _ in clients]
+
+        released_tickets = dict(
+            models.Ticket.objects.filter(id__in=ticket_ids)
+            .exclude(state=constants.TicketState.AVAILABLE)
+            .values_list("id", "state")
+        )
+        models.Ticket.objects.filter(id__in=released_tickets).update(
+            state=constants.TicketState.AVAILABLE
+        )
+
+        # Clients without a ticket are declined too
+        declined = set(
+            models.ClientInfo.objects.filter(id__in=client_ids).values_list(
+                "id", flat=True)
+        )
+        models.ClientInfo.objects.filter(id__in=declined).delete()
+
+        record_ticket_states(
+            clients, released_tickets, constants.TicketState.AVAILABLE)
+        transaction.on_commit(invalidate_lottery_statistics)
+
+    return PurchaseResult(
+        processed=sorted(declined),
+        not_found=[client_id for client_id in client_ids if client_id not in declined],
+    )
+
+
+def get_foreign_client_ids(user, client_ids):
+    """
+    Get the clients a user may not act on: none for a superuser, the
+    clients of other sellers for a seller, like filter_own_rows in the admin.
+
+    Args:
+        user (models.User): The user acting on the clients.
+        client_ids (list): The requested client IDs.
+
+    Returns:
+        list: The IDs of the clients of other sellers.
+    """
+    if user.is_superuser:
+        return []
+    return sorted(
+        models.ClientInfo.objects.filter(id__in=client_ids)
+        .exclude(seller=user)
+        .values_list("id", flat=True)
+    )
+
+
+def get_paid_reserved_clients(purchase_references=None):
+    """
+    Get the clients with a reserved ticket whose purchase reference is paid
+    in full, with one grouped query.
+
+    A reference is paid once the stored totals of its clients add up to the
+    price of all its tickets.
+
+    Args:
+        purchase_references (list, optional): Only look at these references.
+
+    Returns:
+        list: The client IDs.
+    """
+    clients = models.ClientInfo.objects.exclude(
+        Q(purchase_reference__isnull=True) | Q(purchase_reference="")
+    )
+    if purchase_references is not None:
+        clients = clients.filter(purchase_reference__in=purchase_references)
+
+    paid_references = (
+        clients.values("purchase_reference")
+        .annotate(
+            paid=Sum("paid_total"),
+            due=Sum("ticket_number__lottery__price_per_ticket"),
+            tickets=Count("ticket_number"),
+        )
+        .filter(tickets__gt=0, paid__gte=F("due") - 0.005)
+        .values("purchase_reference")
+    )
+
+    return list(
+        clients.filter(
+            purchase_reference__in=paid_references,
+            ticket_number__state=constants.TicketState.RESERVED,
+        ).values_list("id", flat=True)
+    )
+
+
+def verify_paid_purchases(purchase_references=None, transaction_id=""):
+    """
+    Verify the tickets of every purchase reference paid in full.
+
+    Args:
+        purchase_references (list, optional): Only verify these references.
+        transaction_id (str): The payment transaction, stored on the
+            TicketPurchased rows.
+
+    Returns:
+        PurchaseResult: The verified clients.
+    """
+    return verify_clients(
+        get_paid_reserved_clients(purchase_references), transaction_id
+    )
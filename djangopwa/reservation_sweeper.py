@@ -0,0 +1,160 @@
+import logging
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from djangopwa import constants
+from djangopwa import models
+from djangopwa.ticket_availability import ticket_state_changed
+
+logger = logging.getLogger(__name__)
+
+
+# Holding tables swept, both store the expiration of the reservation
+HOLDING_MODELS = (models.TicketReserved, models.TicketPendingPurchase)
+
+
+@dataclass
+class SweepBatch:
+    model_name: str
+    rows: int
+    released_tickets: int
+    seconds: float
+
+
+def get_client_payments():
+    return models.Payment.objects.filter(client_id=OuterRef("client_id"))
+
+
+def count_paid_expired_holdings(now=None):
+    """
+    Count the expired reservations the sweeper keeps because their client
+    paid something.
+    """
+    return models.TicketReserved.objects.filter(
+        expiration__lt=now or timezone.now()
+    ).filter(Exists(get_client_payments())).count()
+
+
+def lock_expired_holdings(model, now, batch_size):
+    """
+    Lock a batch of expired holdings whose client has not paid anything.
+
+    A client holds a single ticket, so a ticket with any payment stays
+    reserved after its expiration until an admin verifies or declines it,
+    see count_paid_expired_holdings. The unpaid tickets of the same
+    purchase are released.
+
+    The range scan uses the index on ``expiration``. Rows locked by another
+    node running the sweeper are skipped, so several nodes share the work.
+
+    Returns:
+        list: Tuples of (client_id, ticket_id, lottery_id, ticket_number).
+    """
+    return list(
+        model.objects.select_for_update(skip_locked=True, of=("self",))
+        .filter(expiration__lt=now)
+        .filter(~Exists(get_client_payments()))
+        .order_by("expiration")
+        .values_list("client_id", "ticket_id", "ticket__lottery_id", "ticket__number")[
+            :batch_size
+        ]
+    )
+
+
+def release_expired_holdings(model, now, batch_size):
+    """
+    Release one batch of expired holdings of a model.
+
+    The tickets still RESERVED without a payment are locked and go back to
+    AVAILABLE, and the clients of those abandoned checkouts are deleted,
+    which also deletes their holding rows, the same way an admin declines
+    a ticket. A ticket verified or paid since the holdings were read is
+    left alone with its client, only the holdings of a ticket that is no
+    longer reserved are deleted, so they are not swept again.
+
+    Returns:
+        tuple: The number of holdings processed and of tickets released.
+    """
+    with transaction.atomic():
+        holdings = lock_expired_holdings(model, now, batch_size)
+        if not holdings:
+            return 0, 0
+
+        ticket_ids = {ticket_id for _, ticket_id, _, _ in holdings}
+
+        releasable_tickets = models.Ticket.objects.filter(
+            id__in=ticket_ids, state=constants.TicketState.RESERVED
+        ).exclude(
+            Exists(models.Payment.objects.filter(client__ticket_number=OuterRef("id")))
+        )
+        released_ticket_ids = set(
+            releasable_tickets.select_for_update().values_list("id", flat=True)
+        )
+        models.Ticket.objects.filter(
+            id__in=released_ticket_ids, state=constants.TicketState.RESERVED
+        ).update(state=constants.TicketState.AVAILABLE)
+
+        models.ClientInfo.objects.filter(
+            ticket_number_id__in=released_ticket_ids,
+            id__in={client_id for client_id, _, _, _ in holdings},
+        ).delete()
+        model.objects.filter(ticket_id__in=ticket_ids - released_ticket_ids).exclude(
+            ticket__state=constants.TicketState.RESERVED
+        ).delete()
+
+        released_numbers = defaultdict(list)
+        for _, ticket_id, lottery_id, ticket_number in holdings:
+            if ticket_id in released_ticket_ids:
+                released_numbers[lottery_id].append(ticket_number)
+
+        for lottery_id, ticket_numbers in released_numbers.items():
+            ticket_state_changed(
+                lottery_id,
+                ticket_numbers,
+                constants.TicketState.AVAILABLE,
+                previous_states={constants.TicketState.RESERVED: len(ticket_numbers)},
+            )
+
+    return len(holdings), len(released_ticket_ids)
+
+
+def sweep_expired_reservations(batch_size=constants.RESERVATION_SWEEP_BATCH_SIZE, now=None):
+    """
+    Release every expired reservation in batches.
+
+    Args:
+        batch_size (int): Maximum number of holdings released per transaction.
+        now (datetime, optional): The reference time, defaults to now.
+
+    Yields:
+        SweepBatch: The statistics of every processed batch.
+    """
+    now = now or timezone.now()
+
+    for model in HOLDING_MODELS:
+        while True:
+            started_at = time.monotonic()
+            rows, released_tickets = release_expired_holdings(
+                model, now, batch_size)
+            if not rows:
+                break
+
+            batch = SweepBatch(
+                model_name=model._meta.model_name,
+                rows=rows,
+                released_tickets=released_tickets,
+                seconds=time.monotonic() - started_at,
+            )
+            logger.info(
+                "Released %s expired %s rows (%s tickets) in %.3fs",
+                batch.rows,
+                batch.model_name,
+                batch.released_tickets,
+                batch.seconds,
+            )
+            yield batch
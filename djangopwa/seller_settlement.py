@@ -0,0 +1,178 @@
+import csv
+from dataclasses import dataclass
+from itertools import groupby
+from operator import itemgetter
+
+from django.db import transaction
+from django.db.models import Case, Count, IntegerField, Max, Sum, Value, When
+from django.utils import timezone
+
+from djangopwa import models
+from djangopwa.payment_balance import (
+    SELLER_BILL_FIELDS,
+    build_balance,
+    build_client_payment_balances,
+)
+
+
+SETTLEMENT_SUMMARY_HEADER = (
+    "seller_id",
+    "username",
+    "first_name",
+    "last_name",
+    "bill_id",
+    "clients",
+    "payments",
+    "total_amount",
+)
+
+
+@dataclass
+class SellerSettlement:
+    bill: models.SellerBill
+    payment_balances: list
+    payment_count: int
+
+    @property
+    def seller(self):
+        return self.bill.seller
+
+
+def create_empty_bills(sellers, generation_date):
+    bills = models.SellerBill.objects.bulk_create(
+        [
+            models.SellerBill(
+                generation_date=generation_date, seller=seller, total_amount=0
+            )
+            for seller in sellers
+        ]
+    )
+    if all(bill.pk for bill in bills):
+        return bills
+
+    # Backends that do not return the inserted primary keys (MySQL)
+    sellers_by_id = {seller.id: seller for seller in sellers}
+    bills = list(
+        models.SellerBill.objects.filter(
+            generation_date=generation_date, seller_id__in=sellers_by_id
+        )
+    )
+    for bill in bills:
+        bill.seller = sellers_by_id[bill.seller_id]
+    return bills
+
+
+def settle_sellers(seller_ids=None, generation_date=None):
+    """
+    Bill the outstanding payments of every seller in one run.
+
+    One bill per seller with outstanding payments is bulk inserted, the
+    payments are claimed for their bills with a single UPDATE, and the
+    balances of all the sellers come from one grouped query and are written
+    with one bulk insert. The number of queries does not depend on the
+    number of sellers, clients or payments.
+
+    Args:
+        seller_ids (list, optional): Only settle these sellers.
+        generation_date (datetime, optional): Defaults to now.
+
+    Returns:
+        list: A SellerSettlement per billed seller, ordered by seller ID.
+    """
+    generation_date = generation_date or timezone.now()
+
+    outstanding = models.Payment.objects.filter(seller_bill__isnull=True)
+    if seller_ids is not None:
+        outstanding = outstanding.filter(seller_id__in=seller_ids)
+
+    with transaction.atomic():
+        sellers = list(
+            models.User.objects.only(*SELLER_BILL_FIELDS, "username")
+            .filter(id__in=outstanding.values("seller_id"))
+            .order_by("id")
+        )
+        if not sellers:
+            return []
+
+        bills = {
+            bill.pk: bill for bill in create_empty_bills(sellers, generation_date)
+        }
+        outstanding.filter(
+            seller_id__in=[bill.seller_id for bill in bills.values()]
+        ).update(
+            seller_bill_id=Case(
+                *[
+                    When(seller_id=bill.seller_id, then=Value(bill.pk))
+                    for bill in bills.values()
+                ],
+                output_field=IntegerField(),
+            )
+        )
+
+        client_balances = (
+            models.Payment.objects.filter(seller_bill_id__in=bills)
+            .values("seller_bill_id", "client_id", "client__ticket_number__number")
+            .annotate(
+                total_amount=Sum("amount"),
+                last_payment_date=Max("date"),
+                payment_count=Count("id"),
+            )
+            .order_by("seller_bill_id", "client_id")
+        )
+
+        settlements = []
+        for bill_id, rows in groupby(client_balances, key=itemgetter("seller_bill_id")):
+            rows = list(rows)
+            bill = bills.pop(bill_id)
+            balance = build_balance(rows)
+            bill.total_amount = int(balance["total"]["amount"])
+            settlements.append(
+                SellerSettlement(
+                    bill=bill,
+                    payment_balances=build_client_payment_balances(bill, balance),
+                    payment_count=sum(row["payment_count"] for row in rows),
+                )
+            )
+
+        if bills:
+            # Their payments were settled meanwhile by another run
+            models.SellerBill.objects.filter(pk__in=bills).delete()
+
+        models.SellerBill.objects.bulk_update(
+            [settlement.bill for settlement in settlements], ["total_amount"]
+        )
+        models.ClientTicketPaymentBalance.objects.bulk_create(
+            [
+                payment_balance
+                for settlement in settlements
+                for payment_balance in settlement.payment_balances
+            ]
+        )
+
+    settlements.sort(key=lambda settlement: settlement.bill.seller_id)
+    return settlements
+
+
+def write_settlement_summary(settlements, file):
+    """
+    Write one CSV line per settled seller to an open text file.
+
+    Args:
+        settlements (list): The SellerSettlement list of settle_sellers.
+        file: The file object to write to.
+    """
+    writer = csv.writer(file)
+    writer.writerow(SETTLEMENT_SUMMARY_HEADER)
+    for settlement in settlements:
+        writer.writerow(
+            [
+                settlement.seller.id,
+                settlement.seller.username,
+                settlement.seller.first_name,
+                settlement.seller.last_name,
+                settlement.bill.pk,
+                len(settlement.payment_balances),
+                settlement.payment_count,
+                settlement.bill.total_amount,
+            ]
+        )
@@ -391,7 +391,7 @@ const getCurrentLotteryId = () => {
  */
 const buildEndpointRandomTicketNumber = () => {
     const lotteryId = getCurrentLotteryId();
-    const endpointUrl = `/api/lottery/${lotteryId}/random_available_ticket/`;
+    const endpointUrl = `/api/lottery/${lotteryId}/random_available_ticket/?hold=1`;
     return endpointUrl;
 };
 
@@ -375,9 +375,10 @@ const MultiDateCalendarComponent = (calendarTitle = "", onClickSearchButton = ()
  *
  * @param {number} seller_id - The ID of the seller for whom the balance is displayed.
  * @param {Object} data - The data object containing client details and total amount.
+ * @param {Array} dates - The selected dates the balance covers.
  * @returns {HTMLDivElement} The container element containing the rendered balance table component.
  */
-const BalanceTableComponent = (seller_id, data) => {
+const BalanceTableComponent = (seller_id, data, dates) => {
     /**
      * Creates a cell element (either 'th' for header or 'td' for data).
      *
@@ -778,17 +779,18 @@ const BalanceTableComponent = (seller_id, data) => {
     /**
      * Performs a request to generate a seller bill using payment balance data.
      *
-     * @param {Object} paymentBalance - The payment balance data object.
+     * @param {Array} selectedDates - The selected dates whose payments are billed.
      * @param {number} sellerID - The ID of the seller for whom to generate the bill.
      */
-    const performGenerateSellerBill = (paymentBalance, sellerID) => {
+    const performGenerateSellerBill = (selectedDates, sellerID) => {
         const loadingModal = createLoadingModal(); // Assume this function creates a loading modal
         document.body.appendChild(loadingModal);
 
         const endpointUrl = buildEndpointGenerateSellerBill(sellerID);
 
+        // The server bills the payments of these dates no bill has settled yet
         const requestBody = {
-            payments: paymentBalance
+            dates: selectedDates
         };
 
         const csrfToken = getCookie('csrftoken'); // Assuming getCookie function exists
@@ -810,7 +812,7 @@ const BalanceTableComponent = (seller_id, data) => {
      * Handles the click event for the "Generate Bill" button.
      */
     const handleOnClickGenerateBillButton = () => {
-        performGenerateSellerBill(data, seller_id); // Assuming data and seller_id are accessible
+        performGenerateSellerBill(dates, seller_id); // Assuming data and seller_id are accessible
     };
 
     /**
@@ -1012,7 +1014,7 @@ const removeLoadingModal = () => {
 };
 
 
-const createBalancePaymentModal = (seller_id, result) => {
+const createBalancePaymentModal = (seller_id, result, selectedDates) => {
     const balancePaymentModal = createModal("balance_payment_modal");
     const balanceContainer = document.createElement('div');
     balanceContainer.classList.add("balance-payment-modal-container");
@@ -1032,7 +1034,7 @@ const createBalancePaymentModal = (seller_id, result) => {
 
     balanceContainer.innerHTML += styles
 
-    balanceContainer.appendChild(BalanceTableComponent(seller_id, result.data));
+    balanceContainer.appendChild(BalanceTableComponent(seller_id, result.data, selectedDates));
 
     balancePaymentModal.appendChild(balanceContainer);
     return balancePaymentModal;
@@ -1070,12 +1072,13 @@ const buildEndpointGetPaymentBalance = (sellerID) => {
 /**
  * Handles the response from a fetch request and logs the result.
  * @param {Object} result - The response result from the fetch request.
+ * @param {Array} selectedDates - The selected dates the balance covers.
  */
-const handleRequestPaymentBalanceResponse = (seller_id, result) => {
+const handleRequestPaymentBalanceResponse = (seller_id, result, selectedDates) => {
     removeLoadingModal();
     const modals = document.querySelectorAll('.payment_balance_modal');
     if (modals) modals.forEach((modal) => document.body.removeChild(modal));
-    balanceModalElement = createBalancePaymentModal(seller_id, result)
+    balanceModalElement = createBalancePaymentModal(seller_id, result, selectedDates)
     document.body.appendChild(balanceModalElement)
 };
 
@@ -1108,7 +1111,7 @@ const performPaymentBalanceRequest = (sellerID, selectedDates) => {
         body: JSON.stringify(requestBody)
     })
         .then(handleBadRequestResponse)
-        .then((result) => handleRequestPaymentBalanceResponse(sellerID, result))
+        .then((result) => handleRequestPaymentBalanceResponse(sellerID, result, selectedDates))
         .catch(handleCatchExceptionErrorRequest);
 };
 
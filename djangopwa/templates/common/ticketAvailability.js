@@ -0,0 +1,128 @@
+/**
+ * Interval in milliseconds between two availability synchronizations.
+ */
+const TICKET_AVAILABILITY_SYNC_INTERVAL_MS = 30000;
+
+/**
+ * Decodes the compact availability payload rendered by the server.
+ * Bit i of the bitset is set when the ticket number lower + i is available.
+ * @param {Object} payload - The payload with the lower bound and the base64 bitset.
+ * @returns {number[]} The available ticket numbers in ascending order.
+ */
+const decodeAvailableTickets = (payload) => {
+  const bytes = atob(payload.bitset);
+  const ticketNumbers = [];
+
+  for (let byteIndex = 0; byteIndex < bytes.length; ++byteIndex) {
+    const byte = bytes.charCodeAt(byteIndex);
+    if (byte === 0) continue;
+
+    for (let bit = 0; bit < 8; ++bit) {
+      if (byte & (1 << bit)) {
+        ticketNumbers.push(payload.lower + byteIndex * 8 + bit);
+      }
+    }
+  }
+
+  return ticketNumbers;
+};
+
+/**
+ * Reads the availability payload embedded in the page with json_script.
+ * @param {string} elementId - The id of the json_script element.
+ * @returns {Object} The availability state with the lottery id, the version
+ * and the set of available ticket numbers.
+ */
+const loadAvailableTickets = (elementId) => {
+  const payload = JSON.parse(document.getElementById(elementId).textContent);
+
+  return {
+    lotteryId: payload.lottery_id,
+    version: payload.version,
+    ticketNumbers: new Set(decodeAvailableTickets(payload)),
+  };
+};
+
+/**
+ * Returns the available ticket numbers of an availability state in ascending order.
+ * @param {Object} availability - The availability state.
+ * @returns {number[]} The sorted available ticket numbers.
+ */
+const getAvailableTicketNumbers = (availability) =>
+  Array.from(availability.ticketNumbers).sort((a, b) => a - b);
+
+/**
+ * Renders one grid item per available ticket number.
+ * @param {string} gridId - The id of the grid container.
+ * @param {Object} availability - The availability state.
+ * @param {number[]} selectedTicketNumbers - The ticket numbers to highlight.
+ */
+const renderAvailableTicketsGrid = (
+  gridId,
+  availability,
+  selectedTicketNumbers = []
+) => {
+  const grid = document.getElementById(gridId);
+  if (!grid) return;
+
+  const fragment = document.createDocumentFragment();
+
+  getAvailableTicketNumbers(availability).forEach((ticketNumber) => {
+    const gridItem = document.createElement("div");
+    gridItem.id = `grid-item-ticket-number-${ticketNumber}`;
+    gridItem.className =
+      "ticket-number text-center border hover:brightness-200 hover:bg-zinc-600";
+    if (selectedTicketNumbers.includes(ticketNumber)) {
+      gridItem.classList.add("card-selected-ticket");
+    }
+    gridItem.innerText = ticketNumber.toString().padStart(4, "0");
+    fragment.appendChild(gridItem);
+  });
+
+  grid.replaceChildren(fragment);
+};
+
+/**
+ * Asks the server for the tickets that changed since the known version and
+ * applies them to the availability state.
+ * @param {Object} availability - The availability state to update.
+ * @returns {Promise<boolean>} True when the availability changed.
+ */
+const syncAvailableTickets = async (availability) => {
+  const response = await fetch(
+    `/api/lottery/${availability.lotteryId}/ticket_availability?version=${availability.version}`
+  );
+
+  // 304 means the client is already up to date
+  if (response.status === 304 || !response.ok) return false;
+
+  const data = await response.json();
+
+  if (data.full) {
+    availability.ticketNumbers = new Set(decodeAvailableTickets(data));
+  } else {
+    data.available.forEach((ticketNumber) =>
+      availability.ticketNumbers.add(ticketNumber)
+    );
+    data.unavailable.forEach((ticketNumber) =>
+      availability.ticketNumbers.delete(ticketNumber)
+    );
+  }
+
+  availability.version = data.version;
+  return true;
+};
+
+/**
+ * Periodically synchronizes the availability state with the server.
+ * @param {Object} availability - The availability state to keep up to date.
+ * @param {Function} onChange - Called after every synchronization that changed something.
+ */
+const startAvailableTicketsSync = (availability, onChange) =>
+  setInterval(async () => {
+    try {
+      if (await syncAvailableTickets(availability)) onChange();
+    } catch (error) {
+      console.error("Could not sync the available tickets:", error);
+    }
+  }, TICKET_AVAILABILITY_SYNC_INTERVAL_MS);
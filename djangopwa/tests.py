@@ -1,3 +1,1598 @@
-from django.test import TestCase
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from importlib import import_module
+from unittest import mock
 
-# Create your tests here.
+from django.apps import apps
+
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.contrib import admin
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Q, QuerySet
+from django.test import RequestFactory, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from djangopwa import constants
+from djangopwa import models
+from djangopwa import reservation_sweeper
+from djangopwa.checkout_hold import (
+    HOLD_PURPOSE_ROULETTE,
+    SESSION_HOLD_OWNER_KEY,
+    acquire_holds,
+    get_foreign_holds,
+    get_owner_holds,
+)
+from djangopwa.crud_views.crud_lottery import create_ticket_purchases
+from djangopwa.forms.ticket_forms import TicketAssignmentForm
+from djangopwa.lottery_counters import add_lottery_tickets, refresh_lottery_counters
+from djangopwa.lottery_statistics import get_lottery_statistics
+from djangopwa.payment_balance import (
+    generate_balance,
+    generate_seller_bill,
+    settle_outstanding_payments,
+)
+from djangopwa.payment_bulk import bulk_create_payments
+from djangopwa.purchase_verification import (
+    decline_clients,
+    verify_clients,
+    verify_paid_purchases,
+)
+from djangopwa.reservation_sweeper import sweep_expired_reservations
+from djangopwa.seller_settlement import settle_sellers
+from djangopwa.ticket_availability import (
+    get_availability_changes,
+    get_availability_index,
+    get_cached_availability_index,
+    prune_ticket_state_changes,
+    update_availability_index,
+)
+from djangopwa.ticket_reservation import reserve_tickets
+from djangopwa.webhook_queue import (
+    enqueue_event,
+    get_retry_delay,
+    process_event_batch,
+    requeue_dead_events,
+)
+from djangopwa.ticket_assignment import (
+    build_intervals_filter,
+    coalesce_intervals,
+    get_assignment_index,
+    get_seller_intervals,
+)
+from djangopwa.ticket_sampler import TicketSampler
+from djangopwa.wompi_events import build_transaction, sign_transaction_event
+from djangopwa.wompi_webhook import (
+    process_event,
+    process_queued_event,
+    validate_signature_hash256,
+)
+from djangopwa.wompi_fake_server import FakeWompiServer
+from lottery.wompi import wompi
+from djangopwa.wompi_reconciliation import (
+    WompiTransactionsClient,
+    get_pending_references,
+    reconcile_references,
+)
+
+
+def create_lottery(ticket_count=10, with_tickets=True, **fields):
+    """
+    Create a lottery numbered from 0 to ``ticket_count - 1``, with its
+    available tickets and counters unless ``with_tickets`` is False.
+    """
+    now = timezone.now()
+    lottery = models.Lottery.objects.create(
+        **{
+            "name": "Rifa",
+            "description": "Rifa de prueba",
+            "lottery_date_1": now,
+            "lottery_date_2": now,
+            "lottery_date_3": now,
+            "lottery_date_4": now,
+            "price_per_ticket": 10000,
+            "lower_series_range": 0,
+            "upper_series_range": ticket_count - 1,
+            **fields,
+        }
+    )
+    if with_tickets:
+        add_lottery_tickets(
+            models.Ticket.objects.bulk_create(
+                [
+                    models.Ticket(lottery=lottery, number=number)
+                    for number in range(ticket_count)
+                ]
+            )
+        )
+    return lottery
+
+
+def build_client_data(purchase_reference="REF"):
+    return {
+        "name": "Nombre",
+        "lastname": "Apellido",
+        "whatsapp": 3000000000,
+        "document_number": 123456,
+        "city": "Ciudad",
+        "purchase_reference": purchase_reference,
+    }
+
+
+class SerialExecutor:
+    """
+    Runs the work of an executor on the calling thread, inside the test
+    transaction.
+    """
+
+    def map(self, function, *iterables):
+        return map(function, *iterables)
+
+
+class LotteryTestMixin:
+    """
+    Seeds a seller and a lottery of ``ticket_count`` available tickets.
+    """
+
+    ticket_count = 10
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = models.User.objects.create(username="vendedor")
+        cls.lottery = create_lottery(cls.ticket_count)
+
+    def reserve(self, ticket_numbers, purchase_reference="REF", **kwargs):
+        return reserve_tickets(
+            self.lottery,
+            ticket_numbers,
+            build_client_data(purchase_reference),
+            seller=self.seller,
+            **kwargs,
+        )
+
+    def get_client(self, ticket_number):
+        return models.ClientInfo.objects.get(
+            ticket_number__lottery=self.lottery,
+            ticket_number__number=ticket_number,
+        )
+
+    def build_payment(self, client, amount, date=None):
+        return models.Payment(
+            seller=self.seller,
+            client=client,
+            amount=amount,
+            date=date or timezone.now(),
+            payment_type="BONO1",
+        )
+
+    def add_payment(self, ticket_number, amount, date=None):
+        payment = self.build_payment(self.get_client(ticket_number), amount, date)
+        payment.save()
+        return payment
+
+
+class AdminTicketTablesQueryCountTest(TestCase):
+    """
+    The pending, reserved, purchased and with payment tables must render a
+    page with the same number of queries whatever the number of rows.
+    """
+
+    TABLE_MODELS = (
+        models.TicketPendingPurchase,
+        models.TicketReserved,
+        models.TicketPurchased,
+        models.TicketWithPayment,
+    )
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin_user = models.User.objects.create_superuser(
+            username="admin", password="admin", email="admin@example.com"
+        )
+        cls.lottery = create_lottery(ticket_count=100, with_tickets=False)
+        cls.next_number = 0
+
+    def setUp(self):
+        self.client.force_login(self.admin_user)
+
+    def create_rows(self, count):
+        expiration = timezone.now() + timezone.timedelta(days=1)
+
+        for _ in range(count):
+            ticket = models.Ticket.objects.create(
+                lottery=self.lottery,
+                number=self.next_number,
+                state=constants.TicketState.RESERVED,
+            )
+            self.next_number += 1
+
+            client = models.ClientInfo.objects.create(
+                lottery_to_buy=self.lottery,
+                ticket_number=ticket,
+                name="Nombre",
+                lastname="Apellido",
+                whatsapp=3000000000,
+                document_number=123456,
+                telephone=3000000000,
+                city="Ciudad",
+                seller=self.admin_user,
+            )
+            models.Payment.objects.create(
+                seller=self.admin_user,
+                client=client,
+                amount=5000,
+                date=timezone.now(),
+                payment_type="BONO1",
+            )
+
+            for model in (
+                models.TicketPendingPurchase,
+                models.TicketReserved,
+            ):
+                model.objects.create(
+                    ticket=ticket, client=client, expiration=expiration
+                )
+            models.TicketPurchased.objects.create(ticket=ticket, client=client)
+
+    def count_changelist_queries(self, model):
+        url = reverse(
+            f"admin:{model._meta.app_label}_{model._meta.model_name}_changelist"
+        )
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries)
+
+    def test_changelist_query_count_does_not_depend_on_rows(self):
+        self.create_rows(1)
+        queries_with_one_row = {
+            model: self.count_changelist_queries(model)
+            for model in self.TABLE_MODELS
+        }
+
+        self.create_rows(20)
+        for model in self.TABLE_MODELS:
+            with self.subTest(model=model.__name__):
+                self.assertEqual(
+                    self.count_changelist_queries(model),
+                    queries_with_one_row[model],
+                )
+
+
+class WompiReconciliationTest(LotteryTestMixin, TestCase):
+    """
+    The reconciliation must ingest the approved transactions the webhook
+    never delivered, once.
+    """
+
+    ticket_count = 100
+
+    def test_missing_approved_transactions_are_ingested_once(self):
+        self.reserve([1, 2, 3], "PAID")
+        self.reserve([4], "UNPAID")
+        self.assertEqual(get_pending_references(), ["PAID", "UNPAID"])
+
+        with FakeWompiServer() as server:
+            server.add_transaction(
+                {
+                    "id": "123-456",
+                    "status": "APPROVED",
+                    "reference": "PAID",
+                    "finalized_at": timezone.now().isoformat(),
+                    "payment_method": {"type": "CARD"},
+                    "amount_in_cents": 3 * 10000 * 100,
+                }
+            )
+            client = WompiTransactionsClient(base_url=server.url, private_key="test")
+            try:
+                report = reconcile_references(client, get_pending_references())
+                second_report = reconcile_references(client, ["PAID"])
+            finally:
+                client.close()
+
+        self.assertEqual(report.references, 2)
+        self.assertEqual(report.ingested, 1)
+        self.assertEqual(report.failed_references, [])
+        self.assertEqual(second_report.ingested, 0)
+        self.assertEqual(
+            models.Payment.objects.filter(purchase_reference="PAID").count(), 3
+        )
+        self.assertEqual(
+            set(
+                models.Ticket.objects.filter(
+                    lottery=self.lottery, number__in=[1, 2, 3, 4]
+                ).values_list("number", "state")
+            ),
+            {
+                (1, constants.TicketState.PURCHASED),
+                (2, constants.TicketState.PURCHASED),
+                (3, constants.TicketState.PURCHASED),
+                (4, constants.TicketState.RESERVED),
+            },
+        )
+        self.assertEqual(get_pending_references(), ["UNPAID"])
+
+    def test_requests_in_flight_are_bounded(self):
+        references = [f"REF{index}" for index in range(100)]
+        client = mock.Mock()
+        client.get_transactions.side_effect = (
+            lambda reference: [] if reference != "REF7" else 1 / 0)
+        in_flight = []
+        submitted = []
+
+        class CountingExecutor(ThreadPoolExecutor):
+            def submit(self, function, /, *args):
+                in_flight.append(
+                    sum(not future.done() for future in submitted))
+                future = super().submit(function, *args)
+                submitted.append(future)
+                return future
+
+        with mock.patch(
+            "djangopwa.wompi_reconciliation.ThreadPoolExecutor", CountingExecutor
+        ), self.assertLogs("djangopwa.wompi_reconciliation", "WARNING"):
+            report = reconcile_references(client, references, concurrency=2)
+
+        self.assertEqual(client.get_transactions.call_count, 100)
+        self.assertEqual(report.failed_references, ["REF7"])
+        self.assertLess(
+            max(in_flight), 2 * constants.WOMPI_RECONCILIATION_REQUESTS_PER_WORKER)
+
+    def test_a_reference_that_cannot_be_ingested_does_not_stop_the_run(self):
+        self.reserve([1], "PAID")
+        transactions = {
+            "BAD": [None],
+            "PAID": [build_transaction("PAID", "APPROVED", 1000000, transaction_id="1-a")],
+        }
+        client = mock.Mock()
+        client.get_transactions.side_effect = transactions.get
+
+        with self.assertLogs("djangopwa.wompi_reconciliation", "ERROR"):
+            report = reconcile_references(client, ["BAD", "PAID"], concurrency=1)
+
+        self.assertEqual(report.failed_references, ["BAD"])
+        self.assertEqual(report.ingested, 1)
+        self.assertEqual(
+            models.Ticket.objects.get(lottery=self.lottery, number=1).state,
+            constants.TicketState.PURCHASED,
+        )
+
+
+class WompiWebhookEventTest(LotteryTestMixin, TestCase):
+    """
+    Signed events must be validated, and retried or out of order deliveries
+    must apply the payment once.
+    """
+
+    def test_signature_is_validated(self):
+        event = sign_transaction_event(
+            build_transaction("REF", "APPROVED", 1000000, transaction_id="1-a"))
+        self.assertTrue(validate_signature_hash256(event))
+
+        event["data"]["transaction"]["amount_in_cents"] = 1
+        self.assertFalse(validate_signature_hash256(event))
+
+    def test_retried_and_out_of_order_deliveries_apply_once(self):
+        self.reserve([1, 2])
+        approved = sign_transaction_event(
+            build_transaction("REF", "APPROVED", 2000000, transaction_id="1-a"))
+        pending = sign_transaction_event(
+            build_transaction("REF", "PENDING", 2000000, transaction_id="1-a"))
+
+        for event in (approved, approved, pending, approved):
+            process_event(event)
+
+        self.assertEqual(
+            list(
+                models.ClientInfo.objects.filter(purchase_reference="REF")
+                .order_by("id")
+                .values_list("paid_total", "payment_count")
+            ),
+            [(10000, 1), (10000, 1)],
+        )
+        self.assertEqual(
+            models.Ticket.objects.filter(
+                lottery=self.lottery, state=constants.TicketState.PURCHASED
+            ).count(),
+            2,
+        )
+
+    def test_payments_of_a_transaction_are_written_with_one_insert(self):
+        self.reserve([1, 2, 3])
+        event = sign_transaction_event(
+            build_transaction("REF", "APPROVED", 1000001, transaction_id="1-a"))
+
+        with CaptureQueriesContext(connection) as queries:
+            process_event(event)
+
+        payment_inserts = [
+            query for query in queries.captured_queries
+            if query["sql"].startswith('INSERT INTO "djangopwa_payment"')
+        ]
+        self.assertEqual(len(payment_inserts), 1)
+        self.assertEqual(
+            list(models.Payment.objects.order_by("client_id").values_list(
+                "amount", flat=True)),
+            [3333.33, 3333.33, 3333.35],
+        )
+        self.assertEqual(
+            models.LotteryCounters.objects.get(lottery=self.lottery).money_raised,
+            10000.01,
+        )
+
+    def test_concurrent_delivery_recorded_first_is_skipped(self):
+        self.reserve([1])
+        event = sign_transaction_event(
+            build_transaction("REF", "APPROVED", 1000000, transaction_id="1-a"))
+        process_event(event)
+
+        # The other delivery passed the lookup before this one was recorded
+        with mock.patch.object(QuerySet, "exists", return_value=False):
+            response = process_event(event)
+
+        self.assertEqual(response["message"], "Transaction already processed")
+        self.assertEqual(models.Payment.objects.count(), 1)
+
+    def test_duplicate_webhook_deliveries_write_one_payment(self):
+        self.reserve([1, 2])
+        event = sign_transaction_event(
+            build_transaction("REF", "APPROVED", 2000000, transaction_id="1-a"))
+
+        for _ in range(3):
+            response = self.client.post(
+                reverse("wompi_webhook"), event, content_type="application/json")
+            self.assertEqual(response.json()["message"], "Event queued")
+
+        batch = process_event_batch(
+            process_queued_event, SerialExecutor(), batch_size=10)
+
+        self.assertEqual(batch.done, 3)
+        self.assertEqual(
+            list(models.Payment.objects.order_by("client_id").values_list(
+                "transaction_id", "amount")),
+            [("1-a", 10000), ("1-a", 10000)],
+        )
+        self.assertEqual(
+            sorted(models.WompiWebhookEvent.objects.values_list("result", flat=True)),
+            ["Transaction already processed"] * 2 + ["Transaction updated successfully"],
+        )
+
+
+class LotteryStatisticsTest(LotteryTestMixin, TestCase):
+    """
+    The dashboard numbers of a lottery must come from two grouped queries
+    and be recomputed after a payment is committed.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        reserve_tickets(
+            cls.lottery, [1, 2, 3], build_client_data("REF"), seller=cls.seller)
+        ticket = models.Ticket.objects.get(lottery=cls.lottery, number=3)
+        ticket.state = constants.TicketState.PURCHASED
+        ticket.save()
+
+    def setUp(self):
+        cache.clear()
+
+    def test_statistics_of_the_lottery(self):
+        self.add_payment(1, 4000)
+        self.add_payment(3, 10000)
+
+        with CaptureQueriesContext(connection) as queries:
+            statistics = get_lottery_statistics(self.lottery)
+        self.assertEqual(len(queries), 2)
+
+        self.assertEqual(
+            statistics.as_context(),
+            {
+                "total_money_raised": "14.000",
+                "percentage": 30.0,
+                "pending_tickets": 3,
+                "complete_tickets_payment": 1,
+                "tickets_with_payments": 1,
+            },
+        )
+
+    def test_payment_invalidates_the_cached_statistics(self):
+        get_lottery_statistics(self.lottery)
+        with self.assertNumQueries(0):
+            get_lottery_statistics(self.lottery)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.add_payment(2, 5000)
+
+        statistics = get_lottery_statistics(self.lottery)
+        self.assertEqual(statistics.money_raised, 5000)
+        self.assertEqual(statistics.tickets_with_payments, 1)
+
+
+class LotteryCountersTest(LotteryTestMixin, TestCase):
+    """
+    The counters of a lottery must follow every transition and payment, and
+    the checker must find and fix the ones that drifted.
+    """
+
+    def get_counters(self):
+        counters = models.LotteryCounters.objects.get(lottery=self.lottery)
+        return (
+            counters.available_tickets,
+            counters.reserved_tickets,
+            counters.purchased_tickets,
+            counters.money_raised,
+        )
+
+    def test_counters_follow_transitions_and_payments(self):
+        self.reserve([1, 2, 3])
+        clients = list(models.ClientInfo.objects.order_by("ticket_number__number"))
+        bulk_create_payments(
+            [self.build_payment(client, 4000) for client in clients])
+        self.assertEqual(self.get_counters(), (7, 3, 0, 12000))
+
+        verify_clients([clients[0].id])
+        decline_clients([clients[1].id])
+        self.assertEqual(self.get_counters(), (8, 1, 1, 8000))
+
+        ticket = models.Ticket.objects.get(lottery=self.lottery, number=9)
+        ticket.state = constants.TicketState.PURCHASED
+        ticket.save()
+        self.assertEqual(self.get_counters(), (7, 1, 2, 8000))
+        self.assertEqual(refresh_lottery_counters(), [])
+
+    def test_checker_repairs_drifted_counters(self):
+        models.LotteryCounters.objects.filter(lottery=self.lottery).update(
+            available_tickets=0, money_raised=500)
+
+        repaired = refresh_lottery_counters([self.lottery.id])
+
+        self.assertEqual(len(repaired), 1)
+        self.assertEqual(repaired[0]["stored"]["available_tickets"], 0)
+        self.assertEqual(self.get_counters(), (10, 0, 0, 0))
+        self.assertEqual(refresh_lottery_counters([self.lottery.id]), [])
+
+    def test_stale_copies_of_a_ticket_are_counted_once(self):
+        first = models.Ticket.objects.get(lottery=self.lottery, number=1)
+        second = models.Ticket.objects.get(lottery=self.lottery, number=1)
+
+        first.state = constants.TicketState.RESERVED
+        first.save()
+        second.state = constants.TicketState.RESERVED
+        second.save()
+        self.assertEqual(self.get_counters(), (9, 1, 0, 0))
+
+        first.state = constants.TicketState.PURCHASED
+        first.save(update_fields=["number"])
+        self.assertEqual(self.get_counters(), (9, 1, 0, 0))
+        self.assertEqual(refresh_lottery_counters(), [])
+
+    def test_deleted_clients_leave_the_lottery_with_one_update(self):
+        self.reserve([1, 2, 3])
+        for ticket_number in (1, 2, 3):
+            self.add_payment(ticket_number, 1000)
+
+        with CaptureQueriesContext(connection) as queries:
+            models.ClientInfo.objects.filter(
+                ticket_number__number__in=[1, 2]).delete()
+        counter_updates = [
+            query for query in queries.captured_queries
+            if query["sql"].startswith('UPDATE "djangopwa_lotterycounters"')
+        ]
+
+        self.assertEqual(len(counter_updates), 1)
+        self.assertEqual(self.get_counters()[3], 1000)
+
+
+class TicketAvailabilitySyncTest(LotteryTestMixin, TestCase):
+    """
+    Only real transitions must reach the change log, and a client behind
+    the pruned log must get a full snapshot.
+    """
+
+    def setUp(self):
+        cache.clear()
+
+    def get_version(self):
+        self.lottery.refresh_from_db(fields=["availability_version"])
+        return self.lottery.availability_version
+
+    def set_state(self, ticket_number, state):
+        ticket = models.Ticket.objects.get(lottery=self.lottery, number=ticket_number)
+        ticket.state = state
+        ticket.save()
+
+    def get_availability(self, version):
+        url = reverse("get_ticket_availability", args=[self.lottery.id])
+        return self.client.get(url, {"version": version})
+
+    def test_save_without_state_change_is_not_recorded(self):
+        version = self.get_version()
+
+        ticket = models.Ticket.objects.get(lottery=self.lottery, number=1)
+        ticket.save()
+
+        self.assertEqual(self.get_version(), version)
+        self.assertFalse(models.TicketStateChange.objects.exists())
+
+    def test_delta_and_full_snapshot_after_pruning(self):
+        self.set_state(1, constants.TicketState.RESERVED)
+        self.set_state(2, constants.TicketState.RESERVED)
+        self.set_state(1, constants.TicketState.AVAILABLE)
+
+        response = self.get_availability(1).json()
+        self.assertFalse(response["full"])
+        self.assertEqual(response["version"], 3)
+        self.assertEqual(response["available"], [1])
+        self.assertEqual(response["unavailable"], [2])
+
+        with mock.patch.object(constants, "TICKET_AVAILABILITY_MAX_DELTA_VERSIONS", 2):
+            self.assertEqual(prune_ticket_state_changes(), 1)
+            self.assertIsNone(get_availability_changes(self.lottery.id, 0))
+            self.assertEqual(get_availability_changes(self.lottery.id, 1)[0], 3)
+            self.assertTrue(self.get_availability(0).json()["full"])
+
+    def test_out_of_order_patch_drops_the_cached_index(self):
+        get_availability_index(self.lottery)
+
+        update_availability_index(
+            self.lottery.id, [1], constants.TicketState.RESERVED, version=1)
+        self.assertEqual(get_cached_availability_index(self.lottery.id).version, 1)
+
+        update_availability_index(
+            self.lottery.id, [2], constants.TicketState.RESERVED, version=3)
+        self.assertIsNone(get_cached_availability_index(self.lottery.id))
+
+
+class CheckoutHoldTest(LotteryTestMixin, TestCase):
+    """
+    A visitor must hold a single roulette number however often it spins,
+    never more than MAX_HOLDS_PER_OWNER roulette numbers at once, and the
+    numbers of a checkout from the moment the form is shown until they
+    are reserved or the holds expire.
+    """
+
+    ticket_count = 30
+
+    def setUp(self):
+        cache.clear()
+        self.sampler = TicketSampler(self.lottery.id, range(self.ticket_count), 0)
+
+    def spin(self, owner):
+        return self.sampler.draw_and_hold(
+            owner, constants.LUCKY_ROULETTE_HOLD_SECONDS)
+
+    def test_spinning_again_releases_the_previous_number(self):
+        for _ in range(20):
+            ticket_number = self.spin("owner")
+
+        self.assertEqual(list(get_owner_holds(self.lottery.id, "owner")), [ticket_number])
+        self.assertEqual(len(self.sampler), self.ticket_count - 1)
+        self.assertEqual(
+            get_foreign_holds(self.lottery.id, range(self.ticket_count), "other"),
+            [ticket_number],
+        )
+
+        other_number = self.spin("other")
+        self.assertNotEqual(other_number, ticket_number)
+        self.assertEqual(len(self.sampler), self.ticket_count - 2)
+
+    def hold_roulette(self, ticket_numbers, owner):
+        return acquire_holds(
+            self.lottery.id, ticket_numbers, owner, purpose=HOLD_PURPOSE_ROULETTE)
+
+    def test_roulette_holds_per_owner_are_capped(self):
+        with mock.patch.object(constants, "MAX_HOLDS_PER_OWNER", 2):
+            self.assertFalse(self.hold_roulette([1, 2, 3], "owner"))
+            self.assertTrue(self.hold_roulette([1, 2], "owner"))
+            self.assertTrue(self.hold_roulette([2], "owner"))
+            self.assertFalse(self.hold_roulette([3], "owner"))
+            self.assertTrue(self.hold_roulette([3], "other"))
+
+            # Checkout holds are not capped
+            self.assertTrue(acquire_holds(self.lottery.id, range(4, 10), "owner"))
+            self.assertEqual(len(get_owner_holds(self.lottery.id, "owner")), 8)
+
+    def purchase(self, ticket_numbers, hold_owner):
+        return create_ticket_purchases(
+            {
+                "lottery_id": self.lottery.id,
+                "ticket_numbers": ticket_numbers,
+                **build_client_data(),
+            },
+            hold_owner=hold_owner,
+        )
+
+    def test_showing_the_checkout_form_holds_the_numbers(self):
+        url = reverse("lottery_purchase_data_form", args=[self.lottery.id])
+
+        response = self.client.get(url, {"ticket_numbers": "1,2"})
+        self.assertTrue(response.context["all_tickets_available"])
+        owner = self.client.session[SESSION_HOLD_OWNER_KEY]
+        self.assertEqual(list(get_owner_holds(self.lottery.id, owner)), [1, 2])
+        self.assertFalse(acquire_holds(self.lottery.id, [2], "other"))
+
+        # A new selection gives back the numbers no longer selected
+        response = self.client.get(url, {"ticket_numbers": "2,3"})
+        self.assertTrue(response.context["all_tickets_available"])
+        self.assertEqual(sorted(get_owner_holds(self.lottery.id, owner)), [2, 3])
+        self.assertTrue(acquire_holds(self.lottery.id, [1], "other"))
+
+        response = self.client.get(url, {"ticket_numbers": "1,2"})
+        self.assertFalse(response.context["all_tickets_available"])
+
+    def test_checkout_of_more_numbers_than_the_roulette_cap(self):
+        ticket_numbers = list(range(constants.MAX_HOLDS_PER_OWNER + 5))
+
+        self.assertEqual(self.purchase(ticket_numbers, "owner").reserved, ticket_numbers)
+
+    def test_lost_numbers_are_reported_on_the_form(self):
+        url = reverse("lottery_purchase_data_form", args=[self.lottery.id])
+        self.client.get(url, {"ticket_numbers": "1,2"})
+        self.reserve([2], purchase_reference="OTHER")
+
+        response = self.client.post(
+            f"{url}?ticket_numbers=1,2",
+            {**build_client_data(), "amount_to_pay": "$20.000"},
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.context["form"].non_field_errors(),
+            ["Los numeros 0002 ya no estan disponibles."],
+        )
+        self.assertFalse(
+            models.ClientInfo.objects.filter(purchase_reference="REF").exists())
+
+    def test_checkout_holds_are_released_after_the_reservation(self):
+        self.assertTrue(acquire_holds(self.lottery.id, [3], "other"))
+
+        self.assertEqual(self.purchase([2, 3], "owner").unavailable, [3])
+        self.assertFalse(models.ClientInfo.objects.exists())
+
+        self.assertEqual(self.purchase([1, 2], "owner").reserved, [1, 2])
+        self.assertEqual(get_owner_holds(self.lottery.id, "owner"), {})
+        self.assertEqual(get_foreign_holds(self.lottery.id, [1, 2], "other"), [])
+
+        # A reservation lost in the database keeps the holds until they expire
+        self.reserve([4], purchase_reference="OTHER")
+        self.assertEqual(self.purchase([4, 5], "owner").reserved, [])
+        self.assertEqual(sorted(get_owner_holds(self.lottery.id, "owner")), [4, 5])
+
+    def test_checkout_holds_expire(self):
+        self.assertTrue(acquire_holds(self.lottery.id, [1], "other", timeout=60))
+        self.assertFalse(acquire_holds(self.lottery.id, [1], "owner"))
+
+        with mock.patch("time.time", return_value=time.time() + 61):
+            self.assertEqual(get_foreign_holds(self.lottery.id, [1], "owner"), [])
+            self.assertEqual(self.purchase([1], "owner").reserved, [1])
+
+
+class SellerBillTest(LotteryTestMixin, TestCase):
+    """
+    A payment must be billed once, whether by date or as outstanding.
+    """
+
+    def setUp(self):
+        self.reserve([1, 2])
+        self.today = timezone.now()
+        self.yesterday = self.today - timedelta(days=1)
+        self.add_payment(1, 10000, self.yesterday)
+        self.add_payment(2, 20000, self.yesterday)
+        self.add_payment(1, 5000, self.today)
+
+    def test_outstanding_bill_skips_the_payments_billed_by_date(self):
+        bill = generate_seller_bill(
+            self.seller.id, [timezone.localdate(self.yesterday)])
+        self.assertEqual(bill["total_amount"], 30000)
+        self.assertIsNone(
+            generate_seller_bill(self.seller.id, [timezone.localdate(self.yesterday)]))
+
+        bill, payment_balances = settle_outstanding_payments(self.seller)
+        self.assertEqual(bill.total_amount, 5000)
+        self.assertEqual(len(payment_balances), 1)
+        self.assertIsNone(settle_outstanding_payments(self.seller))
+
+    def test_failed_bill_leaves_nothing_behind(self):
+        with mock.patch.object(
+            models.ClientTicketPaymentBalance.objects, "bulk_create",
+            side_effect=RuntimeError,
+        ):
+            with self.assertRaises(RuntimeError):
+                settle_outstanding_payments(self.seller)
+
+        self.assertFalse(models.SellerBill.objects.exists())
+        self.assertFalse(
+            models.Payment.objects.filter(seller_bill__isnull=False).exists())
+
+        bill, payment_balances = settle_outstanding_payments(self.seller)
+        self.assertEqual(bill.total_amount, 35000)
+        self.assertEqual(
+            sorted(
+                (balance.ticket_number, balance.total_amount)
+                for balance in bill.clientticketpaymentbalance_set.all()),
+            [(1, 15000), (2, 20000)],
+        )
+        self.assertEqual(len(payment_balances), 2)
+
+    def test_backfill_links_the_payments_of_older_bills(self):
+        bill = models.SellerBill.objects.create(
+            generation_date=self.today, seller=self.seller, total_amount=30000)
+        models.ClientTicketPaymentBalance.objects.bulk_create(
+            [
+                models.ClientTicketPaymentBalance(
+                    seller_bill=bill,
+                    client_id=self.get_client(ticket_number).id,
+                    ticket_number=ticket_number,
+                    total_amount=total_amount,
+                    last_payment_date=self.yesterday,
+                )
+                for ticket_number, total_amount in ((1, 10000), (2, 20000))
+            ]
+        )
+
+        migration = import_module(
+            "djangopwa.migrations.0026_backfill_payment_seller_bill")
+        migration.backfill_payment_seller_bill(apps, None)
+
+        self.assertEqual(
+            models.Payment.objects.filter(seller_bill=bill).count(), 2)
+        self.assertEqual(settle_outstanding_payments(self.seller)[0].total_amount, 5000)
+
+
+class SellerSettlementTest(LotteryTestMixin, TestCase):
+    """
+    Settling the sellers must bill every outstanding payment once, from the
+    function, the command and the admin action alike.
+    """
+
+    def setUp(self):
+        self.other_seller = models.User.objects.create(username="otro")
+        self.reserve([1, 2])
+        self.yesterday = timezone.now() - timedelta(days=1)
+        self.add_payment(1, 10000, self.yesterday)
+        self.add_payment(1, 5000)
+        payment = self.build_payment(self.get_client(2), 20000)
+        payment.seller = self.other_seller
+        payment.save()
+
+    def test_settlement_skips_the_billed_payments(self):
+        generate_seller_bill(self.seller.id, [timezone.localdate(self.yesterday)])
+
+        settlements = settle_sellers()
+        self.assertEqual(
+            [(settlement.seller, settlement.bill.total_amount, settlement.payment_count)
+             for settlement in settlements],
+            [(self.seller, 5000, 1), (self.other_seller, 20000, 1)],
+        )
+        self.assertFalse(
+            models.Payment.objects.filter(seller_bill__isnull=True).exists())
+        self.assertEqual(settle_sellers(), [])
+
+    def test_command_writes_the_summary(self):
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, "summary.csv")
+            call_command("settle_sellers", seller_ids=[self.seller.id],
+                         output=output, stdout=mock.Mock())
+            with open(output) as file:
+                lines = file.read().splitlines()
+
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[1].endswith(",1,2,15000"))
+        self.assertTrue(
+            models.Payment.objects.filter(
+                seller=self.other_seller, seller_bill__isnull=True).exists())
+
+    def test_admin_action_downloads_the_summary(self):
+        admin_user = models.User.objects.create_superuser(
+            username="admin", password="admin")
+        self.client.force_login(admin_user)
+        url = reverse("admin:djangopwa_user_changelist")
+        data = {
+            "action": "settle_outstanding_payments",
+            "_selected_action": [self.seller.id, self.other_seller.id],
+        }
+
+        response = self.client.post(url, data)
+        self.assertEqual(response["Content-Type"], "text/csv")
+        self.assertEqual(len(response.content.decode().splitlines()), 3)
+
+        # Nothing is left to bill the second time
+        self.client.post(url, data)
+        self.assertEqual(models.SellerBill.objects.count(), 2)
+
+
+class TicketAssignmentConflictTest(LotteryTestMixin, TestCase):
+    """
+    Assignments must be validated against the database, even when the
+    cached assignment index missed a concurrent assignment.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.other_seller = models.User.objects.create(username="otro")
+        get_assignment_index(self.lottery.id)
+
+        # Written without signals, the cached index does not see it
+        models.TicketAssignment.objects.bulk_create(
+            [
+                models.TicketAssignment(
+                    lottery=self.lottery,
+                    start_number=2,
+                    end_number=4,
+                    assigned_to=self.other_seller,
+                )
+            ]
+        )
+        self.assertEqual(get_assignment_index(self.lottery.id).intervals, [])
+
+    def assign_range(self, start_number, end_number, seller):
+        return models.TicketAssignment.objects.create(
+            lottery=self.lottery,
+            start_number=start_number,
+            end_number=end_number,
+            assigned_to=seller,
+        )
+
+    def test_overlapping_range_is_rejected(self):
+        for start_number, end_number in ((0, 2), (4, 6), (3, 3), (0, 9)):
+            with self.assertRaises(ValidationError):
+                self.assign_range(start_number, end_number, self.seller)
+
+        self.assign_range(5, 9, self.seller)
+        assignment = self.assign_range(2, 4, self.other_seller)
+
+        # Editing an assignment ignores its own range
+        assignment.end_number = 3
+        assignment.save()
+
+    def test_overlapping_individual_tickets_are_rejected(self):
+        tickets = models.Ticket.objects.filter(lottery=self.lottery, number__in=[1, 3])
+        data = {
+            "individual_tickets": [ticket.id for ticket in tickets],
+            "assigned_to": self.seller.id,
+        }
+
+        form = TicketAssignmentForm(data)
+        self.assertFalse(form.is_valid())
+        self.assertIn("0003", str(form.non_field_errors()))
+        self.assertNotIn("0001", str(form.non_field_errors()))
+
+        data["assigned_to"] = self.other_seller.id
+        self.assertTrue(TicketAssignmentForm(data).is_valid())
+
+
+class PurchaseDeclineTest(LotteryTestMixin, TestCase):
+    """
+    Declining clients must take a fixed number of queries and keep the
+    counters right, and sellers must only act on their own clients.
+    """
+
+    ticket_count = 20
+
+    def decline(self, ticket_numbers):
+        clients = []
+        for ticket_number in ticket_numbers:
+            self.reserve([ticket_number], purchase_reference=f"REF{ticket_number}")
+            self.add_payment(ticket_number, 1000)
+            clients.append(self.get_client(ticket_number).id)
+
+        with CaptureQueriesContext(connection) as queries:
+            result = decline_clients(clients)
+        self.assertEqual(result.processed, sorted(clients))
+        return len(queries)
+
+    def test_query_count_does_not_depend_on_the_clients(self):
+        self.assertEqual(self.decline([0, 1]), self.decline(range(2, 10)))
+
+        for model in (models.ClientInfo, models.Payment, models.SellerDailyPayment,
+                      models.TicketReserved):
+            self.assertFalse(model.objects.exists())
+        counters = models.LotteryCounters.objects.get(lottery=self.lottery)
+        self.assertEqual(counters.available_tickets, self.ticket_count)
+        self.assertEqual(counters.money_raised, 0)
+        self.assertEqual(refresh_lottery_counters([self.lottery.id]), [])
+
+    def test_sellers_only_act_on_their_own_clients(self):
+        other_seller = models.User.objects.create(username="otro")
+        self.reserve([1])
+        models.ClientInfo.objects.filter(id=self.get_client(1).id).update(
+            seller=other_seller)
+        self.reserve([2], purchase_reference="REF2")
+
+        model_admin = admin.site._registry[models.TicketReserved]
+        request = RequestFactory().get("/")
+        request.user = self.seller
+        queryset = model_admin.filter_own_rows(
+            request, models.TicketReserved.objects.all())
+        self.assertEqual(
+            list(queryset.values_list("ticket__number", flat=True)), [2])
+
+        request.user = models.User.objects.create_superuser(username="admin")
+        queryset = model_admin.filter_own_rows(
+            request, models.TicketReserved.objects.all())
+        self.assertEqual(queryset.count(), 2)
+
+    def test_endpoints_reject_the_clients_of_other_sellers(self):
+        other_seller = models.User.objects.create(username="otro")
+        self.reserve([1])
+        self.reserve([2], purchase_reference="REF2")
+        foreign_client = self.get_client(1)
+        models.ClientInfo.objects.filter(id=foreign_client.id).update(
+            seller=other_seller)
+        own_client = self.get_client(2)
+        self.client.force_login(self.seller)
+
+        for url_name in ("verify_ticket_purchases", "decline_tickets"):
+            with self.assertLogs("django.request", "WARNING"):
+                response = self.client.post(
+                    reverse(url_name),
+                    {"client_ids": [own_client.id, foreign_client.id]},
+                    content_type="application/json",
+                )
+            self.assertEqual(response.status_code, 403)
+            self.assertEqual(response.json()["data"], {"client_ids": [foreign_client.id]})
+
+        self.assertEqual(
+            models.Ticket.objects.filter(
+                lottery=self.lottery, state=constants.TicketState.RESERVED).count(),
+            2,
+        )
+
+        response = self.client.post(
+            reverse("decline_tickets"),
+            {"client_ids": [own_client.id]},
+            content_type="application/json",
+        )
+        self.assertEqual(response.json()["data"]["results"],
+                         [{"client_id": own_client.id, "success": True}])
+        self.assertEqual(list(models.ClientInfo.objects.values_list("id", flat=True)),
+                         [foreign_client.id])
+
+
+class PurchaseVerificationTest(LotteryTestMixin, TestCase):
+    """
+    Verifying clients must take a fixed number of queries, and only the
+    references paid in full must be verified automatically.
+    """
+
+    ticket_count = 20
+
+    def verify(self, ticket_numbers):
+        clients = []
+        for ticket_number in ticket_numbers:
+            self.reserve([ticket_number], purchase_reference=f"REF{ticket_number}")
+            clients.append(self.get_client(ticket_number).id)
+
+        with CaptureQueriesContext(connection) as queries:
+            result = verify_clients(clients, transaction_id="1-a")
+        self.assertEqual(result.processed, sorted(clients))
+        return len(queries)
+
+    def test_query_count_does_not_depend_on_the_clients(self):
+        self.assertEqual(self.verify([0, 1]), self.verify(range(2, 10)))
+
+        self.assertEqual(
+            sorted(models.TicketPurchased.objects.values_list(
+                "ticket__number", "transaction_id")),
+            [(number, "1-a") for number in range(10)],
+        )
+        for model in (models.TicketReserved, models.TicketPendingPurchase):
+            self.assertFalse(model.objects.exists())
+        counters = models.LotteryCounters.objects.get(lottery=self.lottery)
+        self.assertEqual(counters.purchased_tickets, 10)
+        self.assertEqual(counters.reserved_tickets, 0)
+        self.assertEqual(refresh_lottery_counters([self.lottery.id]), [])
+
+    def test_verifying_twice_writes_one_purchase(self):
+        self.reserve([1])
+        client_id = self.get_client(1).id
+
+        verify_clients([client_id])
+        result = verify_clients([client_id, 999])
+
+        self.assertEqual(result.processed, [client_id])
+        self.assertEqual(result.not_found, [999])
+        self.assertEqual(models.TicketPurchased.objects.count(), 1)
+        self.assertEqual(
+            models.LotteryCounters.objects.get(lottery=self.lottery).purchased_tickets,
+            1,
+        )
+
+    def test_only_references_paid_in_full_are_verified(self):
+        self.reserve([1, 2], purchase_reference="PAID")
+        self.add_payment(1, 15000)
+        self.add_payment(2, 5000)
+        self.reserve([3, 4], purchase_reference="PARTIAL")
+        self.add_payment(3, 10000)
+
+        result = verify_paid_purchases()
+
+        self.assertEqual(
+            result.processed, sorted([self.get_client(1).id, self.get_client(2).id]))
+        self.assertEqual(
+            dict(models.Ticket.objects.filter(
+                lottery=self.lottery, number__in=[1, 2, 3, 4]
+            ).values_list("number", "state")),
+            {
+                1: constants.TicketState.PURCHASED,
+                2: constants.TicketState.PURCHASED,
+                3: constants.TicketState.RESERVED,
+                4: constants.TicketState.RESERVED,
+            },
+        )
+        self.assertEqual(verify_paid_purchases(["PAID"]).processed, [])
+
+    def test_command_verifies_the_given_references(self):
+        self.reserve([1], purchase_reference="REF1")
+        self.add_payment(1, 10000)
+        self.reserve([2], purchase_reference="REF2")
+        self.add_payment(2, 10000)
+
+        call_command("verify_paid_purchases", reference=["REF1"], stdout=mock.Mock())
+
+        self.assertEqual(
+            list(models.TicketPurchased.objects.values_list(
+                "purchase_reference", flat=True)),
+            ["REF1"],
+        )
+
+
+class TicketReservationTest(LotteryTestMixin, TestCase):
+    """
+    A reservation must create the rows of every won ticket, and nothing at
+    all when a ticket is lost and every ticket is required.
+    """
+
+    def get_counters(self):
+        counters = models.LotteryCounters.objects.get(lottery=self.lottery)
+        return counters.available_tickets, counters.reserved_tickets
+
+    def test_every_ticket_won(self):
+        result = self.reserve([3, 1, 2, 1])
+
+        self.assertEqual(result.reserved, [1, 2, 3])
+        self.assertEqual(result.unavailable, [])
+        clients = models.ClientInfo.objects.filter(lottery_to_buy=self.lottery)
+        self.assertEqual(
+            sorted(clients.values_list("ticket_number__number", flat=True)), [1, 2, 3])
+        self.assertEqual(
+            set(clients.values_list("seller_id", "purchase_reference")),
+            {(self.seller.id, "REF")},
+        )
+        for model in (models.TicketReserved, models.TicketPendingPurchase):
+            self.assertEqual(
+                sorted(model.objects.values_list("ticket__number", flat=True)), [1, 2, 3])
+        self.assertEqual(
+            models.Ticket.objects.filter(
+                lottery=self.lottery, state=constants.TicketState.RESERVED).count(),
+            3,
+        )
+        self.assertEqual(self.get_counters(), (7, 3))
+
+    def test_lost_ticket_reserves_nothing_when_all_are_required(self):
+        self.reserve([2])
+
+        result = self.reserve([1, 2, 3], purchase_reference="OTRA")
+
+        self.assertEqual(result.reserved, [])
+        self.assertEqual(result.unavailable, [2])
+        self.assertFalse(
+            models.ClientInfo.objects.filter(purchase_reference="OTRA").exists())
+        self.assertEqual(models.TicketReserved.objects.count(), 1)
+        self.assertEqual(self.get_counters(), (9, 1))
+
+    def test_partial_reservation(self):
+        self.reserve([2])
+
+        result = self.reserve([1, 2, 3], purchase_reference="OTRA", require_all=False)
+
+        self.assertEqual(result.reserved, [1, 3])
+        self.assertEqual(result.unavailable, [2])
+        self.assertEqual(
+            models.ClientInfo.objects.filter(purchase_reference="OTRA").count(), 2)
+        self.assertEqual(self.get_counters(), (7, 3))
+
+
+class ReservationSweepTest(LotteryTestMixin, TestCase):
+    """
+    The sweeper must release the expired unpaid tickets and keep the ones
+    whose client paid something.
+    """
+
+    def test_expired_unpaid_tickets_are_released(self):
+        self.reserve([1, 2])
+        self.reserve([3], purchase_reference="VIGENTE")
+        self.add_payment(2, 1000)
+        expired = timezone.now() - timedelta(minutes=1)
+        for model in (models.TicketReserved, models.TicketPendingPurchase):
+            model.objects.filter(purchase_reference="REF").update(expiration=expired)
+
+        output = mock.Mock()
+        call_command("sweep_expired_reservations", stdout=output)
+
+        self.assertEqual(
+            sorted(
+                models.ClientInfo.objects.values_list("ticket_number__number", flat=True)),
+            [2, 3],
+        )
+        self.assertEqual(
+            models.Ticket.objects.get(lottery=self.lottery, number=1).state,
+            constants.TicketState.AVAILABLE,
+        )
+        self.assertEqual(
+            sorted(
+                models.Ticket.objects.filter(
+                    lottery=self.lottery, state=constants.TicketState.RESERVED
+                ).values_list("number", flat=True)),
+            [2, 3],
+        )
+        summary = output.write.call_args_list[-1].args[0]
+        self.assertIn("released 1 tickets", summary)
+        self.assertIn("kept 1 expired reservations with payments", summary)
+        self.assertEqual(refresh_lottery_counters(), [])
+
+    def expire(self, purchase_reference="REF"):
+        expired = timezone.now() - timedelta(minutes=1)
+        for model in (models.TicketReserved, models.TicketPendingPurchase):
+            model.objects.filter(purchase_reference=purchase_reference).update(
+                expiration=expired)
+
+    def test_tickets_verified_meanwhile_are_not_released(self):
+        self.reserve([1, 2])
+        self.expire()
+        models.Ticket.objects.filter(lottery=self.lottery, number=1).update(
+            state=constants.TicketState.PURCHASED)
+        verified_client = self.get_client(1)
+
+        batches = list(sweep_expired_reservations())
+
+        self.assertEqual(sum(batch.released_tickets for batch in batches), 1)
+        self.assertEqual(
+            list(models.ClientInfo.objects.values_list("id", flat=True)),
+            [verified_client.id])
+        self.assertEqual(
+            models.Ticket.objects.get(lottery=self.lottery, number=1).state,
+            constants.TicketState.PURCHASED,
+        )
+        for model in (models.TicketReserved, models.TicketPendingPurchase):
+            self.assertFalse(model.objects.exists())
+
+    def test_tickets_paid_meanwhile_are_not_released(self):
+        self.reserve([1])
+        self.expire()
+        lock_holdings = reservation_sweeper.lock_expired_holdings
+
+        def lock_then_pay(*args):
+            holdings = lock_holdings(*args)
+            if holdings:
+                self.add_payment(1, 1000)
+            return holdings
+
+        with mock.patch.object(
+            reservation_sweeper, "lock_expired_holdings", side_effect=lock_then_pay
+        ):
+            batches = list(sweep_expired_reservations())
+
+        self.assertEqual([batch.released_tickets for batch in batches], [0])
+        self.assertEqual(
+            models.Ticket.objects.get(lottery=self.lottery, number=1).state,
+            constants.TicketState.RESERVED,
+        )
+        self.assertTrue(models.TicketReserved.objects.exists())
+
+
+class SellerIntervalsTest(LotteryTestMixin, TestCase):
+    """
+    The numbers assigned to a seller must resolve into coalesced intervals,
+    refreshed once an assignment changes.
+    """
+
+    ticket_count = 30
+
+    def setUp(self):
+        cache.clear()
+
+    def test_coalesce_intervals(self):
+        self.assertEqual(
+            coalesce_intervals([(8, 8), (1, 3), (4, 5), (2, 2), (10, 12), (11, 15)]),
+            [(1, 5), (8, 8), (10, 15)],
+        )
+
+    def test_ranges_and_individual_tickets_are_resolved(self):
+        models.TicketAssignment.objects.create(
+            lottery=self.lottery, start_number=5, end_number=9, assigned_to=self.seller)
+        assignment = models.TicketAssignment.objects.create(
+            lottery=self.lottery, assigned_to=self.seller)
+        assignment.individual_tickets.set(
+            models.Ticket.objects.filter(lottery=self.lottery, number__in=[10, 20]))
+
+        intervals = get_seller_intervals(self.seller.id, self.lottery.id)
+        self.assertEqual(intervals, [(5, 10), (20, 20)])
+        self.assertEqual(
+            sorted(
+                models.Ticket.objects.filter(lottery=self.lottery)
+                .filter(build_intervals_filter(intervals))
+                .values_list("number", flat=True)),
+            [5, 6, 7, 8, 9, 10, 20],
+        )
+        self.assertFalse(
+            models.Ticket.objects.filter(build_intervals_filter([])).exists())
+
+        other_lottery = create_lottery(with_tickets=False)
+        self.assertEqual(get_seller_intervals(self.seller.id, other_lottery.id), [])
+
+    def test_cached_intervals_follow_assignment_changes(self):
+        self.assertEqual(get_seller_intervals(self.seller.id, self.lottery.id), [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            models.TicketAssignment.objects.create(
+                lottery=self.lottery, start_number=1, end_number=3,
+                assigned_to=self.seller)
+
+        self.assertEqual(
+            get_seller_intervals(self.seller.id, self.lottery.id), [(1, 3)])
+
+    def test_tickets_view_only_counts_assignments_of_the_lottery(self):
+        other_lottery = create_lottery(ticket_count=30)
+        models.TicketAssignment.objects.create(
+            lottery=self.lottery, start_number=1, end_number=2, assigned_to=self.seller)
+        models.TicketAssignment.objects.create(
+            lottery=other_lottery, start_number=10, end_number=12,
+            assigned_to=self.seller)
+        models.User.objects.filter(id=self.seller.id).update(is_staff=True)
+        self.client.force_login(self.seller)
+
+        response = self.client.get(reverse("admin-tickets-view"))
+
+        self.assertEqual(response.context["lottery_id"], self.lottery.id)
+        self.assertEqual(
+            sorted(response.context["tickets"].values_list("number", flat=True)),
+            [1, 2],
+        )
+
+
+class ClientPaymentTotalsTest(LotteryTestMixin, TestCase):
+    """
+    The paid total and payment count of a client must follow every payment
+    write, and the repair command must fix the ones that drifted.
+    """
+
+    def setUp(self):
+        self.reserve([1, 2])
+        self.first_client = self.get_client(1)
+        self.second_client = self.get_client(2)
+
+    def get_totals(self, client):
+        client.refresh_from_db(fields=["paid_total", "payment_count"])
+        return client.paid_total, client.payment_count
+
+    def test_totals_follow_create_edit_and_delete(self):
+        payment = self.add_payment(1, 1000)
+        self.add_payment(1, 500)
+        self.assertEqual(self.get_totals(self.first_client), (1500, 2))
+
+        payment.amount = 3000
+        payment.save()
+        self.assertEqual(self.get_totals(self.first_client), (3500, 2))
+
+        payment.client = self.second_client
+        payment.save()
+        self.assertEqual(self.get_totals(self.first_client), (500, 1))
+        self.assertEqual(self.get_totals(self.second_client), (3000, 1))
+
+        payment.delete()
+        self.assertEqual(self.get_totals(self.second_client), (0, 0))
+
+        bulk_create_payments(
+            [self.build_payment(self.second_client, 700) for _ in range(3)])
+        self.assertEqual(self.get_totals(self.second_client), (2100, 3))
+
+    def test_repair_command_fixes_drifted_totals(self):
+        self.add_payment(1, 1000)
+        models.ClientInfo.objects.filter(id=self.first_client.id).update(
+            paid_total=0, payment_count=5)
+
+        output = mock.Mock()
+        call_command("repair_client_payment_totals", stdout=output)
+
+        self.assertEqual(self.get_totals(self.first_client), (1000, 1))
+        self.assertIn("Repaired 1 clients", output.write.call_args_list[-1].args[0])
+
+
+class SellerBalanceTest(LotteryTestMixin, TestCase):
+    """
+    The balance of a seller in some days must be grouped in a single query
+    from the payments a bill of those days would claim.
+    """
+
+    def test_balance_is_grouped_in_one_query(self):
+        self.reserve([1, 2])
+        today = timezone.now()
+        two_days_ago = today - timedelta(days=2)
+        self.add_payment(1, 1000, two_days_ago)
+        self.add_payment(1, 2000, today)
+        self.add_payment(2, 4000, today)
+        self.add_payment(2, 8000, today - timedelta(days=1))
+
+        with CaptureQueriesContext(connection) as queries:
+            balance = generate_balance(
+                self.seller.id,
+                [timezone.localdate(today), timezone.localdate(two_days_ago)],
+            )
+
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(balance["total"]["amount"], 7000)
+        first_client, second_client = self.get_client(1), self.get_client(2)
+        self.assertEqual(balance[first_client.id]["total_amount"], 3000)
+        self.assertEqual(balance[first_client.id]["ticket_number"], "0001")
+        self.assertEqual(balance[second_client.id]["total_amount"], 4000)
+        self.assertEqual(generate_balance(self.seller.id, []), {"total": {"amount": 0}})
+
+    def test_balance_of_a_day_billed_twice_equals_the_bill(self):
+        self.reserve([1, 2])
+        today = timezone.now()
+        dates = [timezone.localdate(today)]
+        self.add_payment(1, 1000, today)
+        generate_seller_bill(self.seller.id, dates)
+
+        self.add_payment(1, 500, today)
+        self.add_payment(2, 200, today)
+        balance = generate_balance(self.seller.id, dates)
+        bill = generate_seller_bill(self.seller.id, dates)
+
+        self.assertEqual(balance["total"]["amount"], 700)
+        self.assertEqual(bill["total_amount"], balance["total"]["amount"])
+        self.assertEqual(
+            {
+                payment_balance["client_id"]: payment_balance["total_amount"]
+                for payment_balance in bill["payment_balances"]
+            },
+            {
+                client_id: details["total_amount"]
+                for client_id, details in balance.items()
+                if client_id != "total"
+            },
+        )
+        self.assertEqual(generate_balance(self.seller.id, dates), {"total": {"amount": 0}})
+
+
+class DailyPaymentRollupTest(LotteryTestMixin, TestCase):
+    """
+    The daily rollup must follow a payment moved to another day, seller or
+    client, and the rebuild command must write it from the payments.
+    """
+
+    def setUp(self):
+        self.reserve([1])
+        self.today = timezone.now()
+        self.yesterday = self.today - timedelta(days=1)
+
+    def get_rollup(self):
+        return sorted(
+            models.SellerDailyPayment.objects.values_list(
+                "seller_id", "day", "total_amount", "payment_count")
+        )
+
+    def test_rollup_follows_the_payment_to_another_day(self):
+        payment = self.add_payment(1, 1000, self.yesterday)
+        self.add_payment(1, 500, self.today)
+
+        payment.date = self.today
+        payment.save()
+        self.assertEqual(
+            self.get_rollup(),
+            [(self.seller.id, timezone.localdate(self.today), 1500, 2)],
+        )
+
+        other_seller = models.User.objects.create(username="otro")
+        payment.seller = other_seller
+        payment.save()
+        self.assertEqual(
+            self.get_rollup(),
+            [
+                (self.seller.id, timezone.localdate(self.today), 500, 1),
+                (other_seller.id, timezone.localdate(self.today), 1000, 1),
+            ],
+        )
+
+        payment.delete()
+        self.assertEqual(
+            self.get_rollup(),
+            [(self.seller.id, timezone.localdate(self.today), 500, 1)],
+        )
+
+    def test_rebuild_command_writes_the_rollup(self):
+        self.add_payment(1, 1000, self.yesterday)
+        self.add_payment(1, 500, self.today)
+        expected = self.get_rollup()
+        models.SellerDailyPayment.objects.all().delete()
+
+        call_command("rebuild_daily_payment_rollup", stdout=mock.Mock())
+
+        self.assertEqual(self.get_rollup(), expected)
+        self.assertEqual(len(expected), 2)
+
+
+class WebhookQueueTest(LotteryTestMixin, TestCase):
+    """
+    Failed events must be retried with a growing delay until they are dead,
+    and queued events must not be checked against the events key again.
+    """
+
+    def process(self, handler):
+        return process_event_batch(handler, SerialExecutor(), batch_size=10)
+
+    def test_retry_delay_doubles_up_to_the_maximum(self):
+        self.assertEqual(
+            [get_retry_delay(attempts) for attempts in range(1, 9)],
+            [30, 60, 120, 240, 480, 960, 1920, 3600],
+        )
+
+    def test_failed_event_is_retried_with_backoff_until_dead(self):
+        event = enqueue_event({"event": "transaction.updated"})
+        handler = mock.Mock(side_effect=RuntimeError("caído"))
+
+        for attempts in range(1, constants.WEBHOOK_EVENT_MAX_ATTEMPTS + 1):
+            failed_at = timezone.now()
+            with self.assertLogs("djangopwa.webhook_queue", "ERROR"):
+                batch = self.process(handler)
+            event.refresh_from_db()
+
+            self.assertEqual(event.attempts, attempts)
+            self.assertIn("caído", event.last_error)
+            delay = (event.next_attempt_at - failed_at).total_seconds()
+            self.assertAlmostEqual(delay, get_retry_delay(attempts), delta=5)
+
+            # Not due before its delay
+            self.assertIsNone(self.process(handler))
+            models.WompiWebhookEvent.objects.filter(id=event.id).update(
+                next_attempt_at=timezone.now())
+
+        self.assertEqual(batch.dead, 1)
+        self.assertEqual(event.state, constants.WebhookEventState.DEAD)
+        self.assertIsNone(self.process(handler))
+
+        self.assertEqual(requeue_dead_events(), 1)
+        event.refresh_from_db()
+        self.assertEqual(
+            (event.state, event.attempts), (constants.WebhookEventState.PENDING, 0))
+
+    def test_queued_event_survives_an_events_key_rotation(self):
+        self.reserve([1])
+        event = enqueue_event(
+            sign_transaction_event(
+                build_transaction("REF", "APPROVED", 1000000, transaction_id="1-a")))
+
+        with mock.patch.object(wompi.credentials, "events_key", "rotada"):
+            batch = self.process(process_queued_event)
+
+        self.assertEqual(batch.done, 1)
+        event.refresh_from_db()
+        self.assertEqual(event.result, "Transaction updated successfully")
+        self.assertEqual(models.Payment.objects.count(), 1)
+
+    def test_event_filter_only_claims_matching_events(self):
+        ours = enqueue_event(sign_transaction_event(
+            build_transaction("loadtest-1", "APPROVED", 1000000, transaction_id="1-a")))
+        theirs = enqueue_event(sign_transaction_event(
+            build_transaction("REF", "APPROVED", 1000000, transaction_id="2-a")))
+        handler = mock.Mock(return_value={"message": "ok"})
+
+        batch = process_event_batch(
+            handler,
+            SerialExecutor(),
+            batch_size=10,
+            event_filter=Q(
+                payload__data__transaction__reference__startswith="loadtest"),
+        )
+
+        self.assertEqual(batch.done, 1)
+        handler.assert_called_once_with(ours.payload)
+        theirs.refresh_from_db()
+        self.assertEqual(theirs.state, constants.WebhookEventState.PENDING)
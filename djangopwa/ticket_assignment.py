@@ -0,0 +1,357 @@
+from bisect import bisect_right
+from dataclasses import dataclass
+from itertools import accumulate
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+
+from djangopwa import constants
+from djangopwa import models
+
+
+# Bumped on every assignment change, it is part of the interval and index
+# cache keys so a change invalidates every one of them at once.
+ASSIGNMENTS_GENERATION_CACHE_KEY = "ticket_assignments_generation"
+
+
+def get_assignments_generation():
+    return cache.get_or_set(ASSIGNMENTS_GENERATION_CACHE_KEY, 0, None)
+
+
+def get_seller_intervals_cache_key(seller_id, lottery_id):
+    generation = get_assignments_generation()
+    return f"seller_ticket_intervals:{generation}:{seller_id}:{lottery_id}"
+
+
+def get_assignment_index_cache_key(lottery_id):
+    generation = get_assignments_generation()
+    return f"ticket_assignment_index:{generation}:{lottery_id}"
+
+
+def coalesce_intervals(intervals):
+    """
+    Sort and merge overlapping or adjacent inclusive intervals.
+
+    Args:
+        intervals (iterable): Tuples of (start, end) ticket numbers.
+
+    Returns:
+        list: The merged (start, end) tuples in ascending order.
+    """
+    coalesced = []
+    for start, end in sorted(intervals):
+        if coalesced and start <= coalesced[-1][1] + 1:
+            if end > coalesced[-1][1]:
+                coalesced[-1] = (coalesced[-1][0], end)
+        else:
+            coalesced.append((start, end))
+    return coalesced
+
+
+def build_seller_intervals(seller_id, lottery_id):
+    """
+    Resolve the ticket numbers assigned to a seller in a lottery, with one
+    query for the ranges and one for the individual tickets.
+
+    Returns:
+        list: The coalesced (start, end) intervals of the assigned numbers.
+    """
+    assignments = models.TicketAssignment.objects.filter(
+        assigned_to_id=seller_id, lottery_id=lottery_id
+    )
+
+    ranges = assignments.filter(
+        start_number__isnull=False, end_number__isnull=False
+    ).values_list("start_number", "end_number")
+
+    individual_numbers = models.Ticket.objects.filter(
+        ticketassignment__assigned_to_id=seller_id,
+        ticketassignment__lottery_id=lottery_id,
+    ).values_list("number", flat=True)
+
+    return coalesce_intervals(
+        [*ranges, *((number, number) for number in individual_numbers)]
+    )
+
+
+def get_seller_intervals(seller_id, lottery_id):
+    """
+    Get the coalesced intervals of the numbers assigned to a seller, cached
+    per (seller, lottery).
+
+    Args:
+        seller_id (int): The ID of the seller.
+        lottery_id (int): The ID of the lottery.
+
+    Returns:
+        list: The (start, end) intervals in ascending order.
+    """
+    cache_key = get_seller_intervals_cache_key(seller_id, lottery_id)
+    intervals = cache.get(cache_key)
+
+    if intervals is None:
+        intervals = build_seller_intervals(seller_id, lottery_id)
+        cache.set(cache_key, intervals,
+                  constants.SELLER_ASSIGNMENT_CACHE_SECONDS)
+
+    return intervals
+
+
+@dataclass(frozen=True)
+class AssignedInterval:
+    start: int
+    end: int
+    seller_id: int
+    assignment_id: int
+
+
+class AssignmentIndex:
+    """
+    Sorted intervals of the ticket numbers assigned in a lottery.
+
+    The intervals are sorted by start next to the running maximum of their
+    ends, so the intervals containing a number or overlapping a range are
+    found with a binary search followed by a backward scan that stops as
+    soon as no earlier interval can reach that far.
+
+    The scan also walks the intervals nested under a long earlier one, so
+    a lookup is O(n) in the worst case instead of the O(log n + k) of an
+    interval tree, and any assignment change rebuilds the whole index
+    instead of updating it. Both are kept on purpose: a lottery has a few
+    hundred assignments that change a few times a day, and the index only
+    serves reads. Writes are validated against the database by
+    find_assignment_conflicts.
+
+    Attributes
+    ----------
+    lottery_id : int
+        ID of the indexed lottery.
+    intervals : list
+        The AssignedInterval of every range and individual ticket.
+    """
+
+    def __init__(self, lottery_id, intervals):
+        self.lottery_id = lottery_id
+        self.intervals = sorted(
+            intervals, key=lambda interval: (interval.start, interval.end)
+        )
+        self._starts = [interval.start for interval in self.intervals]
+        self._max_ends = list(
+            accumulate((interval.end for interval in self.intervals), max)
+        )
+
+    @classmethod
+    def build(cls, lottery_id):
+        """
+        Build the index with one query for the ranges and one for the
+        individual tickets of the lottery.
+        """
+        ranges = models.TicketAssignment.objects.filter(
+            lottery_id=lottery_id,
+            start_number__isnull=False,
+            end_number__isnull=False,
+        ).values_list("start_number", "end_number", "assigned_to_id", "id")
+
+        individual_tickets = models.TicketAssignment.individual_tickets.through.objects.filter(
+            ticketassignment__lottery_id=lottery_id
+        ).values_list(
+            "ticket__number", "ticketassignment__assigned_to_id", "ticketassignment_id"
+        )
+
+        return cls(
+            lottery_id,
+            [
+                *(AssignedInterval(*assignment) for assignment in ranges),
+                *(
+                    AssignedInterval(number, number, seller_id, assignment_id)
+                    for number, seller_id, assignment_id in individual_tickets
+                ),
+            ],
+        )
+
+    def overlapping(self, start, end):
+        """
+        Yields the intervals that share at least one number with [start, end].
+        """
+        position = bisect_right(self._starts, end) - 1
+        while position >= 0 and self._max_ends[position] >= start:
+            interval = self.intervals[position]
+            if interval.end >= start:
+                yield interval
+            position -= 1
+
+    def get_owners(self, ticket_numbers):
+        """
+        Get the sellers every ticket number is assigned to.
+
+        Returns:
+            dict: The sorted IDs of the owner sellers keyed by ticket number,
+            an empty list for unassigned numbers.
+        """
+        return {
+            number: sorted(
+                {interval.seller_id for interval in self.overlapping(number, number)}
+            )
+            for number in ticket_numbers
+        }
+
+    def get_assigned_intervals(self):
+        """
+        Get the coalesced intervals of every assigned number, whoever owns it.
+        """
+        return coalesce_intervals(
+            (interval.start, interval.end) for interval in self.intervals
+        )
+
+    def get_all_conflicts(self):
+        """
+        Get every pair of overlapping intervals assigned to different sellers.
+
+        Returns:
+            list: Tuples of two conflicting AssignedInterval.
+        """
+        conflicts = []
+        for position, interval in enumerate(self.intervals):
+            for other in self.overlapping(interval.start, interval.end):
+                if (
+                    other.seller_id != interval.seller_id
+                    and (other.start, other.end, other.assignment_id)
+                    < (interval.start, interval.end, interval.assignment_id)
+                ):
+                    conflicts.append((other, interval))
+        return conflicts
+
+
+def get_assignment_index(lottery_id):
+    """
+    Get the assignment index of a lottery, building and caching it on a miss.
+
+    Any assignment change invalidates the cached index, it is rebuilt with
+    two flat queries on the next read.
+
+    Args:
+        lottery_id (int): The ID of the lottery.
+
+    Returns:
+        AssignmentIndex: The assignment index of the lottery.
+    """
+    cache_key = get_assignment_index_cache_key(lottery_id)
+    index = cache.get(cache_key)
+
+    if index is None:
+        index = AssignmentIndex.build(lottery_id)
+        cache.set(cache_key, index, constants.SELLER_ASSIGNMENT_CACHE_SECONDS)
+
+    return index
+
+
+def lock_lottery_assignments(lottery_id):
+    """
+    Lock the lottery row, so the assignments of the lottery are validated
+    and written one at a time until the transaction ends.
+
+    Outside of a transaction there is nothing to hold the lock for, the
+    caller validates without it.
+    """
+    if transaction.get_connection().in_atomic_block:
+        models.Lottery.objects.select_for_update().filter(id=lottery_id).exists()
+
+
+def find_assignment_conflicts(lottery_id, intervals, seller_id, assignment_id=None):
+    """
+    Get the assignments of other sellers overlapping some intervals, read
+    from the database rather than the cached index.
+
+    One query finds the ranges with start <= end of an interval and
+    end >= its start, answered by the (lottery, start, end) index, another
+    the individual tickets inside the intervals.
+
+    Args:
+        lottery_id (int): The ID of the lottery.
+        intervals (list): The (start, end) intervals to check.
+        seller_id (int): The seller the intervals are assigned to.
+        assignment_id (int, optional): The assignment being edited, its
+            current ranges and tickets are ignored.
+
+    Returns:
+        list: The conflicting AssignedInterval, sorted by start.
+    """
+    intervals = coalesce_intervals(intervals)
+    if not intervals:
+        return []
+
+    overlap_filter = Q()
+    for start, end in intervals:
+        overlap_filter |= Q(start_number__lte=end, end_number__gte=start)
+
+    assignments = models.TicketAssignment.objects.filter(
+        lottery_id=lottery_id
+    ).exclude(assigned_to_id=seller_id)
+    if assignment_id is not None:
+        assignments = assignments.exclude(id=assignment_id)
+
+    ranges = assignments.filter(overlap_filter).values_list(
+        "start_number", "end_number", "assigned_to_id", "id"
+    )
+
+    individual_tickets = models.TicketAssignment.individual_tickets.through.objects.filter(
+        build_intervals_filter(intervals, "ticket__number"),
+        ticketassignment__in=assignments,
+    ).values_list(
+        "ticket__number", "ticketassignment__assigned_to_id", "ticketassignment_id"
+    )
+
+    return sorted(
+        [
+            *(AssignedInterval(*assignment) for assignment in ranges),
+            *(
+                AssignedInterval(number, number, seller_id, assignment_id)
+                for number, seller_id, assignment_id in individual_tickets
+            ),
+        ],
+        key=lambda interval: (interval.start, interval.end),
+    )
+
+
+def build_intervals_filter(intervals, field_name="number"):
+    """
+    Compile intervals into a filter with one BETWEEN per range and a single
+    IN for the isolated numbers, so its size follows the number of intervals
+    instead of the number of tickets.
+
+    Args:
+        intervals (list): Coalesced (start, end) intervals.
+        field_name (str): The ticket number field to filter on.
+
+    Returns:
+        Q: The filter, it matches nothing when there are no intervals.
+    """
+    intervals_filter = Q()
+    single_numbers = []
+
+    for start, end in intervals:
+        if start == end:
+            single_numbers.append(start)
+        else:
+            intervals_filter |= Q(**{f"{field_name}__range": (start, end)})
+
+    if single_numbers:
+        intervals_filter |= Q(**{f"{field_name}__in": single_numbers})
+
+    if not intervals_filter:
+        return Q(pk__in=[])
+
+    return intervals_filter
+
+
+def invalidate_seller_intervals():
+    try:
+        cache.incr(ASSIGNMENTS_GENERATION_CACHE_KEY)
+    except ValueError:
+        cache.set(ASSIGNMENTS_GENERATION_CACHE_KEY, 1, None)
+
+
+def on_assignment_changed(sender, **kwargs):
+    # After the commit, a read in between would cache the old assignments
+    transaction.on_commit(invalidate_seller_intervals)
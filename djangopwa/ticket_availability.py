@@ -0,0 +1,353 @@
+import base64
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+
+from djangopwa import constants
+from djangopwa import models
+from djangopwa.lottery_counters import (
+    is_lottery_deletion,
+    move_lottery_counters,
+    move_ticket_counters,
+    refresh_lottery_counters,
+)
+
+
+def get_cache_key(lottery_id):
+    return f"ticket_availability:{lottery_id}"
+
+
+class AvailabilityIndex:
+    """
+    Bitset of the available ticket numbers of a lottery.
+
+    Bit ``i`` is set when ticket number ``lower + i`` is available, so a
+    10,000 number lottery fits in 1,250 bytes.
+
+    Attributes
+    ----------
+    lottery_id : int
+        ID of the indexed lottery.
+    lower : int
+        First ticket number of the lottery.
+    upper : int
+        Last ticket number of the lottery.
+    bits : bytearray
+        The availability bitset.
+    version : int
+        Availability version of the lottery the bitset reflects.
+    """
+
+    def __init__(self, lottery_id, lower, upper, bits=None, version=0):
+        self.lottery_id = lottery_id
+        self.lower = lower
+        self.upper = upper
+        self.version = version
+        size = (upper - lower) // 8 + 1 if upper >= lower else 0
+        self.bits = bits if bits is not None else bytearray(size)
+
+    @classmethod
+    def build(cls, lottery):
+        """
+        Build the index from the ticket table with a single flat query.
+
+        Args:
+            lottery (Lottery): The lottery to index.
+
+        Returns:
+            AvailabilityIndex: The index of the available tickets.
+        """
+        # Read the version before the tickets, a transition committed in
+        # between is then sent again as a delta instead of being lost.
+        version = models.Lottery.objects.filter(id=lottery.id).values_list(
+            "availability_version", flat=True
+        ).first() or 0
+
+        index = cls(
+            lottery.id,
+            lottery.lower_series_range,
+            lottery.upper_series_range,
+            version=version,
+        )
+        available_numbers = models.Ticket.objects.filter(
+            lottery_id=lottery.id, state=constants.TicketState.AVAILABLE
+        ).values_list("number", flat=True)
+
+        for number in available_numbers.iterator():
+            index.set_available(number, True)
+
+        return index
+
+    def contains(self, number):
+        return self.lower <= number <= self.upper
+
+    def is_available(self, number):
+        if not self.contains(number):
+            return False
+        offset = number - self.lower
+        return bool(self.bits[offset >> 3] & (1 << (offset & 7)))
+
+    def set_available(self, number, available):
+        if not self.contains(number):
+            return
+        offset = number - self.lower
+        if available:
+            self.bits[offset >> 3] |= 1 << (offset & 7)
+        else:
+            self.bits[offset >> 3] &= ~(1 << (offset & 7)) & 0xFF
+
+    def available_count(self):
+        return int.from_bytes(self.bits, "little").bit_count()
+
+    def available_numbers(self):
+        """
+        Yields the available ticket numbers in ascending order.
+        """
+        for byte_index, byte in enumerate(self.bits):
+            if not byte:
+                continue
+            for bit in range(8):
+                if byte & (1 << bit):
+                    yield self.lower + (byte_index << 3) + bit
+
+    def to_payload(self):
+        """
+        Serialize the index into the compact payload consumed by the templates.
+
+        Returns:
+            dict: The lottery bounds, the version, the available count and
+            the base64 bitset.
+        """
+        return {
+            "lottery_id": self.lottery_id,
+            "version": self.version,
+            "lower": self.lower,
+            "upper": self.upper,
+            "available_count": self.available_count(),
+            "bitset": base64.b64encode(bytes(self.bits)).decode("ascii"),
+        }
+
+
+def get_cached_availability_index(lottery_id):
+    return cache.get(get_cache_key(lottery_id))
+
+
+def get_availability_index(lottery):
+    """
+    Get the availability index of a lottery, building and caching it on a miss.
+
+    Args:
+        lottery (Lottery): The lottery whose availability is requested.
+
+    Returns:
+        AvailabilityIndex: The availability index of the lottery.
+    """
+    cache_key = get_cache_key(lottery.id)
+    index = cache.get(cache_key)
+
+    if index is None:
+        index = AvailabilityIndex.build(lottery)
+        cache.set(
+            cache_key, index, constants.TICKET_AVAILABILITY_CACHE_SECONDS
+        )
+
+    return index
+
+
+def update_availability_index(lottery_id, ticket_numbers, state, version):
+    """
+    Patch the cached index of a lottery after some tickets changed state.
+
+    The cache offers no atomic read-modify-write, so the index is only
+    patched when it is exactly one version behind the transition. Any other
+    version means a concurrent transition got there first or was missed,
+    the index is then dropped and rebuilt from the ticket table on the next
+    read, so a cached index always reflects exactly its version.
+
+    Args:
+        lottery_id (int): The ID of the lottery.
+        ticket_numbers (list): The ticket numbers that changed.
+        state (int): The new state of the tickets.
+        version (int): The availability version of the transition.
+    """
+    cache_key = get_cache_key(lottery_id)
+    index = cache.get(cache_key)
+
+    if index is None:
+        return
+
+    if index.version != version - 1:
+        cache.delete(cache_key)
+        return
+
+    available = state == constants.TicketState.AVAILABLE
+    for ticket_number in ticket_numbers:
+        index.set_available(ticket_number, available)
+    index.version = version
+
+    cache.set(cache_key, index, constants.TICKET_AVAILABILITY_CACHE_SECONDS)
+
+
+def bump_availability_version(lottery_id):
+    """
+    Increment the availability version of a lottery.
+
+    The conditional UPDATE locks the lottery row until the surrounding
+    transaction commits, so versions become visible in increasing order.
+
+    Args:
+        lottery_id (int): The ID of the lottery.
+
+    Returns:
+        int: The new availability version.
+    """
+    lottery_queryset = models.Lottery.objects.filter(id=lottery_id)
+    lottery_queryset.update(availability_version=F("availability_version") + 1)
+    return lottery_queryset.values_list("availability_version", flat=True).first()
+
+
+def ticket_state_changed(lottery_id, ticket_numbers, state, previous_states=None):
+    """
+    Record that some tickets of a lottery changed state.
+
+    The transition bumps the availability version of the lottery, is
+    appended to the change log read by the delta sync endpoint and moves
+    the lottery counters. The cached index is patched once the current
+    transaction commits so a rolled back reservation never leaks into the
+    cache.
+
+    Args:
+        lottery_id (int): The ID of the lottery.
+        ticket_numbers (list): The ticket numbers that changed.
+        state (int): The new state of the tickets.
+        previous_states (dict, optional): The number of those tickets that
+            were in each state before, empty for new tickets. When unknown
+            the counters of the lottery are rebuilt from its tickets.
+
+    Returns:
+        int: The availability version of the transition.
+    """
+    ticket_numbers = list(ticket_numbers)
+    if not ticket_numbers:
+        return None
+
+    with transaction.atomic():
+        version = bump_availability_version(lottery_id)
+        models.TicketStateChange.objects.bulk_create(
+            [
+                models.TicketStateChange(
+                    lottery_id=lottery_id,
+                    number=ticket_number,
+                    state=state,
+                    version=version,
+                )
+                for ticket_number in ticket_numbers
+            ]
+        )
+        if previous_states is None:
+            refresh_lottery_counters([lottery_id])
+        else:
+            move_ticket_counters(
+                lottery_id, state, len(ticket_numbers), previous_states)
+
+    transaction.on_commit(
+        lambda: on_ticket_state_committed(
+            lottery_id, ticket_numbers, state, version)
+    )
+    return version
+
+
+def on_ticket_state_committed(lottery_id, ticket_numbers, state, version):
+    from djangopwa.lottery_statistics import invalidate_lottery_statistics
+    from djangopwa.ticket_sampler import update_ticket_sampler
+
+    update_availability_index(lottery_id, ticket_numbers, state, version)
+    update_ticket_sampler(lottery_id, ticket_numbers, state, version)
+    invalidate_lottery_statistics()
+
+
+def get_availability_changes(lottery_id, since_version):
+    """
+    Get the latest state of every ticket that changed after a version.
+
+    Every version has at least one row in the change log and versions are
+    consecutive, so a log that does not start right after ``since_version``
+    was pruned past it and can no longer tell what changed.
+
+    Args:
+        lottery_id (int): The ID of the lottery.
+        since_version (int): The last version known by the client.
+
+    Returns:
+        tuple | None: The newest version found and a dict mapping each
+        changed ticket number to its current state, None when the changes
+        are no longer retained and a full snapshot is needed.
+    """
+    changes = models.TicketStateChange.objects.filter(
+        lottery_id=lottery_id, version__gt=since_version
+    ).order_by("version").values_list("number", "state", "version")
+
+    latest_version = since_version
+    ticket_states = {}
+    for number, state, version in changes:
+        if latest_version == since_version and version != since_version + 1:
+            return None
+        ticket_states[number] = state
+        latest_version = version
+
+    return latest_version, ticket_states
+
+
+def prune_ticket_state_changes():
+    """
+    Delete the change log rows no client can be sent as a delta anymore,
+    those more than TICKET_AVAILABILITY_MAX_DELTA_VERSIONS behind the
+    current version of their lottery. A client behind the retained rows
+    gets a full snapshot, see get_availability_changes.
+
+    Returns:
+        int: The number of deleted rows.
+    """
+    deleted, _ = models.TicketStateChange.objects.filter(
+        version__lte=F("lottery__availability_version")
+        - constants.TICKET_AVAILABILITY_MAX_DELTA_VERSIONS
+    ).delete()
+    return deleted
+
+
+def on_ticket_saved(sender, instance, created, update_fields=None, **kwargs):
+    # Saved without writing the state
+    if update_fields is not None and "state" not in update_fields:
+        return
+
+    if created:
+        previous_states = {}
+    elif instance.get_previous_state() is not None:
+        previous_states = {instance.get_previous_state(): 1}
+    else:
+        # Saved over an existing row without loading it first
+        previous_states = None
+
+    # Saved without a state change, the clients have nothing to sync
+    if previous_states == {instance.state: 1}:
+        return
+
+    ticket_state_changed(
+        instance.lottery_id, [instance.number], instance.state, previous_states)
+
+
+def discard_availability(lottery_id):
+    from djangopwa.ticket_sampler import discard_ticket_sampler
+
+    cache.delete(get_cache_key(lottery_id))
+    discard_ticket_sampler(lottery_id)
+
+
+def on_ticket_deleted(sender, instance, origin=None, **kwargs):
+    if not is_lottery_deletion(origin):
+        # Sent inside the deletion transaction
+        move_lottery_counters(instance.lottery_id, {instance.state: -1})
+
+    # A deleted ticket only leaves the cache, its lottery may be going away
+    transaction.on_commit(lambda: discard_availability(instance.lottery_id))
@@ -0,0 +1,179 @@
+from dataclasses import dataclass, field
+
+from django.db import transaction
+from django.utils import timezone
+
+from djangopwa import constants
+from djangopwa import models
+from djangopwa.ticket_availability import ticket_state_changed
+
+
+class ReservationConflict(Exception):
+    """
+    Raised inside the reservation transaction to roll it back when some of
+    the requested tickets could not be reserved.
+    """
+
+    def __init__(self, unavailable):
+        super().__init__(unavailable)
+        self.unavailable = unavailable
+
+
+@dataclass
+class ReservationResult:
+    reserved: list = field(default_factory=list)
+    unavailable: list = field(default_factory=list)
+
+
+def lock_available_tickets(lottery_id, ticket_numbers):
+    """
+    Lock the requested tickets that are still available.
+
+    Rows already locked by a concurrent checkout are skipped instead of
+    waited for, they are lost for this reservation.
+
+    Returns:
+        dict: The ID of every locked ticket keyed by its number.
+    """
+    tickets = (
+        models.Ticket.objects.select_for_update(skip_locked=True)
+        .filter(
+            lottery_id=lottery_id,
+            number__in=ticket_numbers,
+            state=constants.TicketState.AVAILABLE,
+        )
+        .values_list("number", "id")
+    )
+    return dict(tickets)
+
+
+def create_reservation_clients(lottery, tickets, client_data, seller):
+    """
+    Create one ClientInfo per reserved ticket with a single insert.
+
+    Returns:
+        dict: The ID of the client created for every ticket ID.
+    """
+    purchase_reference = client_data.get("purchase_reference")
+
+    clients = models.ClientInfo.objects.bulk_create(
+        [
+            models.ClientInfo(
+                name=client_data.get("name"),
+                lastname=client_data.get("lastname"),
+                whatsapp=client_data.get("whatsapp"),
+                telephone=client_data.get("whatsapp"),
+                document_number=client_data.get("document_number"),
+                city=client_data.get("city"),
+                lottery_to_buy=lottery,
+                ticket_number_id=ticket_id,
+                purchase_reference=purchase_reference,
+                seller=seller,
+            )
+            for ticket_id in tickets.values()
+        ]
+    )
+
+    if all(client.pk for client in clients):
+        return {client.ticket_number_id: client.pk for client in clients}
+
+    # Backends that do not return the inserted primary keys (MySQL)
+    return dict(
+        models.ClientInfo.objects.filter(
+            purchase_reference=purchase_reference,
+            ticket_number_id__in=tickets.values(),
+        ).values_list("ticket_number_id", "id")
+    )
+
+
+def reserve_tickets(lottery, ticket_numbers, client_data, seller=None, require_all=True):
+    """
+    Reserve several tickets of a lottery in one transaction.
+
+    The available tickets are locked and moved to RESERVED with one
+    conditional UPDATE, then their ClientInfo, TicketReserved and
+    TicketPendingPurchase rows are written with bulk inserts, so the number
+    of queries does not depend on the number of tickets.
+
+    Args:
+        lottery (Lottery): The lottery the tickets belong to.
+        ticket_numbers (list): The ticket numbers to reserve.
+        client_data (dict): The buyer data and the purchase reference.
+        seller (User, optional): The seller of the purchase.
+        require_all (bool): Reserve nothing unless every ticket is won.
+
+    Returns:
+        ReservationResult: The reserved and the unavailable ticket numbers.
+    """
+    ticket_numbers = sorted(set(ticket_numbers))
+    if not ticket_numbers:
+        return ReservationResult()
+
+    seller = seller or models.get_default_seller()
+    purchase_reference = client_data.get("purchase_reference")
+    expiration = timezone.now() + timezone.timedelta(
+        days=constants.MAX_TIME_DAYS_RESERVATION_TICKET
+    )
+
+    try:
+        with transaction.atomic():
+            tickets = lock_available_tickets(lottery.id, ticket_numbers)
+
+            if require_all and len(tickets) != len(ticket_numbers):
+                raise ReservationConflict(
+                    [number for number in ticket_numbers if number not in tickets]
+                )
+
+            updated = models.Ticket.objects.filter(
+                id__in=tickets.values(), state=constants.TicketState.AVAILABLE
+            ).update(state=constants.TicketState.RESERVED)
+
+            # Only possible on backends without row locks (SQLite)
+            if updated != len(tickets):
+                raise ReservationConflict(ticket_numbers)
+
+            if not tickets:
+                return ReservationResult(unavailable=ticket_numbers)
+
+            client_ids = create_reservation_clients(
+                lottery, tickets, client_data, seller
+            )
+
+            models.TicketReserved.objects.bulk_create(
+                [
+                    models.TicketReserved(
+                        ticket_id=ticket_id,
+                        expiration=expiration,
+                        client_id=client_ids[ticket_id],
+                        purchase_reference=purchase_reference,
+                    )
+                    for ticket_id in tickets.values()
+                ]
+            )
+
+            models.TicketPendingPurchase.objects.bulk_create(
+                [
+                    models.TicketPendingPurchase(
+                        ticket_id=ticket_id,
+                        expiration=expiration,
+                        client_id=client_ids[ticket_id],
+                        purchase_reference=purchase_reference,
+                    )
+                    for ticket_id in tickets.values()
+                ]
+            )
+
+            ticket_state_changed(
+                lottery.id,
+                tickets.keys(),
+                constants.TicketState.RESERVED,
+                previous_states={constants.TicketState.AVAILABLE: len(tickets)},
+            )
+    except ReservationConflict as conflict:
+        return ReservationResult(unavailable=conflict.unavailable)
+
+    return ReservationResult(
+        reserved=sorted(tickets),
+        unavailable=[
+            number for number in ticket_numbers if number not in tickets],
+    )
@@ -0,0 +1,247 @@
+import random
+import threading
+import time
+from collections import deque
+
+from djangopwa import constants
+from djangopwa import models
+from djangopwa.checkout_hold import (
+    HOLD_PURPOSE_ROULETTE,
+    acquire_hold,
+    release_owner_holds,
+)
+from djangopwa.ticket_availability import (
+    get_availability_changes,
+    get_availability_index,
+    get_cached_availability_index,
+)
+
+
+# Attempts made by draw_and_hold before giving up on numbers held elsewhere
+MAX_HOLD_ATTEMPTS = 16
+
+_samplers = {}
+_samplers_lock = threading.Lock()
+
+
+class TicketSampler:
+    """
+    Uniform random sampler over the available tickets of a lottery.
+
+    The available numbers live in a list and their positions in a dict, so a
+    number is drawn, added or removed (swap with the last item and pop) in
+    O(1). Held numbers leave the list until their hold expires.
+
+    Attributes
+    ----------
+    lottery_id : int
+        ID of the sampled lottery.
+    version : int
+        Availability version of the lottery the sampler reflects.
+    """
+
+    def __init__(self, lottery_id, ticket_numbers, version):
+        self.lottery_id = lottery_id
+        self.version = version
+        self.lock = threading.Lock()
+        self._reset(ticket_numbers)
+
+    @classmethod
+    def from_index(cls, index):
+        return cls(index.lottery_id, index.available_numbers(), index.version)
+
+    def _reset(self, ticket_numbers):
+        self._numbers = list(ticket_numbers)
+        self._positions = {
+            number: position for position, number in enumerate(self._numbers)
+        }
+        self._held = {}
+        self._hold_queue = deque()
+
+    def __len__(self):
+        return len(self._numbers)
+
+    def _add(self, ticket_number):
+        if ticket_number in self._positions or ticket_number in self._held:
+            return
+        self._positions[ticket_number] = len(self._numbers)
+        self._numbers.append(ticket_number)
+
+    def _remove(self, ticket_number):
+        position = self._positions.pop(ticket_number, None)
+        if position is None:
+            return
+        last_number = self._numbers.pop()
+        if last_number != ticket_number:
+            self._numbers[position] = last_number
+            self._positions[last_number] = position
+
+    def _hold(self, ticket_number, expires_at):
+        self._remove(ticket_number)
+        self._held[ticket_number] = expires_at
+        self._hold_queue.append((expires_at, ticket_number))
+
+    def _unhold(self, ticket_number):
+        # Left in the queue, the stale entry no longer matches _held
+        if self._held.pop(ticket_number, None) is not None:
+            self._add(ticket_number)
+
+    def _release_expired_holds(self):
+        now = time.monotonic()
+        while self._hold_queue and self._hold_queue[0][0] <= now:
+            expires_at, ticket_number = self._hold_queue.popleft()
+            # Skip numbers that were re-held or became unavailable meanwhile
+            if self._held.get(ticket_number) == expires_at:
+                del self._held[ticket_number]
+                self._add(ticket_number)
+
+    def apply(self, ticket_numbers, state, version):
+        """
+        Apply a state transition recorded with the given availability version.
+
+        A transition that does not directly follow the known version means
+        some were missed, it is left to sync() which reads the change log.
+        """
+        with self.lock:
+            if version != self.version + 1:
+                return
+            self._apply(ticket_numbers, state)
+            self.version = version
+
+    def _apply(self, ticket_numbers, state):
+        for ticket_number in ticket_numbers:
+            if state == constants.TicketState.AVAILABLE:
+                self._add(ticket_number)
+            else:
+                self._remove(ticket_number)
+                self._held.pop(ticket_number, None)
+
+    def sync(self, index):
+        """
+        Catch up with the availability index of the lottery.
+
+        Small gaps are filled from the change log with one query, larger ones
+        or gaps the pruned log no longer covers rebuild the sampler from the
+        index.
+        """
+        with self.lock:
+            if index.version <= self.version:
+                return
+
+            changes = None
+            if (
+                index.version - self.version
+                <= constants.TICKET_AVAILABILITY_MAX_DELTA_VERSIONS
+            ):
+                changes = get_availability_changes(self.lottery_id, self.version)
+
+            if changes is None:
+                self._reset(index.available_numbers())
+                self.version = index.version
+                return
+
+            version, ticket_states = changes
+            for ticket_number, state in ticket_states.items():
+                self._apply([ticket_number], state)
+            self.version = max(version, self.version)
+
+    def draw(self):
+        """
+        Draw an available ticket number uniformly at random.
+
+        Returns:
+            int | None: The drawn ticket number, None when none is available.
+        """
+        with self.lock:
+            self._release_expired_holds()
+            if not self._numbers:
+                return None
+            return self._numbers[random.randrange(len(self._numbers))]
+
+    def draw_and_hold(self, owner, hold_seconds):
+        """
+        Draw an available ticket number and hold it so that no concurrent
+        spin or checkout, in this process or any other sharing the cache,
+        gets it before the hold expires.
+
+        The number of the previous spin of the owner is released first, so
+        an owner holds a single roulette number however often it spins.
+
+        Args:
+            owner (str): The hold owner token of the spinner.
+            hold_seconds (int): Seconds the drawn number stays held.
+
+        Returns:
+            int | None: The drawn ticket number, None when none could be held.
+        """
+        with self.lock:
+            self._release_expired_holds()
+
+            for ticket_number in release_owner_holds(
+                self.lottery_id, owner, HOLD_PURPOSE_ROULETTE
+            ):
+                self._unhold(ticket_number)
+
+            for _ in range(MAX_HOLD_ATTEMPTS):
+                if not self._numbers:
+                    return None
+
+                ticket_number = self._numbers[
+                    random.randrange(len(self._numbers))]
+                expires_at = time.monotonic() + hold_seconds
+                self._hold(ticket_number, expires_at)
+
+                # Fails when another spinner or checkout holds the number
+                if acquire_hold(
+                    self.lottery_id,
+                    ticket_number,
+                    owner,
+                    hold_seconds,
+                    purpose=HOLD_PURPOSE_ROULETTE,
+                ):
+                    return ticket_number
+
+            return None
+
+
+def get_ticket_sampler(lottery_id):
+    """
+    Get the sampler of a lottery, up to date with its availability index.
+
+    Args:
+        lottery_id (int): The ID of the lottery.
+
+    Returns:
+        TicketSampler: The sampler of the lottery.
+
+    Raises:
+        Lottery.DoesNotExist: If the lottery does not exist.
+    """
+    index = get_cached_availability_index(lottery_id)
+    if index is None:
+        index = get_availability_index(
+            models.Lottery.objects.get(id=lottery_id))
+
+    with _samplers_lock:
+        sampler = _samplers.get(lottery_id)
+        if sampler is None:
+            sampler = TicketSampler.from_index(index)
+            _samplers[lottery_id] = sampler
+
+    sampler.sync(index)
+    return sampler
+
+
+def update_ticket_sampler(lottery_id, ticket_numbers, state, version):
+    """
+    Patch the sampler of a lottery, if this process has one, after some
+    tickets changed state.
+    """
+    sampler = _samplers.get(lottery_id)
+    if sampler is not None:
+        sampler.apply(ticket_numbers, state, version)
+
+
+def discard_ticket_sampler(lottery_id):
+    with _samplers_lock:
+        _samplers.pop(lottery_id, None)
@@ -32,6 +32,11 @@ urlpatterns = [
         views.get_ticket_state,
         name="get_ticket_state",
     ),
+    path(
+        "api/lottery/<int:lottery_id>/ticket_availability",
+        views.get_ticket_availability,
+        name="get_ticket_availability",
+    ),
     path(
         "api/get_client_bill_data/<int:clientId>/<int:billType>",
         views.get_client_bill_data,
@@ -48,11 +53,26 @@ urlpatterns = [
         views.decline_ticket,
         name="decline_ticket"
     ),
+    path(
+        "api/verify_purchases",
+        views.verify_ticket_purchases,
+        name="verify_ticket_purchases",
+    ),
+    path(
+        "api/decline_tickets",
+        views.decline_tickets,
+        name="decline_tickets",
+    ),
     path(
         "api/get_tickets_to_assign",
         views.get_tickets_to_assign,
         name="get_tickets_to_assign"
     ),
+    path(
+        "api/lottery/<int:lottery_id>/ticket_owners",
+        views.get_ticket_owners,
+        name="get_ticket_owners",
+    ),
     path(
         "api/get_ticket_info/<int:lottery_id>/<int:ticket_number>",
         views.get_ticket_info,
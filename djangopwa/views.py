@@ -4,19 +4,30 @@ import requests
 
 from django.utils import timezone
 from django.shortcuts import get_object_or_404, render, redirect
-from django.http import HttpResponse, JsonResponse
+from django.http import HttpResponse, HttpResponseNotModified, JsonResponse
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.decorators import user_passes_test
 from django.core.paginator import Paginator
 
 from djangopwa import constants
 from djangopwa.constants import TicketState
+from djangopwa.ticket_availability import (
+    get_availability_changes,
+    get_availability_index,
+    get_cached_availability_index,
+)
+from djangopwa.ticket_assignment import get_assignment_index
+from djangopwa.purchase_verification import (
+    decline_clients,
+    get_foreign_client_ids,
+    verify_clients,
+)
 from djangopwa.payment_balance import (
     parse_dates,
-    get_payments_by_dates,
     generate_balance,
+    generate_outstanding_balance,
+    generate_outstanding_seller_bill,
     generate_seller_bill,
-    serialize_seller_bill_json,
 )
 
 import json
@@ -37,6 +48,67 @@ def get_ticket_state(request):
     return JsonResponse({"ticket_state": ticket.state == TicketState.AVAILABLE})
 
 
+def get_ticket_availability(request, lottery_id):
+    """
+    Returns the ticket availability of a lottery as a versioned snapshot.
+
+    A client sending the last version it knows gets only the ticket numbers
+    that changed since then, or a 304 when nothing changed. Clients without a
+    version, or too far behind, get the full bitset snapshot.
+
+    Args:
+        request (HttpRequest): The HTTP request.
+        lottery_id (int): The ID of the lottery.
+
+    Returns:
+        JsonResponse: The snapshot or the changes since the client version.
+    """
+    try:
+        client_version = int(request.GET.get("version", ""))
+    except ValueError:
+        client_version = None
+
+    index = get_cached_availability_index(lottery_id)
+    if index is None:
+        lottery = get_object_or_404(models.Lottery, id=lottery_id)
+        index = get_availability_index(lottery)
+
+    if client_version == index.version:
+        return HttpResponseNotModified()
+
+    if (
+        client_version is None
+        or client_version > index.version
+        or index.version - client_version
+        > constants.TICKET_AVAILABILITY_MAX_DELTA_VERSIONS
+    ):
+        return JsonResponse({**index.to_payload(), "full": True})
+
+    changes = get_availability_changes(lottery_id, client_version)
+    if changes is None:
+        # The change log was pruned past the client version
+        return JsonResponse({**index.to_payload(), "full": True})
+    version, ticket_states = changes
+
+    return JsonResponse(
+        {
+            "lottery_id": lottery_id,
+            "version": max(version, index.version),
+            "full": False,
+            "available": [
+                number
+                for number, state in ticket_states.items()
+                if state == TicketState.AVAILABLE
+            ],
+            "unavailable": [
+                number
+                for number, state in ticket_states.items()
+                if state != TicketState.AVAILABLE
+            ],
+        }
+    )
+
+
 def get_request_body(request):
     try:
         body_unicode = request.body.decode("utf-8")
@@ -45,16 +117,22 @@ def get_request_body(request):
         return None
 
 
-def build_json_response(data, status="success", message=""):
-    return JsonResponse({"status": status, "data": data, "message": message})
+def build_json_response(data, status="success", message="", http_status=200):
+    return JsonResponse(
+        {"status": status, "data": data, "message": message}, status=http_status
+    )
 
 
 @user_passes_test(check_user_active)
 def get_seller_balance_payment_list(request, seller_id):
-    dates = get_request_body(request).get("dates")
+    request_data = get_request_body(request)
+    if request_data.get("outstanding"):
+        balance = generate_outstanding_balance(seller_id)
+        return build_json_response(data=balance)
+
+    dates = request_data.get("dates")
     parsed_dates = parse_dates(dates)
-    payments = get_payments_by_dates(seller_id, parsed_dates)
-    balance = generate_balance(payments=payments)
+    balance = generate_balance(seller_id, parsed_dates)
     return build_json_response(data=balance)
 
 
@@ -76,14 +154,27 @@ def generate_seller_bill_endpoint(request, seller_id):
             data={}, status="error", message="Invalid JSON data."
         )
 
-    payments = request_data.get("payments")
-    if not payments:
+    if request_data.get("outstanding"):
+        serialized_bill = generate_outstanding_seller_bill(seller_id)
+        if serialized_bill is None:
+            return build_json_response(
+                data={}, status="error", message="No outstanding payments."
+            )
+        return build_json_response(
+            data={"bill": serialized_bill}, message="Bill generated successfully."
+        )
+
+    dates = parse_dates(request_data.get("dates") or [])
+    if not dates:
         return build_json_response(
-            data={}, status="error", message="Payments are required."
+            data={}, status="error", message="Dates are required."
         )
 
-    bill = generate_seller_bill(seller_id, payments)
-    serialized_bill = serialize_seller_bill_json(bill)
+    serialized_bill = generate_seller_bill(seller_id, dates)
+    if serialized_bill is None:
+        return build_json_response(
+            data={}, status="error", message="No outstanding payments."
+        )
 
     return build_json_response(
         data={"bill": serialized_bill}, message="Bill generated successfully."
@@ -183,7 +274,7 @@ def get_bono_client_bill_data(client: models.ClientInfo, billType):
         bill_ticket_template_image_url = ""
         bill_certificate_template_image_url = ""
         
-    payment_balance = calculate_client_balance(client)
+    payment_balance = client.paid_total
     amount_to_pay = client.lottery_to_buy.price_per_ticket - payment_balance
     
     return {
@@ -222,7 +313,7 @@ def get_total_payment_client_bill_data(client: models.ClientInfo, billType):
         bill_ticket_template_image_url = ""
         bill_certificate_template_image_url = ""
         
-    payment_balance = calculate_client_balance(client)
+    payment_balance = client.paid_total
     amount_to_pay = client.lottery_to_buy.price_per_ticket - payment_balance
 
     return {
@@ -306,14 +397,6 @@ def get_ticket_info(request, lottery_id, ticket_number):
         ticket_reserved = models.TicketReserved.objects.get(ticket=ticket)
         client = ticket_reserved.client
     if client:
-        payments = models.Payment.objects.filter(client=client)
-
-        payment_count = payments.count()
-
-        total_payment = 0
-        for payment in payments:
-            total_payment += payment.amount
-
         client_context = {
             "name_and_lastname": mask_after_third_character(client.name)
             + " "
@@ -321,21 +404,13 @@ def get_ticket_info(request, lottery_id, ticket_number):
             "document_number": mask_except_last_three_characters(
                 str(client.document_number)
             ),
-            "payment_count": payment_count,
-            "total_payment": total_payment,
+            "payment_count": client.payment_count,
+            "total_payment": client.paid_total,
         }
         data["client"] = client_context
     return JsonResponse(data)
 
 
-def calculate_client_balance(client):
-    payments = models.Payment.objects.filter(client=client)
-    payment_balance = 0
-    for payment in payments:
-        payment_balance += payment.amount
-    return payment_balance
-
-
 @user_passes_test(check_user_active)
 def get_ticket_png_data(request, client_id):
     data = {"success": False, "message": ""}
@@ -346,7 +421,7 @@ def get_ticket_png_data(request, client_id):
         data["message"] = f"Could not get client with id {client_id}"
         return JsonResponse(data)
 
-    client_balance = calculate_client_balance(client)
+    client_balance = client.paid_total
     ticket_price = client.lottery_to_buy.price_per_ticket
     amount_to_pay = ticket_price - client_balance
 
@@ -387,6 +462,146 @@ def decline_ticket(request, client_id):
     return JsonResponse(data)
 
 
+def get_request_client_ids(request):
+    request_data = get_request_body(request)
+    if not isinstance(request_data, dict):
+        return None
+    client_ids = request_data.get("client_ids")
+    if not isinstance(client_ids, list):
+        return None
+    try:
+        return [int(client_id) for client_id in client_ids]
+    except (TypeError, ValueError):
+        return None
+
+
+def reject_foreign_clients(request, client_ids):
+    """
+    Refuse a request acting on clients of other sellers, the same rows the
+    admin actions leave out.
+
+    Returns:
+        JsonResponse: A 403 response naming the foreign client IDs, None
+        when the user may act on every client.
+    """
+    foreign_client_ids = get_foreign_client_ids(request.user, client_ids)
+    if not foreign_client_ids:
+        return None
+    return build_json_response(
+        data={"client_ids": foreign_client_ids},
+        status="error",
+        message="Some clients belong to another seller.",
+        http_status=403,
+    )
+
+
+@user_passes_test(check_user_active)
+def verify_ticket_purchases(request):
+    """
+    Verifies the purchases of several clients in one transaction.
+
+    Args:
+        request (HttpRequest): The HTTP request, with the ``client_ids`` list
+            in its JSON body. A seller may only send its own clients.
+
+    Returns:
+        JsonResponse: One result per client ID.
+    """
+    client_ids = get_request_client_ids(request)
+    if client_ids is None:
+        return build_json_response(
+            data={}, status="error", message="client_ids must be a list of IDs."
+        )
+
+    rejection = reject_foreign_clients(request, client_ids)
+    if rejection:
+        return rejection
+
+    result = verify_clients(client_ids)
+    return build_json_response(
+        data={"results": result.as_results()},
+        message=f"{len(result.processed)} ticket purchases verified.",
+    )
+
+
+@user_passes_test(check_user_active)
+def decline_tickets(request):
+    """
+    Declines the tickets of several clients in one transaction.
+
+    Args:
+        request (HttpRequest): The HTTP request, with the ``client_ids`` list
+            in its JSON body. A seller may only send its own clients.
+
+    Returns:
+        JsonResponse: One result per client ID.
+    """
+    client_ids = get_request_client_ids(request)
+    if client_ids is None:
+        return build_json_response(
+            data={}, status="error", message="client_ids must be a list of IDs."
+        )
+
+    rejection = reject_foreign_clients(request, client_ids)
+    if rejection:
+        return rejection
+
+    result = decline_clients(client_ids)
+    return build_json_response(
+        data={"results": result.as_results()},
+        message=f"{len(result.processed)} tickets declined.",
+    )
+
+
+@user_passes_test(check_user_active)
+def get_ticket_owners(request, lottery_id):
+    """
+    Returns the sellers the given ticket numbers are assigned to.
+
+    The numbers are looked up in the cached assignment index of the lottery
+    instead of querying the assignments for every number.
+
+    Args:
+        request (HttpRequest): The HTTP request, with the comma separated
+            ``ticket_numbers`` to look up.
+        lottery_id (int): The ID of the lottery.
+
+    Returns:
+        JsonResponse: The owners of every number, an empty list when the
+        number is not assigned.
+    """
+    try:
+        ticket_numbers = [
+            int(ticket_number)
+            for ticket_number in request.GET.get("ticket_numbers", "").split(",")
+            if ticket_number
+        ]
+    except ValueError:
+        return build_json_response(
+            data={}, status="error", message="Invalid ticket numbers."
+        )
+
+    owners = get_assignment_index(lottery_id).get_owners(ticket_numbers)
+
+    seller_ids = {seller_id for sellers in owners.values() for seller_id in sellers}
+    usernames = dict(
+        models.User.objects.filter(id__in=seller_ids).values_list("id", "username")
+    )
+
+    return build_json_response(
+        data={
+            "lottery_id": lottery_id,
+            "owners": {
+                number: [
+                    {"id": seller_id, "username": usernames.get(seller_id)}
+                    for seller_id in sellers
+                ]
+                for number, sellers in owners.items()
+            },
+        }
+    )
+
+
 def get_tickets_to_assign(request):
     lottery_id = request.GET.get('lottery_id')
     tickets_selected = request.GET.get('tickets_selected', '')
@@ -0,0 +1,237 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import timedelta
+
+from django.db import close_old_connections, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from djangopwa import constants
+from djangopwa import models
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class QueueBatch:
+    events: int
+    done: int
+    retried: int
+    dead: int
+    seconds: float
+
+
+def enqueue_event(data):
+    """
+    Store a webhook event for the workers.
+
+    Only events whose signature was validated may be queued, the workers
+    trust them.
+
+    Args:
+        data (dict): The raw event, its signature already validated.
+
+    Returns:
+        models.WompiWebhookEvent: The queued event.
+    """
+    return models.WompiWebhookEvent.objects.create(
+        event=str(data.get("event", ""))[:64], payload=data
+    )
+
+
+def get_retry_delay(attempts):
+    """
+    Seconds to wait before the next attempt, doubled on every failure.
+    """
+    return min(
+        constants.WEBHOOK_EVENT_RETRY_SECONDS * 2 ** (attempts - 1),
+        constants.WEBHOOK_EVENT_MAX_BACKOFF_SECONDS,
+    )
+
+
+def claim_events(batch_size, now=None, event_filter=None):
+    """
+    Claim a batch of due events for this worker.
+
+    The rows are locked with SKIP LOCKED, so several workers share the queue
+    without claiming the same event. Events claimed by a worker that died
+    are claimed again after the processing timeout.
+
+    Args:
+        batch_size (int): Maximum number of events claimed.
+        now (datetime, optional): The time the events must be due by.
+        event_filter (Q, optional): Only claim the events that match it.
+
+    Returns:
+        list: The claimed models.WompiWebhookEvent, with their attempt counted.
+    """
+    now = now or timezone.now()
+    stale_before = now - timedelta(
+        seconds=constants.WEBHOOK_EVENT_PROCESSING_TIMEOUT_SECONDS)
+
+    events = models.WompiWebhookEvent.objects.all()
+    if event_filter is not None:
+        events = events.filter(event_filter)
+
+    with transaction.atomic():
+        event_ids = list(
+            events.select_for_update(skip_locked=True)
+            .filter(
+                Q(
+                    state=constants.WebhookEventState.PENDING,
+                    next_attempt_at__lte=now,
+                )
+                | Q(
+                    state=constants.WebhookEventState.PROCESSING,
+                    locked_at__lt=stale_before,
+                )
+            )
+            .order_by("next_attempt_at")
+            .values_list("id", flat=True)[:batch_size]
+        )
+        if not event_ids:
+            return []
+
+        models.WompiWebhookEvent.objects.filter(id__in=event_ids).update(
+            state=constants.WebhookEventState.PROCESSING,
+            locked_at=now,
+            attempts=F("attempts") + 1,
+        )
+        return list(
+            models.WompiWebhookEvent.objects.filter(id__in=event_ids).order_by("id")
+        )
+
+
+def finish_event(event, **fields):
+    # Only the claim that is still current may close the event
+    return models.WompiWebhookEvent.objects.filter(
+        id=event.id,
+        state=constants.WebhookEventState.PROCESSING,
+        locked_at=event.locked_at,
+    ).update(**fields)
+
+
+def record_failure(event, error):
+    if event.attempts >= constants.WEBHOOK_EVENT_MAX_ATTEMPTS:
+        state = constants.WebhookEventState.DEAD
+    else:
+        state = constants.WebhookEventState.PENDING
+    finish_event(
+        event,
+        state=state,
+        next_attempt_at=timezone.now() + timedelta(
+            seconds=get_retry_delay(event.attempts)),
+        locked_at=None,
+        last_error=repr(error),
+    )
+    return state
+
+
+def run_event(handler, event):
+    """
+    Process one claimed event and record the outcome.
+
+    Returns:
+        int: The state the event was left in. An event whose outcome could
+        not be recorded stays PROCESSING and is claimed again after the
+        processing timeout.
+    """
+    close_old_connections()
+    try:
+        try:
+            response = handler(event.payload)
+        except Exception as error:
+            logger.exception("Webhook event %s failed", event.id)
+            return record_failure(event, error)
+
+        message = response.get("message", "") if isinstance(response, dict) else ""
+        finish_event(
+            event,
+            state=constants.WebhookEventState.DONE,
+            processed_at=timezone.now(),
+            locked_at=None,
+            result=str(message)[:200],
+        )
+        return constants.WebhookEventState.DONE
+    except Exception:
+        logger.exception("Could not record the outcome of webhook event %s", event.id)
+        return constants.WebhookEventState.PROCESSING
+    finally:
+        close_old_connections()
+
+
+def process_event_batch(handler, executor, batch_size, event_filter=None):
+    """
+    Claim one batch of events and process it on the executor threads.
+
+    Returns:
+        QueueBatch: The statistics of the batch, None when nothing was due.
+    """
+    started_at = time.monotonic()
+    events = claim_events(batch_size, event_filter=event_filter)
+    if not events:
+        return None
+
+    states = list(executor.map(lambda event: run_event(handler, event), events))
+    batch = QueueBatch(
+        events=len(events),
+        done=states.count(constants.WebhookEventState.DONE),
+        retried=states.count(constants.WebhookEventState.PENDING),
+        dead=states.count(constants.WebhookEventState.DEAD),
+        seconds=time.monotonic() - started_at,
+    )
+    logger.info(
+        "Processed %s webhook events (%s done, %s retried, %s dead) in %.3fs",
+        batch.events,
+        batch.done,
+        batch.retried,
+        batch.dead,
+        batch.seconds,
+    )
+    return batch
+
+
+def process_events(
+    handler,
+    batch_size=constants.WEBHOOK_QUEUE_BATCH_SIZE,
+    workers=4,
+    event_filter=None,
+    executor_class=ThreadPoolExecutor,
+):
+    """
+    Process the due events in batches until the queue is drained.
+
+    Args:
+        handler (callable): Called with the payload of every event.
+        batch_size (int): Events claimed per batch.
+        workers (int): Threads processing the events of a batch.
+        event_filter (Q, optional): Only process the events that match it.
+        executor_class (type): The executor running the batches.
+
+    Yields:
+        QueueBatch: The statistics of every processed batch.
+    """
+    with executor_class(max_workers=workers) as executor:
+        while True:
+            batch = process_event_batch(handler, executor, batch_size, event_filter)
+            if batch is None:
+                return
+            yield batch
+
+
+def requeue_dead_events():
+    """
+    Give the dead events a new round of attempts.
+
+    Returns:
+        int: The number of requeued events.
+    """
+    return models.WompiWebhookEvent.objects.filter(
+        state=constants.WebhookEventState.DEAD
+    ).update(
+        state=constants.WebhookEventState.PENDING,
+        attempts=0,
+        next_attempt_at=timezone.now(),
+    )
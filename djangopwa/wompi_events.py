@@ -0,0 +1,113 @@
+from django.utils import timezone
+
+from djangopwa.wompi_webhook import generate_sha256_hash
+from lottery.wompi import wompi
+
+
+SIGNED_PROPERTIES = (
+    "transaction.id",
+    "transaction.status",
+    "transaction.amount_in_cents",
+)
+
+
+def generate_transaction_id(rng):
+    return f"{rng.randint(10000, 99999)}-{rng.getrandbits(64):016x}"
+
+
+def build_transaction(reference, status, amount_in_cents, transaction_id,
+                      finalized_at=None):
+    return {
+        "id": transaction_id,
+        "status": status,
+        "reference": reference,
+        "finalized_at": (finalized_at or timezone.now()).isoformat(),
+        "payment_method": {"type": "CARD"},
+        "amount_in_cents": amount_in_cents,
+    }
+
+
+def sign_transaction_event(transaction_data, timestamp=None, events_key=None):
+    """
+    Build a ``transaction.updated`` event signed the way Wompi signs it.
+
+    Args:
+        transaction_data (dict): The transaction, see build_transaction.
+        timestamp (int, optional): Defaults to now.
+        events_key (str, optional): Defaults to the configured events key.
+
+    Returns:
+        dict: The event, accepted by validate_signature_hash256.
+    """
+    timestamp = int(timezone.now().timestamp()) if timestamp is None else timestamp
+    events_key = wompi.credentials.events_key if events_key is None else events_key
+
+    values = {
+        "transaction.id": transaction_data["id"],
+        "transaction.status": transaction_data["status"],
+        "transaction.amount_in_cents": transaction_data["amount_in_cents"],
+    }
+    checksum = generate_sha256_hash(
+        "".join(str(values[name]) for name in SIGNED_PROPERTIES)
+        + str(timestamp)
+        + events_key
+    )
+
+    return {
+        "event": "transaction.updated",
+        "data": {"transaction": transaction_data},
+        "environment": "test",
+        "signature": {"properties": list(SIGNED_PROPERTIES), "checksum": checksum},
+        "timestamp": timestamp,
+        "sent_at": timezone.now().isoformat(),
+    }
+
+
+def generate_reference_events(reference, amount_in_cents, rng, retry_ratio=0.2,
+                              out_of_order_ratio=0.1, declined_ratio=0.1):
+    """
+    Generate the deliveries Wompi could send for one purchase reference.
+
+    A declined attempt may come first, the PENDING status of the paying
+    transaction may arrive after its APPROVED status, and any delivery may
+    be repeated as Wompi does when it retries.
+
+    Args:
+        reference (str): The purchase reference.
+        amount_in_cents (int): The amount of the purchase.
+        rng (random.Random): The source of randomness, for repeatable runs.
+
+    Returns:
+        list: The signed events, in delivery order.
+    """
+    events = []
+    if rng.random() < declined_ratio:
+        events.append(
+            sign_transaction_event(
+                build_transaction(
+                    reference,
+                    "DECLINED",
+                    amount_in_cents,
+                    transaction_id=generate_transaction_id(rng),
+                )
+            )
+        )
+
+    transaction_id = generate_transaction_id(rng)
+    statuses = ["PENDING", "APPROVED"]
+    if rng.random() < out_of_order_ratio:
+        statuses.reverse()
+    for status in statuses:
+        events.append(
+            sign_transaction_event(
+                build_transaction(
+                    reference, status, amount_in_cents, transaction_id=transaction_id)
+            )
+        )
+
+    deliveries = []
+    for event in events:
+        deliveries.append(event)
+        while rng.random() < retry_ratio:
+            deliveries.append(event)
+    return deliveries
@@ -0,0 +1,91 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class FakeWompiServer:
+    """
+    Local stand-in of the Wompi transactions API, for tests and offline runs
+    of the reconciliation.
+
+    Serves ``GET /transactions?reference=...`` from the ``transactions``
+    dict, keyed by purchase reference, on a free local port.
+
+    Usage:
+        with FakeWompiServer() as server:
+            server.add_transaction({...})
+            client = WompiTransactionsClient(base_url=server.url)
+
+    Args:
+        latency (float): Seconds every response is delayed, to simulate the
+            network.
+    """
+
+    def __init__(self, latency=0):
+        self.latency = latency
+        self.transactions = {}
+        self.requests = 0
+        self.lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), self.build_handler())
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def add_transaction(self, transaction_data):
+        self.transactions.setdefault(transaction_data["reference"], []).append(
+            transaction_data
+        )
+
+    def build_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                with server.lock:
+                    server.requests += 1
+                if server.latency:
+                    time.sleep(server.latency)
+
+                if url.path.rstrip("/") != "/transactions":
+                    self.send_json(404, {"error": {"type": "NOT_FOUND_ERROR"}})
+                    return
+
+                reference = parse_qs(url.query).get("reference", [""])[0]
+                self.send_json(200, {"data": server.transactions.get(reference, [])})
+
+            def send_json(self, status, data):
+                body = json.dumps(data).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -0,0 +1,177 @@
+import logging
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from itertools import islice
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from django.db.models import Q
+
+from djangopwa import constants
+from djangopwa import models
+from djangopwa.wompi_webhook import ingest_transaction
+from lottery.wompi import wompi
+
+logger = logging.getLogger(__name__)
+
+
+class WompiTransactionsClient:
+    """
+    Reads the transactions of a purchase reference from the Wompi API.
+
+    The requests share a pooled session with one keep-alive connection per
+    worker thread, and the transient errors are retried with backoff.
+    Any object with the same ``get_transactions`` and ``close`` methods can
+    be passed to the reconciliation instead.
+
+    Args:
+        base_url (str, optional): The API URL including its version,
+            defaults to the configured WOMPI_BASE_API_URL.
+        private_key (str, optional): Defaults to the configured key.
+        max_connections (int): Size of the connection pool.
+        timeout (float): Seconds to wait for each response.
+    """
+
+    def __init__(self, base_url=None, private_key=None, max_connections=10, timeout=10):
+        self.base_url = (base_url or wompi.base_url).rstrip("/")
+        self.timeout = timeout
+
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=max_connections,
+            max_retries=Retry(
+                total=3,
+                backoff_factor=0.5,
+                status_forcelist=(429, 500, 502, 503, 504),
+                allowed_methods=("GET",),
+            ),
+        )
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers["Authorization"] = (
+            f"Bearer {private_key or wompi.credentials.private_key}"
+        )
+
+    def get_transactions(self, reference):
+        response = self.session.get(
+            f"{self.base_url}/transactions",
+            params={"reference": reference},
+            timeout=self.timeout,
+        )
+        response.raise_for_status()
+        return response.json().get("data", [])
+
+    def close(self):
+        self.session.close()
+
+
+@dataclass
+class ReconciliationReport:
+    references: int = 0
+    transactions: int = 0
+    ingested: int = 0
+    failed_references: list = field(default_factory=list)
+    seconds: float = 0
+
+    @property
+    def references_per_second(self):
+        return self.references / self.seconds if self.seconds else 0
+
+
+def get_pending_references():
+    """
+    Get the purchase references with reserved tickets whose payment was
+    never approved through the webhook.
+
+    Returns:
+        list: The purchase references.
+    """
+    approved_references = models.WompiTransactionEvent.objects.filter(
+        status="APPROVED"
+    ).values("purchase_reference")
+
+    return list(
+        models.ClientInfo.objects.filter(
+            ticket_number__state=constants.TicketState.RESERVED
+        )
+        .exclude(Q(purchase_reference__isnull=True) | Q(purchase_reference=""))
+        .exclude(purchase_reference__in=approved_references)
+        .values_list("purchase_reference", flat=True)
+        .distinct()
+        .order_by("purchase_reference")
+    )
+
+
+def reconcile_references(client, references, concurrency=10, dry_run=False):
+    """
+    Query the status of the references and ingest the missing transactions.
+
+    The API is queried from ``concurrency`` threads at most, while the
+    transactions are ingested from the calling thread as the responses
+    arrive, through the same idempotent path as the webhook. A new
+    reference is submitted as each response arrives, so no more than
+    WOMPI_RECONCILIATION_REQUESTS_PER_WORKER requests per thread wait for
+    a thread however many references there are.
+
+    Args:
+        client: A WompiTransactionsClient or a stand-in with the same methods.
+        references (list): The purchase references to reconcile.
+        concurrency (int): Maximum number of requests in flight.
+        dry_run (bool): Only count the transactions found.
+
+    Returns:
+        ReconciliationReport: The counts and the throughput of the run.
+    """
+    report = ReconciliationReport(references=len(references))
+    started_at = time.monotonic()
+    unsubmitted = iter(references)
+    futures = {}
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+
+        def submit(count):
+            for reference in islice(unsubmitted, count):
+                futures[executor.submit(client.get_transactions, reference)] = reference
+
+        submit(concurrency * constants.WOMPI_RECONCILIATION_REQUESTS_PER_WORKER)
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                ingest_reference(report, futures.pop(future), future, dry_run)
+            submit(len(done))
+
+    report.seconds = time.monotonic() - started_at
+    return report
+
+
+def ingest_reference(report, reference, future, dry_run):
+    """
+    Ingest the transactions read for a reference and count them.
+
+    A reference that cannot be read or ingested is logged and reported as
+    failed, the run goes on with the others.
+    """
+    try:
+        transactions = future.result()
+    except Exception as error:
+        logger.warning("Could not read the transactions of %s: %s",
+                       reference, error)
+        report.failed_references.append(reference)
+        return
+
+    report.transactions += len(transactions)
+    if dry_run:
+        return
+
+    try:
+        for transaction_data in transactions:
+            response = ingest_transaction(transaction_data)
+            if response["message"] == "Transaction updated successfully":
+                report.ingested += 1
+    except Exception:
+        logger.exception("Could not ingest the transactions of %s", reference)
+        report.failed_references.append(reference)
@@ -2,12 +2,16 @@ from . import models
 import hashlib
 import logging
 
+from django.db import IntegrityError, transaction
 from django.http import HttpRequest, HttpResponseBadRequest, JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.dateparse import parse_datetime
 
 import json
 
+from djangopwa.payment_bulk import bulk_create_payments
+from djangopwa.purchase_verification import verify_paid_purchases
+from djangopwa.webhook_queue import enqueue_event
 from lottery.wompi import wompi
 
 logger = logging.getLogger(__name__)
@@ -75,8 +79,20 @@ def transaction_updated_event(data):
         logger.error("Transaction update event failed due to invalid signature")
         return {"message": "ERROR: Could not validate signature"}
 
-    transaction_data = data["data"]["transaction"]
+    return ingest_transaction(data["data"]["transaction"])
 
+
+def ingest_transaction(transaction_data):
+    """
+    Apply a Wompi transaction once, whether it came from the webhook or
+    from the reconciliation job.
+
+    Args:
+        transaction_data (dict): The transaction as sent by Wompi.
+
+    Returns:
+        dict: The outcome message.
+    """
     if not all(key in transaction_data for key in ["id", "status", "reference", "finalized_at", "payment_method", "amount_in_cents"]):
         logger.error("Incomplete transaction data")
         return {"message": "ERROR: Incomplete transaction data"}
@@ -85,12 +101,49 @@ def transaction_updated_event(data):
     transaction_status = transaction_data["status"]
     purchase_reference = transaction_data["reference"]
 
+    # Retried deliveries are acknowledged with this single indexed lookup
+    if models.WompiTransactionEvent.objects.filter(
+        transaction_id=transaction_id, status=transaction_status
+    ).exists():
+        logger.info("Transaction %s (%s) already processed",
+                    transaction_id, transaction_status)
+        return {"message": "Transaction already processed"}
+
+    # The event is recorded in the transaction that applies it, a failure
+    # leaves it unrecorded for the next retry
+    with transaction.atomic():
+        try:
+            with transaction.atomic():
+                models.WompiTransactionEvent.objects.create(
+                    transaction_id=transaction_id,
+                    status=transaction_status,
+                    purchase_reference=purchase_reference,
+                )
+        except IntegrityError:
+            # A concurrent delivery of the same event recorded it first
+            logger.info("Transaction %s (%s) already processed",
+                        transaction_id, transaction_status)
+            return {"message": "Transaction already processed"}
+
+        return apply_transaction_update(transaction_data)
+
+
+def apply_transaction_update(transaction_data):
+    transaction_id = transaction_data["id"]
+    transaction_status = transaction_data["status"]
+    purchase_reference = transaction_data["reference"]
+
     if transaction_status != "APPROVED":
         return {"message": "Transaction declined"}
 
-    clients = models.ClientInfo.objects.filter(purchase_reference=purchase_reference)
+    # The seller of every client is read by the same query
+    clients = list(
+        models.ClientInfo.objects.filter(purchase_reference=purchase_reference)
+        .select_related("seller")
+        .order_by("id")
+    )
 
-    if not clients.exists():
+    if not clients:
         return {"message": "No clients found for the given purchase reference"}
 
     finalized_at_datetime = parse_datetime(transaction_data["finalized_at"])
@@ -99,10 +152,6 @@ def transaction_updated_event(data):
     amount_in_pesos = Decimal(amount_in_cents) / 100
 
     num_clients = len(clients)
-    
-    if num_clients == 0:
-        logger.error("No clients found for the given purchase reference")
-        return {"message": "No clients to distribute the payment"}
 
     # Calculate base amount per client
     base_amount_per_client = amount_in_pesos / num_clients
@@ -114,6 +163,7 @@ def transaction_updated_event(data):
     # Calculate the difference and distribute it
     difference = amount_in_pesos - total_distributed
 
+    payments = []
     # Allocate the difference to the last client
     for index, client in enumerate(clients):
         if index == num_clients - 1:  # Last client
@@ -121,17 +171,28 @@ def transaction_updated_event(data):
         else:
             payment_amount = base_amount_per_client
 
-        payment = models.Payment(
-            seller=client.seller,
-            client=client,
-            date=finalized_at_datetime,
-            payment_type="BONO1",
-            transaction_id=transaction_id,
-            purchase_reference=purchase_reference,
-            payment_method=payment_method,
-            amount=payment_amount
+        payments.append(
+            models.Payment(
+                seller=client.seller,
+                client=client,
+                date=finalized_at_datetime,
+                payment_type="BONO1",
+                transaction_id=transaction_id,
+                purchase_reference=purchase_reference,
+                payment_method=payment_method,
+                amount=payment_amount
+            )
         )
-        payment.save()
+
+    # One insert for every ticket of the purchase, in the event transaction
+    bulk_create_payments(payments)
+
+    # A reference paid in full needs no verification by an admin
+    verification = verify_paid_purchases(
+        [purchase_reference], transaction_id=transaction_id)
+    if verification.processed:
+        logger.info("Verified %s tickets of purchase %s",
+                    len(verification.processed), purchase_reference)
 
     return {"message": "Transaction updated successfully"}
 
@@ -142,8 +203,27 @@ def process_event(data):
     return {"message": "No valid event found"}
 
 
+def process_queued_event(data):
+    """
+    Process an event of the webhook queue.
+
+    The webhook only queues the events whose signature it validated, so it
+    is not checked again: after a rotation of the events key the old
+    signatures would fail and valid events would end up DEAD.
+    """
+    if data.get("event") == "transaction.updated":
+        return ingest_transaction(data["data"]["transaction"])
+    return {"message": "No valid event found"}
+
+
 @csrf_exempt
 def wompi_webhook(request):
+    """
+    Validate the signature of a Wompi event and queue it.
+
+    The event is processed by the process_webhook_events worker, so the
+    response does not wait for the payments to be written.
+    """
     if request.method != "POST":
         logger.warning("Received a non-POST request: %s", request.method)
         return HttpResponseBadRequest("Only POST requests are allowed.")
@@ -153,12 +233,15 @@ def wompi_webhook(request):
     try:
         data = json.loads(request.body)
 
-        response = process_event(data)
-        if isinstance(response, dict) and "message" in response:
-            return JsonResponse(response)
+        if not isinstance(data, dict) or data.get("event") != "transaction.updated":
+            return JsonResponse({"message": "No valid event found"})
+
+        if not validate_signature_hash256(data):
+            logger.error("Webhook event rejected due to invalid signature")
+            return JsonResponse({"message": "ERROR: Could not validate signature"})
 
-        logger.warning("No valid response from process_event")
-        return JsonResponse({"message": "Event processed but no valid response"}, status=500)
+        event = enqueue_event(data)
+        return JsonResponse({"message": "Event queued", "event_id": event.id})
 
     except json.JSONDecodeError:
         logger.error("Error decoding JSON: %s", request.body)
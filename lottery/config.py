@@ -16,7 +16,10 @@ class Config:
         self.config.read(self.config_file)
         self.environment = self.get("env", "ENVIRONMENT")
 
-    def get(self, category, varname):
+    def get(self, category, varname, fallback=None):
+        # Optional settings pass a fallback, the others must be configured
+        if fallback is not None and not self.config.has_option(category, varname):
+            return fallback
         return self.config.get(category, varname).replace('"', "")
 
 
@@ -15,7 +15,7 @@ from djangopwa.cloudinary import config_cloudinary
 import os
 
 from lottery import wompi
-from lottery.config import BASE_DIR
+from lottery.config import BASE_DIR, config
 
 LANGUAGE_CODE = "es-ES"
 USE_I18N = True
@@ -235,6 +235,29 @@ DATABASES = {
     }
 }
 
+# Cache used by the ticket availability index, the roulette sampler, the
+# checkout holds and the assignment index. LocMemCache is private to each
+# process, so as soon as more than one worker process serves the site, even
+# on a single host, the holds and indexes diverge between workers. Set
+# REDIS_URL in the [cache] section of .config to share them.
+CACHE_REDIS_URL = config.get("cache", "REDIS_URL", fallback="")
+if CACHE_REDIS_URL:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": CACHE_REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "LOCATION": "lottery",
+            # Room for a hold per ticket number besides the per-lottery entries
+            "OPTIONS": {"MAX_ENTRIES": 100_000},
+        }
+    }
+
 # PostgreSQL Database config
 # DATABASES = {
 #     "default": {